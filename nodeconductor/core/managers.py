@@ -1,10 +1,18 @@
+import collections
 import copy
 import functools
+import hashlib
 import heapq
 import itertools
 
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, FieldError
+from django.db import connections, models
+from django.db.models.functions import Lower
+from django.db.models.sql import EmptyResultSet
+from django.utils.encoding import smart_str
 
 
 class GenericKeyMixin(object):
@@ -104,24 +112,192 @@ class SummaryQuerySet(object):
             return
 
     def __getitem__(self, val):
-        chained_querysets = self._get_chained_querysets()
         if isinstance(val, slice):
-            return list(itertools.islice(chained_querysets, val.start, val.stop))
+            if val.stop is None or val.step is not None:
+                return list(itertools.islice(self._get_chained_querysets(), val.start, val.stop, val.step))
+            return self._get_page(val.start or 0, val.stop)
         else:
             try:
-                return itertools.islice(chained_querysets, val, val + 1).next()
-            except StopIteration:
-                raise IndexError
+                return self._get_page(val, val + 1)[0]
+            except IndexError:
+                raise IndexError('SummaryQuerySet index out of range')
+
+    def __iter__(self):
+        return self._get_chained_querysets()
 
     def __len__(self):
-        return sum([q.count() for q in self.querysets])
+        timeout = settings.NODECONDUCTOR.get('SUMMARY_COUNT_CACHE_TIMEOUT')
+        if not timeout:
+            return sum(self.get_counts())
 
-    def _get_chained_querysets(self):
+        # Total count could be slightly outdated, but it allows to skip counting on each page request.
+        sql, params = self._get_counts_query()
+        key = 'summary_count_%s' % hashlib.md5(smart_str(sql) + smart_str(params)).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = sum(self.get_counts())
+            cache.set(key, count, timeout)
+        return count
+
+    def get_counts(self):
+        """ Return number of objects in each queryset, all of them are counted by single query """
+        sql, params = self._get_counts_query()
+        counts = [0] * len(self.querysets)
+        if sql:
+            with connections[self.querysets[0].db].cursor() as cursor:
+                cursor.execute(sql, params)
+                for index, count in cursor.fetchall():
+                    counts[index] = count
+        return counts
+
+    def _get_counts_query(self):
+        """ Combine COUNT queries of all querysets using UNION ALL """
+        subqueries = []
+        params = []
+        for index, qs in enumerate(self.querysets):
+            try:
+                sql, qs_params = qs.order_by().values_list('pk').query.sql_with_params()
+            except EmptyResultSet:
+                continue
+            subqueries.append('SELECT %d AS summary_index, COUNT(*) AS summary_count FROM (%s) summary_%d' % (
+                index, sql, index))
+            params.extend(qs_params)
+        return ' UNION ALL '.join(subqueries), params
+
+    def _get_order_by(self):
+        """ Return ordering that is shared by all querysets or None if querysets are not ordered uniformly """
         if self._order_by:
-            return self._merge([qs.iterator() for qs in self.querysets], compared_attr=self._order_by)
+            return [self._order_by]
+        orderings = set(tuple(qs.query.order_by) for qs in self.querysets)
+        if len(orderings) != 1:
+            return None
+        ordering = orderings.pop()
+        if ordering and all(isinstance(field, basestring) for field in ordering):
+            return list(ordering)
+
+    def _get_chained_querysets(self):
+        order_by = self._get_order_by()
+        if order_by:
+            return self._merge([qs.iterator() for qs in self.querysets], compared_attr=order_by[0])
         else:
             return itertools.chain(*[qs.iterator() for qs in self.querysets])
 
+    def _get_page(self, start, stop):
+        """ Return objects from [start, stop) range, only objects of this range are fetched from database """
+        if start >= stop or not self.querysets:
+            return []
+
+        order_by = self._get_order_by()
+        if not order_by:
+            return self._get_chained_page(start, stop)
+
+        try:
+            keys = self._get_ordered_keys(order_by, start, stop)
+        except FieldError:
+            # Ordering is not expressible as model fields (for example, it is based on extra select).
+            return list(itertools.islice(self._get_chained_querysets(), start, stop))
+        return self._get_objects_by_keys(keys)
+
+    def _get_chained_page(self, start, stop):
+        """ Slice unordered querysets one after another using their counts as offsets """
+        page = []
+        for qs, count in zip(self.querysets, self.get_counts()):
+            if stop <= 0:
+                break
+            if start < count:
+                if not qs.ordered:
+                    qs = qs.order_by('pk')
+                page.extend(qs[start:stop])
+            start = max(start - count, 0)
+            stop -= count
+        return page
+
+    def _get_ordered_keys(self, order_by, start, stop):
+        """ Return (queryset index, primary key) pairs of objects from [start, stop) range.
+
+            Each queryset is projected to its primary key and ordering columns. Projections are
+            combined with UNION ALL, so that ordering, offset and limit are applied by database.
+            Strings are compared case-insensitively. Paths through multi-valued relations
+            are ordered by minimal value, so each object is projected once.
+        """
+        fields = [(field[1:], 'DESC') if field.startswith('-') else (field, 'ASC') for field in order_by]
+        keys = ['summary_key_%d' % index for index in range(len(fields))]
+        columns = ', '.join(['summary_pk'] + keys)
+
+        subqueries = []
+        params = []
+        for index, qs in enumerate(self.querysets):
+            annotations = {}
+            is_grouped = False
+            for key, (field, _) in zip(keys, fields):
+                model_field, is_multivalued = self._get_order_field(qs.model, field)
+                expression = models.F(field)
+                if isinstance(model_field, (models.CharField, models.TextField)):
+                    expression = Lower(expression)
+                if is_multivalued:
+                    expression = models.Min(expression)
+                    is_grouped = True
+                annotations[key] = expression
+            projection = qs.order_by()
+            if is_grouped:
+                projection = projection.values('pk')
+            projection = projection.annotate(summary_pk=models.F('pk'), **annotations).values_list('summary_pk', *keys)
+            try:
+                sql, qs_params = projection.query.sql_with_params()
+            except EmptyResultSet:
+                continue
+            subqueries.append('SELECT %d AS summary_index, %s FROM (%s) summary_%d' % (index, columns, sql, index))
+            params.extend(qs_params)
+
+        if not subqueries:
+            return []
+
+        ordering = []
+        for key, (_, direction) in zip(keys, fields):
+            # In MySQL NULL values come *first* with ascending sort order.
+            # We use the same behaviour for all databases.
+            ordering.append('CASE WHEN %s IS NULL THEN 0 ELSE 1 END %s' % (key, direction))
+            ordering.append('%s %s' % (key, direction))
+        ordering.extend(['summary_index', 'summary_pk'])
+
+        sql = 'SELECT summary_index, summary_pk FROM (%s) summary ORDER BY %s LIMIT %d OFFSET %d' % (
+            ' UNION ALL '.join(subqueries), ', '.join(ordering), stop - start, start)
+
+        with connections[self.querysets[0].db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    @staticmethod
+    def _get_order_field(model, path):
+        """ Return model field of ordering path and True if path goes through multi-valued relation """
+        field = None
+        is_multivalued = False
+        for name in path.split('__'):
+            if field is not None:
+                model = field.related_model
+            if model is None:
+                raise FieldError('Cannot resolve ordering path %s.' % path)
+            try:
+                field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            except FieldDoesNotExist as e:
+                raise FieldError(e)
+            if field.many_to_many or field.one_to_many:
+                is_multivalued = True
+        return field, is_multivalued
+
+    def _get_objects_by_keys(self, keys):
+        """ Fetch objects for (queryset index, primary key) pairs preserving their order """
+        pks = collections.defaultdict(list)
+        for index, pk in keys:
+            pks[index].append(pk)
+
+        objects = {}
+        for index, index_pks in pks.items():
+            for obj in self.querysets[index].order_by().filter(pk__in=index_pks):
+                objects[index, obj.pk] = obj
+
+        return [objects[key] for key in keys if key in objects]
+
     def _merge(self, subsequences, compared_attr='pk'):
 
         @functools.total_ordering
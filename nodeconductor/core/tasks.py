@@ -9,6 +9,7 @@ import sys
 from celery import current_task, Task as CeleryTask
 from celery.execute import send_task as send_celery_task
 from celery.exceptions import MaxRetriesExceededError
+from celery.utils import uuid
 from celery.worker.job import Request
 from django.core.cache import cache
 from django.db import transaction, IntegrityError, models as django_models
@@ -121,7 +122,7 @@ def retry_if_false(func):
     return wrapped
 
 
-def send_task(app_label, task_name):
+def send_task(app_label, task_name, countdown=2):
     """ A helper function to deal with nodeconductor "high-level" tasks.
         Define high-level task with explicit name using a pattern:
         nodeconductor.<app_label>.<task_name>
@@ -141,11 +142,12 @@ def send_task(app_label, task_name):
         .. code-block:: python
             provision_instance_fn.delay(instance_uuid, backend_flavor_id)
 
+        Task is executed not earlier than in "countdown" seconds.
     """
 
     def delay(*args, **kwargs):
         full_task_name = 'nodeconductor.%s.%s' % (app_label, task_name)
-        send_celery_task(full_task_name, args, kwargs, countdown=2)
+        send_celery_task(full_task_name, args, kwargs, countdown=countdown)
 
     return delay
 
@@ -396,26 +398,90 @@ class BackgroundTask(CeleryTask):
 
         Background task features:
          - background task does not start if previous task with the same name
-           and input parameters is not completed yet;
+           and input parameters is not completed yet. Scheduled task holds lock
+           in cache, lock is released when task succeeds or fails and expires
+           after LOCK_TIMEOUT if task has been lost;
          - all background tasks are scheduled in separate queue "background";
          - by default we do not log background tasks in celery logs. So tasks
            should log themselves explicitly and make sure that they will not
            spam error messages.
 
-        Implement "is_equal" method to define what tasks are equal and should
-        be executed simultaneously.
+        Override "get_lock_key" method to define what tasks are equal and should
+        not be executed simultaneously. Tasks that implement deprecated "is_equal"
+        method instead are still checked against tasks of celery workers, but
+        this requires inspect broadcast to all workers on each schedule.
     """
     is_background = True
+    LOCK_TIMEOUT = 60 * 60
+    _warned_is_equal_classes = set()
 
-    def is_equal(self, other_task, *args, **kwargs):
-        """ Return True if task do the same operation as other_task.
-
-            Note! Other task is represented as serialized celery task - dictionary.
-        """
-        raise NotImplementedError('BackgroundTask should implement "is_equal" method to avoid queue overload.')
+    def get_lock_key(self, *args, **kwargs):
+        """ Return cache key that is the same for tasks that do the same operation """
+        # Arguments that are not JSON serializable are represented by repr.
+        hash_input = json.dumps({'name': self.name, 'args': args, 'kwargs': kwargs}, sort_keys=True, default=repr)
+        # md5 is used for internal caching, not need to care about security
+        return 'background_task_lock_%s' % hashlib.md5(hash_input).hexdigest()  # nosec
 
     def is_previous_task_processing(self, *args, **kwargs):
         """ Return True if exist task that is equal to current and is uncompleted """
+        if self._uses_is_equal():
+            return self._is_equal_task_inspected(*args, **kwargs)
+        return cache.get(self.get_lock_key(*args, **kwargs)) is not None
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        """ Do not run background task if previous task is uncompleted """
+        if self._uses_is_equal():
+            if self._is_equal_task_inspected(*(args or ()), **(kwargs or {})):
+                self._log_not_scheduled()
+                return
+            return super(BackgroundTask, self).apply_async(args=args, kwargs=kwargs, **options)
+
+        lock_key = self.get_lock_key(*(args or ()), **(kwargs or {}))
+        task_id = options.setdefault('task_id', uuid())
+        if not cache.add(lock_key, task_id, self.LOCK_TIMEOUT):
+            # Retry is published with ID of the task that already holds the lock.
+            if cache.get(lock_key) != task_id:
+                self._log_not_scheduled()
+                return
+            cache.set(lock_key, task_id, self.LOCK_TIMEOUT)
+        try:
+            return super(BackgroundTask, self).apply_async(args=args, kwargs=kwargs, **options)
+        except Exception:
+            cache.delete(lock_key)
+            raise
+
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        """ Release lock when task succeeds or fails. Lock is kept while task is retried. """
+        if not self._uses_is_equal():
+            lock_key = self.get_lock_key(*(args or ()), **(kwargs or {}))
+            # Lock could expire and be taken by the next task, it should not be released.
+            if cache.get(lock_key) == task_id:
+                cache.delete(lock_key)
+        return super(BackgroundTask, self).after_return(status, retval, task_id, args, kwargs, einfo)
+
+    def _log_not_scheduled(self):
+        message = 'Background task %s was not scheduled, because its predecessor is not completed yet.' % self.name
+        logger.info(message)
+
+    def _uses_is_equal(self):
+        if not callable(getattr(self, 'is_equal', None)):
+            return False
+        # Warn once per task class, not on each schedule.
+        if type(self) not in self._warned_is_equal_classes:
+            self._warned_is_equal_classes.add(type(self))
+            import warnings
+
+            warnings.warn(
+                'is_equal() of background task %s is deprecated. Override get_lock_key() instead.' % self.name,
+                DeprecationWarning,
+            )
+        return True
+
+    def _is_equal_task_inspected(self, *args, **kwargs):
+        """ Check tasks of all celery workers by deprecated "is_equal" method.
+
+            Note! Other task is represented as serialized celery task - dictionary.
+        """
         app = self._get_app()
         inspect = app.control.inspect()
         active = inspect.active() or {}
@@ -424,14 +490,6 @@ class BackgroundTask(CeleryTask):
         uncompleted = sum(active.values() + scheduled.values() + reserved.values(), [])
         return any(self.is_equal(task, *args, **kwargs) for task in uncompleted)
 
-    def apply_async(self, args=None, kwargs=None, **options):
-        """ Do not run background task if previous task is uncompleted """
-        if self.is_previous_task_processing(*args, **kwargs):
-            message = 'Background task %s was not scheduled, because its predecessor is not completed yet.' % self.name
-            logger.info(message)
-            return
-        return super(BackgroundTask, self).apply_async(args=args, kwargs=kwargs, **options)
-
 
 class PenalizedBackgroundTask(BackgroundTask):
     """
@@ -458,7 +516,8 @@ class PenalizedBackgroundTask(BackgroundTask):
 
     def _get_cache_key(self, args, kwargs):
         """ Returns key to be used in cache """
-        hash_input = json.dumps({'name': self.name, 'args': args, 'kwargs': kwargs}, sort_keys=True)
+        # Arguments that are not JSON serializable are represented by repr.
+        hash_input = json.dumps({'name': self.name, 'args': args, 'kwargs': kwargs}, sort_keys=True, default=repr)
         # md5 is used for internal caching, not need to care about security
         return hashlib.md5(hash_input).hexdigest()  # nosec
 
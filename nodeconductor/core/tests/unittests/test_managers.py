@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase
+
+from nodeconductor.core.managers import SummaryQuerySet
+from nodeconductor.logging import models as logging_models
+from nodeconductor.logging.tests import factories as logging_factories
+from nodeconductor.structure.tests import factories as structure_factories
+
+
+class SummaryQuerySetTest(TestCase):
+
+    def setUp(self):
+        self.hooks = []
+        for index, username in enumerate(['delta', 'alpha', 'echo', 'charlie', 'bravo', 'foxtrot']):
+            user = structure_factories.UserFactory(username=username)
+            if index % 2:
+                hook = logging_factories.WebHookFactory(user=user)
+            else:
+                hook = logging_factories.PushHookFactory(user=user, token='token-%s' % username)
+            self.hooks.append(hook)
+        self.hooks.sort(key=lambda hook: hook.user.username)
+
+    def get_queryset(self):
+        return SummaryQuerySet([logging_models.WebHook, logging_models.PushHook])
+
+    def test_slice_is_ordered_across_all_querysets(self):
+        queryset = self.get_queryset().order_by('user__username')
+
+        self.assertEqual(queryset[0:2], self.hooks[0:2])
+        self.assertEqual(queryset[2:5], self.hooks[2:5])
+        self.assertEqual(queryset[5:10], self.hooks[5:])
+
+    def test_slice_supports_descending_ordering(self):
+        queryset = self.get_queryset().order_by('-user__username')
+
+        self.assertEqual(queryset[1:4], list(reversed(self.hooks))[1:4])
+
+    def test_strings_are_ordered_case_insensitively(self):
+        hook = logging_factories.WebHookFactory(user=structure_factories.UserFactory(username='Zulu'))
+
+        queryset = self.get_queryset().order_by('user__username')
+
+        self.assertEqual(queryset[len(self.hooks)], hook)
+
+    def test_objects_are_not_repeated_if_ordering_path_is_multi_valued(self):
+        groups = [Group.objects.create(name=name) for name in ('first', 'second')]
+        for hook in self.hooks:
+            hook.user.groups.add(*groups)
+
+        queryset = self.get_queryset().order_by('user__groups__name')
+
+        self.assertEqual(sorted(hook.pk for hook in queryset[0:10]), sorted(hook.pk for hook in self.hooks))
+
+    def test_ordering_of_querysets_is_used_if_it_is_the_same_for_all_of_them(self):
+        queryset = self.get_queryset()
+        queryset.querysets = [qs.order_by('user__username') for qs in queryset.querysets]
+
+        self.assertEqual(queryset[3], self.hooks[3])
+
+    def test_unordered_slice_is_taken_from_chained_querysets(self):
+        queryset = self.get_queryset()
+
+        self.assertEqual(queryset[1:5], list(queryset)[1:5])
+        self.assertEqual(len(queryset[2:100]), len(self.hooks) - 2)
+
+    def test_only_objects_of_requested_page_are_fetched(self):
+        queryset = self.get_queryset().order_by('user__username')
+
+        # One query for keys of the page and one query per model for the objects themselves.
+        with self.assertNumQueries(3):
+            queryset[4:6]
+
+    def test_index_error_is_raised_for_index_out_of_range(self):
+        queryset = self.get_queryset().order_by('user__username')
+
+        with self.assertRaises(IndexError):
+            queryset[len(self.hooks)]
+
+    def test_counts_of_all_querysets_are_computed_by_single_query(self):
+        queryset = self.get_queryset()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(queryset.get_counts(), [3, 3])
+
+    def test_length_is_taken_from_cache_if_cache_timeout_is_defined(self):
+        nodeconductor_settings = settings.NODECONDUCTOR.copy()
+        nodeconductor_settings['SUMMARY_COUNT_CACHE_TIMEOUT'] = 60
+        cache.clear()
+
+        with self.settings(NODECONDUCTOR=nodeconductor_settings):
+            self.assertEqual(len(self.get_queryset()), len(self.hooks))
+            with self.assertNumQueries(0):
+                self.assertEqual(len(self.get_queryset()), len(self.hooks))
@@ -0,0 +1,121 @@
+from __future__ import unicode_literals
+
+import warnings
+
+from celery import states
+from django.core.cache import cache
+from django.test import TestCase
+import mock
+
+from nodeconductor.core import tasks
+
+
+class PullTask(tasks.BackgroundTask):
+    name = 'nodeconductor.core.tests.PullTask'
+
+    def run(self, serialized_instance):
+        pass
+
+
+class LegacyPullTask(tasks.BackgroundTask):
+    name = 'nodeconductor.core.tests.LegacyPullTask'
+
+    def is_equal(self, other_task, serialized_instance):
+        return other_task.get('args') == [serialized_instance]
+
+    def run(self, serialized_instance):
+        pass
+
+
+@mock.patch('celery.app.task.Task.apply_async')
+class BackgroundTaskTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.task = PullTask()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_task_is_not_scheduled_if_previous_task_is_not_completed(self, apply_async):
+        self.task.apply_async(args=('instance:1',))
+        self.task.apply_async(args=('instance:1',))
+
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertTrue(self.task.is_previous_task_processing('instance:1'))
+
+    def test_tasks_with_different_args_are_scheduled(self, apply_async):
+        self.task.apply_async(args=('instance:1',))
+        self.task.apply_async(args=('instance:2',))
+
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_task_is_scheduled_after_previous_task_is_completed(self, apply_async):
+        self.task.apply_async(args=('instance:1',))
+        task_id = apply_async.call_args[1]['task_id']
+
+        self.task.after_return(states.FAILURE, None, task_id, ['instance:1'], {}, None)
+        self.task.apply_async(args=('instance:1',))
+
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_lock_of_other_task_is_not_released(self, apply_async):
+        self.task.apply_async(args=('instance:1',))
+
+        self.task.after_return(states.SUCCESS, None, 'expired-task-id', ['instance:1'], {}, None)
+
+        self.assertTrue(self.task.is_previous_task_processing('instance:1'))
+
+    def test_lock_is_released_if_task_is_not_published(self, apply_async):
+        apply_async.side_effect = IOError
+
+        with self.assertRaises(IOError):
+            self.task.apply_async(args=('instance:1',))
+
+        self.assertFalse(self.task.is_previous_task_processing('instance:1'))
+
+    def test_retry_of_task_is_scheduled(self, apply_async):
+        self.task.apply_async(args=('instance:1',))
+        task_id = apply_async.call_args[1]['task_id']
+
+        self.task.apply_async(args=('instance:1',), task_id=task_id)
+
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(apply_async.call_args[1]['task_id'], task_id)
+
+    def test_lock_key_of_task_with_not_json_serializable_args_is_defined(self, apply_async):
+        self.task.apply_async(args=(object(),))
+        self.task.apply_async(kwargs={'instance': {'instance:1'}})
+
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertTrue(self.task.is_previous_task_processing(instance={'instance:1'}))
+
+    @mock.patch('celery.app.control.Control.inspect')
+    def test_deprecated_is_equal_is_checked_against_tasks_of_workers(self, inspect, apply_async):
+        inspect().active.return_value = {'worker': [{'args': ['instance:1']}]}
+        inspect().scheduled.return_value = {}
+        inspect().reserved.return_value = {}
+        task = LegacyPullTask()
+
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            task.apply_async(args=('instance:1',))
+            task.apply_async(args=('instance:2',))
+
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual(apply_async.call_args[1]['args'], ('instance:2',))
+
+    @mock.patch.object(tasks.BackgroundTask, '_warned_is_equal_classes', set())
+    @mock.patch('celery.app.control.Control.inspect')
+    def test_deprecation_of_is_equal_is_warned_once_per_class(self, inspect, apply_async):
+        inspect().active.return_value = {}
+        inspect().scheduled.return_value = {}
+        inspect().reserved.return_value = {}
+
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter('always')
+            LegacyPullTask().apply_async(args=('instance:1',))
+            LegacyPullTask().apply_async(args=('instance:2',))
+
+        deprecations = [w for w in caught_warnings if issubclass(w.category, DeprecationWarning)]
+        self.assertEqual(len(deprecations), 1)
@@ -14,6 +14,7 @@ from django.apps import apps
 from django.contrib.auth import get_user_model
 from django.core.management import call_command
 from django.core.urlresolvers import reverse, resolve
+from django.db.models import Case, Value, When
 from django.http import QueryDict
 from django.utils import timezone
 from django.utils.crypto import get_random_string
@@ -107,6 +108,19 @@ def month_end(date):
     return timezone.make_aware(last_second_of_month, timezone.get_current_timezone())
 
 
+def bulk_update(model, field_name, values, batch_size=300):
+    """ Update field of many model instances with a single query per batch.
+
+        :param values: dictionary that maps instance primary key to new value of the field.
+    """
+    field = model._meta.get_field(field_name)
+    pks = list(values.keys())
+    for index in range(0, len(pks), batch_size):
+        batch = pks[index:index + batch_size]
+        cases = [When(pk=pk, then=Value(values[pk])) for pk in batch]
+        model.objects.filter(pk__in=batch).update(**{field_name: Case(*cases, output_field=field)})
+
+
 def request_api(request, url_or_view_name, method='GET', data=None, params=None, verify=False):
     """ Make a request to API internally.
         Use 'request.user' for authentication.
@@ -10,7 +10,7 @@ class CostTrackingConfig(AppConfig):
 
     def ready(self):
         from nodeconductor.cost_tracking import handlers
-        from nodeconductor.quotas import models as quotas_models
+        from nodeconductor.quotas import models as quotas_models, signals as quotas_signals
         from nodeconductor.structure import models as structure_models
 
         PriceEstimate = self.get_model('PriceEstimate')
@@ -35,6 +35,27 @@ class CostTrackingConfig(AppConfig):
             dispatch_uid='nodeconductor.cost_tracking.handlers.resource_quota_update',
         )
 
+        quotas_signals.quota_usage_changed.connect(
+            handlers.resource_quota_update,
+            sender=quotas_models.Quota,
+            dispatch_uid='nodeconductor.cost_tracking.handlers.resource_quota_usage_change',
+        )
+
+        for model in (self.get_model('PriceListItem'), self.get_model('DefaultPriceListItem')):
+            signals.post_save.connect(
+                handlers.invalidate_minute_rates,
+                sender=model,
+                dispatch_uid='nodeconductor.cost_tracking.handlers.invalidate_minute_rates_on_save_%s' % (
+                    model.__name__),
+            )
+
+            signals.post_delete.connect(
+                handlers.invalidate_minute_rates,
+                sender=model,
+                dispatch_uid='nodeconductor.cost_tracking.handlers.invalidate_minute_rates_on_delete_%s' % (
+                    model.__name__),
+            )
+
         signals.post_save.connect(
             handlers.copy_threshold_from_previous_price_estimate,
             sender=PriceEstimate,
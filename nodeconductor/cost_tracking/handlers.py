@@ -160,3 +160,7 @@ def _update_resource_estimate(resource, new_configuration):
     consumption_details.update_configuration(new_configuration)
     price_estimate.update_total()
     return price_estimate
+
+
+def invalidate_minute_rates(sender, instance, **kwargs):
+    models.PriceListItem.invalidate_minute_rates()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_ancestry(apps, schema_editor):
+    PriceEstimate = apps.get_model('cost_tracking', 'PriceEstimate')
+    PriceEstimateAncestry = apps.get_model('cost_tracking', 'PriceEstimateAncestry')
+    links = PriceEstimate.parents.through.objects.values_list('from_priceestimate_id', 'to_priceestimate_id')
+    parents = {}
+    for child_id, parent_id in links:
+        parents.setdefault(child_id, []).append(parent_id)
+
+    ancestries = []
+    for descendant_id in parents:
+        depths = {}
+        level, depth = parents[descendant_id], 1
+        while level:
+            next_level = []
+            for ancestor_id in level:
+                if ancestor_id not in depths:
+                    depths[ancestor_id] = depth
+                    next_level.extend(parents.get(ancestor_id, []))
+            level, depth = next_level, depth + 1
+        ancestries.extend(PriceEstimateAncestry(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth)
+                          for ancestor_id, depth in depths.items())
+    PriceEstimateAncestry.objects.bulk_create(ancestries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cost_tracking', '0025_increase_price_decimal_places'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceEstimateAncestry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendants_links', to='cost_tracking.PriceEstimate')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestors_links', to='cost_tracking.PriceEstimate')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='priceestimateancestry',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.RunPython(fill_ancestry),
+    ]
@@ -2,13 +2,15 @@ from __future__ import unicode_literals
 
 import datetime
 import logging
+import uuid
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models, transaction
-from django.db.models import Q
+from django.db.models import F, Q
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.lru_cache import lru_cache
@@ -28,6 +30,12 @@ from . import CostTrackingRegister
 
 logger = logging.getLogger(__name__)
 
+MINUTE_RATES_CACHE_TIMEOUT = 60 * 60 * 24
+MINUTE_RATES_VERSION_KEY = 'cost_tracking_minute_rates_version'
+# In-process copy of shared cache, maps (service content type, service, resource content type)
+# to (version, minute rates).
+_minute_rates_cache = {}
+
 
 class EstimateUpdateError(Exception):
     pass
@@ -90,6 +98,10 @@ class PriceEstimate(LoggableMixin, AlertThresholdMixin, core_models.UuidMixin, c
     def is_over_threshold(self):  # For AlertThresholdMixin
         return self.total > self.threshold
 
+    @classmethod
+    def get_over_threshold_query(cls):  # For AlertThresholdMixin
+        return Q(total__gt=F('threshold'))
+
     @classmethod
     def get_checkable_objects(cls):  # For AlertThresholdMixin
         """ Raise alerts only for price estimates that describe current month. """
@@ -111,9 +123,31 @@ class PriceEstimate(LoggableMixin, AlertThresholdMixin, core_models.UuidMixin, c
         scope_parents = self.scope.get_parents()
         for scope_parent in scope_parents:
             parent, created = PriceEstimate.objects.get_or_create(scope=scope_parent, month=self.month, year=self.year)
-            self.parents.add(parent)
             if created:
                 parent.create_ancestors()
+            self.parents.add(parent)
+            self._link_to_ancestors(parent)
+
+    def _link_to_ancestors(self, parent):
+        """ Register parent and all its ancestors in closure table """
+        depths = {parent.pk: 1}
+        for ancestor_id, depth in PriceEstimateAncestry.objects.filter(
+                descendant=parent).values_list('ancestor_id', 'depth'):
+            depths[ancestor_id] = depth + 1
+        linked_ancestors_ids = set(
+            PriceEstimateAncestry.objects.filter(descendant=self).values_list('ancestor_id', flat=True))
+        PriceEstimateAncestry.objects.bulk_create([
+            PriceEstimateAncestry(ancestor_id=ancestor_id, descendant=self, depth=depth)
+            for ancestor_id, depth in depths.items() if ancestor_id not in linked_ancestors_ids
+        ])
+
+    def get_ancestors(self):
+        """ Get all unique estimate ancestors from closure table """
+        return list(PriceEstimate.objects.filter(descendants_links__descendant=self))
+
+    def get_descendants(self):
+        """ Get all unique estimate descendants from closure table """
+        return list(PriceEstimate.objects.filter(ancestors_links__ancestor=self))
 
     def init_details(self):
         """ Initialize price estimate details based on its scope """
@@ -142,9 +176,8 @@ class PriceEstimate(LoggableMixin, AlertThresholdMixin, core_models.UuidMixin, c
                 self.update_ancestors_total(diff)
 
     def update_ancestors_total(self, diff):
-        for ancestor in self.get_ancestors():
-            ancestor.total += diff
-            ancestor.save(update_fields=['total'])
+        ancestors_ids = PriceEstimateAncestry.objects.filter(descendant=self).values('ancestor_id')
+        PriceEstimate.objects.filter(pk__in=ancestors_ids).update(total=F('total') + diff)
 
     def update_consumed(self):
         """ Re-calculate price of resource until now. Does not update ancestors. """
@@ -176,8 +209,15 @@ class PriceEstimate(LoggableMixin, AlertThresholdMixin, core_models.UuidMixin, c
         """ Calculate price estimate for scope depends on consumed data and price list items.
             Map each consumable to price list item and multiply price its price by time of usage.
         """
-        price_list_items = PriceListItem.get_for_resource(self.scope)
-        consumables_prices = {(item.item_type, item.key): item.minute_rate for item in price_list_items}
+        consumables_prices = PriceListItem.get_minute_rates_for_resource(self.scope)
+        return self.calculate_price(consumed, consumables_prices)
+
+    @staticmethod
+    def calculate_price(consumed, consumables_prices):
+        """ Multiply usage of each consumable by its minute rate.
+
+            Argument "consumables_prices" maps (item_type, key) pair to minute rate.
+        """
         total = 0
         for consumable_item, usage in consumed.items():
             try:
@@ -215,6 +255,21 @@ class PriceEstimate(LoggableMixin, AlertThresholdMixin, core_models.UuidMixin, c
                 yield grandchild
 
 
+class PriceEstimateAncestry(models.Model):
+    """ Closure table of price estimates hierarchy.
+
+        Holds a row for each (ancestor, descendant) pair, so ancestors or
+        descendants of estimate are fetched by a single query without recursion.
+        Depth is the number of links between descendant and ancestor.
+    """
+    ancestor = models.ForeignKey(PriceEstimate, related_name='descendants_links')
+    descendant = models.ForeignKey(PriceEstimate, related_name='ancestors_links')
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+
+
 class ConsumptionDetailUpdateError(Exception):
     pass
 
@@ -462,3 +517,78 @@ class PriceListItem(core_models.UuidMixin, AbstractPriceListItem):
             default_price_list_item__in=default_items, service=service).select_related('default_price_list_item'))
         rewrited_defaults = set([i.default_price_list_item for i in items])
         return items | (default_items - rewrited_defaults)
+
+    @classmethod
+    def get_minute_rates_for_resource(cls, resource):
+        """ Get minute rates of consumables that should be used for resource.
+
+            Returns dictionary that maps (item_type, key) pair to minute rate.
+            Rates are cached per service and resource content type until any
+            price list item is changed.
+        """
+        service = resource.service_project_link.service
+        return cls.get_minute_rates(service, ContentType.objects.get_for_model(resource))
+
+    @classmethod
+    def get_minute_rates(cls, service, resource_content_type):
+        return cls.get_services_minute_rates(type(service), [service.id], resource_content_type)[service.id]
+
+    @classmethod
+    def get_services_minute_rates(cls, service_model, services_ids, resource_content_type):
+        """ Get minute rates of consumables for resources of each of given services.
+
+            Returns dictionary that maps service ID to {(item_type, key): minute_rate}.
+            Price list items defined for service override default ones. Rates that
+            are missing in cache are fetched by two queries for all services.
+        """
+        version = cls._get_minute_rates_version()
+        service_content_type = ContentType.objects.get_for_model(service_model)
+
+        minute_rates = {}
+        keys = {}
+        for service_id in set(services_ids):
+            local_key = (service_content_type.id, service_id, resource_content_type.id)
+            cached_version, service_rates = _minute_rates_cache.get(local_key, (None, None))
+            if cached_version == version:
+                minute_rates[service_id] = service_rates
+            else:
+                keys['cost_tracking_minute_rates_%s_%s_%s_%s' % ((version,) + local_key)] = service_id
+        if not keys:
+            return minute_rates
+
+        cached_rates = cache.get_many(keys.keys())
+        missing_ids = [service_id for key, service_id in keys.items() if key not in cached_rates]
+        if missing_ids:
+            default_items = DefaultPriceListItem.objects.filter(resource_content_type=resource_content_type)
+            default_rates = {(item.item_type, item.key): item.minute_rate for item in default_items}
+            new_rates = {service_id: default_rates.copy() for service_id in missing_ids}
+            items = cls.objects.filter(
+                content_type=service_content_type,
+                object_id__in=missing_ids,
+                default_price_list_item__resource_content_type=resource_content_type,
+            ).select_related('default_price_list_item')
+            for item in items:
+                new_rates[item.object_id][(item.item_type, item.key)] = item.minute_rate
+            new_cached_rates = {key: new_rates[service_id] for key, service_id in keys.items()
+                                if service_id in new_rates}
+            cache.set_many(new_cached_rates, MINUTE_RATES_CACHE_TIMEOUT)
+            cached_rates.update(new_cached_rates)
+
+        for key, service_id in keys.items():
+            local_key = (service_content_type.id, service_id, resource_content_type.id)
+            _minute_rates_cache[local_key] = (version, cached_rates[key])
+            minute_rates[service_id] = cached_rates[key]
+        return minute_rates
+
+    @staticmethod
+    def invalidate_minute_rates():
+        """ Make cached minute rates of all services obsolete """
+        cache.set(MINUTE_RATES_VERSION_KEY, uuid.uuid4().hex, None)
+
+    @staticmethod
+    def _get_minute_rates_version():
+        version = cache.get(MINUTE_RATES_VERSION_KEY)
+        if version is None:
+            cache.add(MINUTE_RATES_VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(MINUTE_RATES_VERSION_KEY)
+        return version
@@ -1,8 +1,15 @@
+import logging
+
 from celery import shared_task
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q, Sum
 
+from nodeconductor.core import utils as core_utils
 from nodeconductor.cost_tracking import CostTrackingRegister, models
 from nodeconductor.structure import models as structure_models
 
+logger = logging.getLogger(__name__)
+
 
 @shared_task(name='nodeconductor.cost_tracking.recalculate_estimate')
 def recalculate_estimate(recalculate_total=False):
@@ -18,15 +25,55 @@ def recalculate_estimate(recalculate_total=False):
     CostTrackingRegister.autodiscover()
     # Step 1. Recalculate resources estimates.
     for resource_model in CostTrackingRegister.registered_resources:
-        for resource in resource_model.objects.all():
-            _update_resource_consumed(resource, recalculate_total=recalculate_total)
+        _update_resources_consumed(resource_model, recalculate_total=recalculate_total)
     # Step 2. Move from down to top and recalculate consumed estimate for each
     #         object based on its children.
-    ancestors_models = [m for m in models.PriceEstimate.get_estimated_models()
-                        if not issubclass(m, structure_models.ResourceMixin)]
-    for model in ancestors_models:
-        for ancestor in model.objects.all():
-            _update_ancestor_consumed(ancestor)
+    _update_ancestors_consumed()
+
+
+def _update_resources_consumed(resource_model, recalculate_total):
+    """ Recalculate consumed price for all resources of given model.
+
+        Estimates, consumption details and price list items are fetched in bulk,
+        prices are calculated in memory and only changed values are written back.
+        Resources without current estimate are processed one by one, because
+        their estimates and ancestors should be created.
+    """
+    resource_content_type = ContentType.objects.get_for_model(resource_model)
+    price_estimates = {
+        estimate.object_id: estimate for estimate in models.PriceEstimate.objects.filter_current().filter(
+            content_type=resource_content_type).select_related('consumption_details')
+    }
+    resources = list(resource_model.objects.values_list('pk', 'service_project_link__service'))
+    spl_model = resource_model._meta.get_field('service_project_link').related_model
+    service_model = spl_model._meta.get_field('service').related_model
+    minute_rates = models.PriceListItem.get_services_minute_rates(
+        service_model, [service_id for _, service_id in resources], resource_content_type)
+
+    new_consumed = {}
+    not_estimated_resources_ids = []
+    for resource_id, service_id in resources:
+        price_estimate = price_estimates.get(resource_id)
+        if price_estimate is None or recalculate_total:
+            not_estimated_resources_ids.append(resource_id)
+            continue
+        try:
+            consumption_details = price_estimate.consumption_details
+        except models.ConsumptionDetails.DoesNotExist:
+            logger.error('Cannot update consumed for price estimate %s that does not have consumption details.',
+                         price_estimate.uuid.hex)
+            continue
+        consumed = models.PriceEstimate.calculate_price(
+            consumption_details.consumed_until_now, minute_rates[service_id])
+        if consumed != price_estimate.consumed:
+            new_consumed[price_estimate.pk] = consumed
+    core_utils.bulk_update(models.PriceEstimate, 'consumed', new_consumed)
+
+    batch_size = 500
+    for index in range(0, len(not_estimated_resources_ids), batch_size):
+        batch = not_estimated_resources_ids[index:index + batch_size]
+        for resource in resource_model.objects.filter(pk__in=batch):
+            _update_resource_consumed(resource, recalculate_total=recalculate_total)
 
 
 def _update_resource_consumed(resource, recalculate_total):
@@ -40,9 +87,43 @@ def _update_resource_consumed(resource, recalculate_total):
     price_estimate.update_consumed()
 
 
-def _update_ancestor_consumed(ancestor):
-    price_estimate, _ = models.PriceEstimate.objects.get_or_create_current(scope=ancestor)
-    resource_descendants = [descendant for descendant in price_estimate.get_descendants()
-                            if isinstance(descendant.scope, structure_models.ResourceMixin)]
-    price_estimate.consumed = sum([descendant.consumed for descendant in resource_descendants])
-    price_estimate.save(update_fields=['consumed'])
+def _update_ancestors_consumed():
+    """ Set consumed of each ancestor estimate to the sum of consumed of its resources estimates.
+
+        Sums are calculated by single grouped query over estimates closure table.
+    """
+    estimated_models = models.PriceEstimate.get_estimated_models()
+    resources_models = [m for m in estimated_models if issubclass(m, structure_models.ResourceMixin)]
+    ancestors_models = [m for m in estimated_models if not issubclass(m, structure_models.ResourceMixin)]
+
+    current_estimates = models.PriceEstimate.objects.filter_current()
+    for model in ancestors_models:
+        estimated_ids = current_estimates.filter(
+            content_type=ContentType.objects.get_for_model(model)).values('object_id')
+        for ancestor in model.objects.exclude(pk__in=estimated_ids):
+            models.PriceEstimate.objects.get_or_create_current(scope=ancestor)
+
+    ancestries = models.PriceEstimateAncestry.objects.filter(
+        _get_existing_scope_query(resources_models, prefix='descendant__'),
+        ancestor__in=current_estimates,
+    )
+    sums = dict(ancestries.values_list('ancestor_id').annotate(consumed=Sum('descendant__consumed')))
+
+    ancestors_estimates = current_estimates.filter(_get_existing_scope_query(ancestors_models))
+    new_consumed = {}
+    for estimate_id, consumed in ancestors_estimates.values_list('pk', 'consumed'):
+        value = sums.get(estimate_id) or 0
+        if value != consumed:
+            new_consumed[estimate_id] = value
+    core_utils.bulk_update(models.PriceEstimate, 'consumed', new_consumed)
+
+
+def _get_existing_scope_query(scope_models, prefix=''):
+    """ Filter estimates which scope is an existing instance of one of given models """
+    query = Q()
+    for model in scope_models:
+        query |= Q(**{
+            prefix + 'content_type': ContentType.objects.get_for_model(model),
+            prefix + 'object_id__in': model.objects.values('pk'),
+        })
+    return query
@@ -1,7 +1,7 @@
 import datetime
 
 from django.contrib.contenttypes.models import ContentType
-from django.test import TransactionTestCase
+from django.test import TestCase, TransactionTestCase
 from freezegun import freeze_time
 
 from nodeconductor.cost_tracking import models, ConsumableItem
@@ -96,6 +96,53 @@ class PriceListItemTest(TransactionTestCase):
         expected = {default_item1, item}
         self.assertSetEqual(models.PriceListItem.get_for_resource(resource), expected)
 
+    def test_get_minute_rates_for_resource(self):
+        resource = structure_factories.TestNewInstanceFactory()
+        resource_content_type = ContentType.objects.get_for_model(resource)
+        service = resource.service_project_link.service
+        default_item1 = models.DefaultPriceListItem.objects.create(
+            resource_content_type=resource_content_type, item_type='flavor', key='small', value=10)
+        default_item2 = models.DefaultPriceListItem.objects.create(
+            resource_content_type=resource_content_type, item_type='storage', key='1 GB', value=0.5)
+        item = models.PriceListItem.objects.create(default_price_list_item=default_item2, service=service, value=1)
+
+        expected = {('flavor', 'small'): default_item1.minute_rate, ('storage', '1 GB'): item.minute_rate}
+        self.assertEqual(models.PriceListItem.get_minute_rates_for_resource(resource), expected)
+
+    def test_minute_rates_are_taken_from_cache_until_price_list_item_is_changed(self):
+        resource = structure_factories.TestNewInstanceFactory()
+        resource_content_type = ContentType.objects.get_for_model(resource)
+        service = resource.service_project_link.service
+        default_item = models.DefaultPriceListItem.objects.create(
+            resource_content_type=resource_content_type, item_type='flavor', key='small', value=10)
+        models.PriceListItem.get_minute_rates(service, resource_content_type)
+
+        with self.assertNumQueries(0):
+            models.PriceListItem.get_minute_rates(service, resource_content_type)
+
+        item = models.PriceListItem.objects.create(default_price_list_item=default_item, service=service, value=20)
+        minute_rates = models.PriceListItem.get_minute_rates(service, resource_content_type)
+        self.assertEqual(minute_rates, {('flavor', 'small'): item.minute_rate})
+
+    def test_minute_rates_of_many_services_are_fetched_together(self):
+        resource = structure_factories.TestNewInstanceFactory()
+        resource_content_type = ContentType.objects.get_for_model(resource)
+        service = resource.service_project_link.service
+        other_service = structure_factories.TestServiceFactory()
+        default_item = models.DefaultPriceListItem.objects.create(
+            resource_content_type=resource_content_type, item_type='flavor', key='small', value=10)
+        item = models.PriceListItem.objects.create(default_price_list_item=default_item, service=service, value=20)
+
+        minute_rates = models.PriceListItem.get_services_minute_rates(
+            type(service), [service.id, other_service.id], resource_content_type)
+
+        self.assertEqual(minute_rates, {
+            service.id: {('flavor', 'small'): item.minute_rate},
+            other_service.id: {('flavor', 'small'): default_item.minute_rate},
+        })
+        self.assertEqual(models.PriceListItem.get_minute_rates(service, resource_content_type),
+                         minute_rates[service.id])
+
 
 class DefaultPriceListItemTest(TransactionTestCase):
 
@@ -108,3 +155,41 @@ class DefaultPriceListItemTest(TransactionTestCase):
         actual = models.DefaultPriceListItem.get_consumable_items_pretty_names(
             price_list_item.resource_content_type, [consumable_item])
         self.assertDictEqual(actual, expected)
+
+
+class PriceEstimateAncestryTest(TestCase):
+
+    def setUp(self):
+        self.resource = structure_factories.TestNewInstanceFactory()
+        self.spl = self.resource.service_project_link
+        self.estimate = models.PriceEstimate.objects.create(scope=self.resource, month=8, year=2016)
+        self.estimate.create_ancestors()
+
+    def get_estimate(self, scope):
+        return models.PriceEstimate.objects.get(scope=scope, month=8, year=2016)
+
+    def test_ancestors_are_taken_from_closure_table(self):
+        scopes = (self.spl, self.spl.project, self.spl.service, self.spl.service.settings, self.spl.project.customer)
+        expected = {self.get_estimate(scope) for scope in scopes}
+
+        with self.assertNumQueries(1):
+            self.assertSetEqual(set(self.estimate.get_ancestors()), expected)
+
+    def test_depth_is_length_of_path_to_ancestor(self):
+        ancestry = models.PriceEstimateAncestry.objects.get(
+            descendant=self.estimate, ancestor=self.get_estimate(self.spl.project.customer))
+        self.assertEqual(ancestry.depth, 3)
+
+    def test_descendants_are_taken_from_closure_table(self):
+        customer_estimate = self.get_estimate(self.spl.project.customer)
+        expected = {self.estimate, self.get_estimate(self.spl), self.get_estimate(self.spl.project),
+                    self.get_estimate(self.spl.service)}
+
+        self.assertSetEqual(set(customer_estimate.get_descendants()), expected)
+
+    def test_ancestors_total_is_updated_by_single_query(self):
+        with self.assertNumQueries(1):
+            self.estimate.update_ancestors_total(diff=10)
+
+        for ancestor in self.estimate.get_ancestors():
+            self.assertEqual(ancestor.total, 10)
@@ -1,7 +1,9 @@
 import datetime
 
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from freezegun import freeze_time
 
 from nodeconductor.cost_tracking import models, CostTrackingRegister, tasks
@@ -76,3 +78,20 @@ class RecalculateEstimateTest(TransactionTestCase):
             message = 'Price estimate "consumed" is calculated wrongly for "%s". Real value: %s, expected: %s.' % (
                 price_estimate.scope, price_estimate.consumed, expected_consumed)
             self.assertAlmostEqual(price_estimate.consumed, expected_consumed, msg=message)
+
+    def test_number_of_queries_does_not_depend_on_number_of_resources(self):
+        calculation_time = datetime.datetime(2016, 8, 8, 15, 0)
+        with freeze_time(calculation_time):
+            tasks.recalculate_estimate()
+            with CaptureQueriesContext(connection) as single_resource_context:
+                tasks.recalculate_estimate()
+
+        with freeze_time(self.start_time):
+            for _ in range(3):
+                structure_factories.TestNewInstanceFactory(disk=10 * 1024, service_project_link=self.spl)
+        with freeze_time(calculation_time):
+            tasks.recalculate_estimate()
+            with CaptureQueriesContext(connection) as many_resources_context:
+                tasks.recalculate_estimate()
+
+        self.assertEqual(len(single_resource_context), len(many_resources_context))
@@ -53,8 +53,15 @@ class PushHookAdmin(BaseHookAdmin):
     list_display = BaseHookAdmin.list_display + ('type', 'device_id')
 
 
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = ('url', 'created', 'attempts', 'error')
+    list_filter = ('created',)
+    search_fields = ('url',)
+
+
 admin.site.register(models.Alert, AlertAdmin)
 admin.site.register(models.SystemNotification, SystemNotificationAdmin)
 admin.site.register(models.WebHook, WebHookAdmin)
 admin.site.register(models.EmailHook, EmailHookAdmin)
 admin.site.register(models.PushHook, PushHookAdmin)
+admin.site.register(models.DeadLetter, DeadLetterAdmin)
@@ -17,3 +17,17 @@ class EventsConfig(AppConfig):
                 sender=model,
                 dispatch_uid='nodeconductor.logging.handlers.remove_{}_{}_related_alerts'.format(model.__name__, index),
             )
+
+            signals.post_save.connect(
+                handlers.invalidate_permitted_objects_uuids,
+                sender=model,
+                dispatch_uid='nodeconductor.logging.handlers.invalidate_permitted_objects_uuids_on_{}_{}_save'.format(
+                    model.__name__, index),
+            )
+
+            signals.post_delete.connect(
+                handlers.invalidate_permitted_objects_uuids,
+                sender=model,
+                dispatch_uid='nodeconductor.logging.handlers.invalidate_permitted_objects_uuids_on_{}_{}_delete'.format(
+                    model.__name__, index),
+            )
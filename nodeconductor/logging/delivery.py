@@ -0,0 +1,225 @@
+""" Delivery of hook events over HTTP with pooled connections, retries and circuit breaking """
+from __future__ import unicode_literals
+
+import collections
+import hashlib
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import six
+from django.utils.six.moves import http_cookiejar as cookielib
+from django.utils.six.moves.urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'connect_timeout': 5,
+    'read_timeout': 10,
+    'max_workers': 10,
+    'max_attempts': 3,
+    'retry_backoff': 1,
+    'circuit_failures_threshold': 5,
+    'circuit_reset_timeout': 60,
+}
+
+
+class HookRequest(collections.namedtuple('HookRequest', ('url', 'kwargs', 'hook'))):
+    """ Request to hook destination, kwargs are passed to requests.Session.post.
+
+        Request is passed to retry task, so it should not contain secrets. Hook is
+        a pair of hook model label and argument of its "get_request_headers" class
+        method, headers with secrets are added by this method right before sending.
+    """
+
+    def __new__(cls, url, kwargs, hook=None):
+        return super(HookRequest, cls).__new__(cls, url, kwargs, tuple(hook) if hook else None)
+
+    def get_kwargs(self):
+        if self.hook is None:
+            return self.kwargs
+        model_label, argument = self.hook
+        headers = dict(self.kwargs.get('headers') or {})
+        headers.update(apps.get_model(model_label).get_request_headers(argument))
+        return dict(self.kwargs, headers=headers)
+
+
+# Sessions keep pool of persistent connections to each destination, they are shared by threads of process.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_delivery_settings():
+    delivery_settings = DEFAULT_SETTINGS.copy()
+    delivery_settings.update(settings.NODECONDUCTOR.get('HOOK_DELIVERY', {}))
+    return delivery_settings
+
+
+def get_destination(url):
+    parsed_url = urlparse(url)
+    return '%s://%s' % (parsed_url.scheme, parsed_url.netloc)
+
+
+class BlockAllCookies(cookielib.CookiePolicy):
+    """ Sessions are shared by hooks of all users, so cookies should not be stored """
+    netscape = True
+    rfc2965 = hide_cookie2 = False
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+    def domain_return_ok(self, domain, request):
+        return False
+
+    def path_return_ok(self, path, request):
+        return False
+
+
+def get_session(destination):
+    with _sessions_lock:
+        session = _sessions.get(destination)
+        if session is None:
+            session = requests.Session()
+            session.cookies.set_policy(BlockAllCookies())
+            adapter = HTTPAdapter(pool_maxsize=get_delivery_settings()['max_workers'])
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[destination] = session
+        return session
+
+
+class CircuitBreaker(object):
+    """ Stop delivery to destination for reset timeout after several consecutive failures.
+
+        State is stored in cache, so it is shared by all workers.
+    """
+
+    def __init__(self, destination, failures_threshold, reset_timeout):
+        key = hashlib.md5(destination.encode('utf-8')).hexdigest()
+        self.destination = destination
+        self.failures_key = 'hook_delivery_failures_%s' % key
+        self.open_key = 'hook_delivery_circuit_open_%s' % key
+        self.failures_threshold = failures_threshold
+        self.reset_timeout = reset_timeout
+
+    def is_open(self):
+        return bool(cache.get(self.open_key))
+
+    def record_success(self):
+        cache.delete(self.failures_key)
+
+    def record_failure(self):
+        cache.add(self.failures_key, 0, self.reset_timeout)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            # Counter has expired after it was added.
+            failures = 1
+        if failures >= self.failures_threshold:
+            logger.warning('Delivery of hook events to %s is suspended for %s seconds after %s failures.',
+                           self.destination, self.reset_timeout, failures)
+            cache.set(self.open_key, True, self.reset_timeout)
+            cache.delete(self.failures_key)
+
+
+def send_requests(hook_requests, attempt=1):
+    """ Send requests to hook destinations concurrently.
+
+        Requests to the same destination are sent one by one by single thread, so slow or
+        dead destination does not occupy other threads. Failed requests are not retried in
+        place: they are rescheduled as celery task with exponential backoff, so worker is not
+        blocked. Requests are stored as dead letters if all attempts have failed.
+    """
+    if not hook_requests:
+        return
+
+    requests_by_destination = collections.OrderedDict()
+    for hook_request in hook_requests:
+        requests_by_destination.setdefault(get_destination(hook_request.url), []).append(hook_request)
+
+    delivery_settings = get_delivery_settings()
+    workers = min(delivery_settings['max_workers'], len(requests_by_destination))
+
+    def send(destination_requests):
+        destination, destination_requests = destination_requests
+        return _send_to_destination(destination, destination_requests, attempt, delivery_settings)
+
+    if workers == 1:
+        results = map(send, requests_by_destination.items())
+    else:
+        pool = ThreadPool(workers)
+        try:
+            results = pool.map(send, requests_by_destination.items())
+        finally:
+            pool.close()
+            pool.join()
+
+    retries = [hook_request for destination_retries, _ in results for hook_request in destination_retries]
+    if retries:
+        # XXX: This import provides circular dependencies between core and
+        #      logging applications.
+        from nodeconductor.core.tasks import send_task
+        countdown = delivery_settings['retry_backoff'] * 2 ** (attempt - 1)
+        send_task('logging', 'retry_hook_requests', countdown=countdown)(
+            [tuple(hook_request) for hook_request in retries], attempt + 1)
+
+    failures = [failure for _, destination_failures in results for failure in destination_failures]
+    if failures:
+        # XXX: Models module depends on delivery, so dead letter model is imported here.
+        from nodeconductor.logging.models import DeadLetter
+        DeadLetter.objects.bulk_create([
+            DeadLetter(url=hook_request.url, payload=hook_request.kwargs.get('json') or hook_request.kwargs.get('data'),
+                       error=error, attempts=attempts)
+            for hook_request, error, attempts in failures
+        ])
+
+
+def _send_to_destination(destination, destination_requests, attempt, delivery_settings):
+    """ Send requests to single destination.
+
+        Returns list of requests that should be retried and list of failed requests with errors and attempts count.
+    """
+    session = get_session(destination)
+    circuit_breaker = CircuitBreaker(
+        destination, delivery_settings['circuit_failures_threshold'], delivery_settings['circuit_reset_timeout'])
+    timeout = (delivery_settings['connect_timeout'], delivery_settings['read_timeout'])
+    retries = []
+    failures = []
+    for hook_request in destination_requests:
+        if circuit_breaker.is_open():
+            failures.append((hook_request, 'Delivery to destination is suspended after consecutive failures.',
+                             attempt - 1))
+            continue
+        try:
+            response = session.post(hook_request.url, timeout=timeout, **hook_request.get_kwargs())
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            error = six.text_type(e)
+            status_code = e.response.status_code
+            # Request is rejected by destination, so it would not succeed on retry.
+            is_retryable = status_code >= 500 or status_code == 429
+        except requests.RequestException as e:
+            error = six.text_type(e)
+            is_retryable = True
+        else:
+            circuit_breaker.record_success()
+            continue
+
+        if is_retryable:
+            circuit_breaker.record_failure()
+        if is_retryable and attempt < delivery_settings['max_attempts']:
+            retries.append(hook_request)
+        else:
+            logger.warning('Failed to deliver hook events to %s after %s attempts: %s',
+                           hook_request.url, attempt, error)
+            failures.append((hook_request, error, attempt))
+    return retries, failures
@@ -1,15 +1,48 @@
 from __future__ import unicode_literals
 
+import copy
+import datetime
+import hashlib
+import json
 import logging
+import threading
 
 from django.conf import settings
-from elasticsearch import Elasticsearch
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from elasticsearch import Elasticsearch, helpers
 
 from nodeconductor.core.utils import datetime_to_timestamp
 
 
 logger = logging.getLogger(__name__)
 
+# Stored terms lookup documents are re-indexed after this timeout to recover from index cleanup.
+TERMS_LOOKUP_CACHE_TIMEOUT = 60 * 60
+
+# Number of events fetched by each scroll request of export.
+SCAN_BATCH_SIZE = 500
+
+# Counts of past periods are cached, they are recalculated after timeout to reflect index cleanup.
+COUNT_HISTORY_CACHE_TIMEOUT = 24 * 60 * 60
+# Events are delivered to Elasticsearch with delay, so recently finished period is not cached yet.
+COUNT_HISTORY_DELIVERY_DELAY = datetime.timedelta(minutes=5)
+
+# Elasticsearch client is thread safe and keeps pool of persistent connections,
+# so single client is shared by all requests of the process.
+_client = None
+_client_lock = threading.Lock()
+
+
+@receiver(setting_changed)
+def reset_client(setting, **kwargs):
+    global _client
+    if setting == 'NODECONDUCTOR':
+        with _client_lock:
+            _client = None
+
 
 class ElasticsearchError(Exception):
     pass
@@ -33,15 +66,31 @@ class EmptyQueryset(object):
     def __getitem__(self, key):
         return []
 
+    def count_history(self, points):
+        return [{'end': datetime_to_timestamp(point), 'count': 0} for point in sorted(set(points))]
+
+    def get_page_after(self, cursor, size):
+        return [], None
+
+    def scan(self):
+        return iter([])
+
 
 class ElasticsearchResultList(object):
-    """ List of results acceptable by django pagination """
+    """ List of results acceptable by django pagination.
+
+        Total count is taken from the same search that fetches events, so if page
+        is prefetched paginator gets both count and events by single search.
+    """
 
     def __init__(self):
         self.client = ElasticsearchClient()
+        self.total = None
+        self._page = None
 
     def filter(self, should_terms=None, must_terms=None, must_not_terms=None, search_text='', start=None, end=None):
-        setattr(self, 'total', None)
+        self.total = None
+        self._page = None
         self.client.prepare_search_body(
             should_terms=should_terms,
             must_terms=must_terms,
@@ -54,24 +103,58 @@ class ElasticsearchResultList(object):
 
     def order_by(self, sort):
         self.sort = sort
+        self._page = None
         return self
 
+    def prefetch(self, from_, size):
+        """ Fetch page of events together with total count, they are reused by further calls """
+        events = self._get_events(from_, size)['events']
+        self._page = (from_, size, events)
+
     def count(self):
-        return self.client.get_count()
+        if self.total is None:
+            return self.client.get_count()
+        return self.total
 
     def aggregated_count(self, ranges):
         return self.client.get_aggregated_by_timestamp_count(ranges)
 
+    def count_history(self, points):
+        return self.client.get_count_history(points)
+
+    def get_page_after(self, cursor, size):
+        """ Fetch page of events that follow cursor, return events and cursor of the next page """
+        events_and_cursor = self.client.get_events_after(
+            cursor=cursor,
+            size=size,
+            sort=getattr(self, 'sort', '-@timestamp'),
+        )
+        return events_and_cursor['events'], events_and_cursor['cursor']
+
+    def scan(self):
+        """ Iterate over all filtered events in constant memory, events are not ordered """
+        return self.client.scan_events()
+
     def _get_events(self, from_, size):
-        return self.client.get_events(
+        events_and_total = self.client.get_events(
             from_=from_,
             size=size,
             sort=getattr(self, 'sort', '-@timestamp'),
         )
+        self.total = events_and_total['total']
+        return events_and_total
+
+    def _get_prefetched_events(self, start, stop):
+        if self._page is None:
+            return None
+        from_, size, events = self._page
+        if start == from_ and stop - start <= size:
+            return events[:stop - start]
+        return None
 
     def __len__(self):
-        if not hasattr(self, 'total') or self.total is None:
-            self.total = self._get_events(0, 1)['total']
+        if self.total is None:
+            self._get_events(0, 0)
         return self.total
 
     def __getitem__(self, key):
@@ -79,11 +162,13 @@ class ElasticsearchResultList(object):
             if key.step is not None and key.step != 1:
                 raise ElasticsearchResultListError('ElasticsearchResultList can be iterated only with step 1')
             start = key.start if key.start is not None else 0
-            events_and_total = self._get_events(start, key.stop - start)
+            stop = key.stop
         else:
-            events_and_total = self._get_events(key, 1)
-        self.total = events_and_total['total']
-        return events_and_total['events']
+            start, stop = key, key + 1
+        events = self._get_prefetched_events(start, stop)
+        if events is None:
+            events = self._get_events(start, stop - start)['events']
+        return events
 
 
 def _execute_if_not_empty(func):
@@ -105,6 +190,7 @@ class ElasticsearchClient(object):
             self.queries = {}
             self.timestamp_filter = {}
             self.should_terms_filter = {}
+            self.should_terms_lookup_filter = {}
             self.must_terms_filter = {}
             self.must_not_terms_filter = {}
             self.timestamp_ranges = []
@@ -113,6 +199,10 @@ class ElasticsearchClient(object):
         def set_should_terms(self, terms):
             self.should_terms_filter.update({key: map(str, value) for key, value in terms.items()})
 
+        @_execute_if_not_empty
+        def set_should_terms_lookup(self, lookups):
+            self.should_terms_lookup_filter.update(lookups)
+
         @_execute_if_not_empty
         def set_must_terms(self, terms):
             self.must_terms_filter.update({key: map(str, value) for key, value in terms.items()})
@@ -169,9 +259,11 @@ class ElasticsearchClient(object):
                     }
                 }
 
-            if self.should_terms_filter:
+            if self.should_terms_filter or self.should_terms_lookup_filter:
                 self['query']['filtered']['filter']['bool']['should'] = [
                     {'terms': {key: value}} for key, value in self.should_terms_filter.items()
+                ] + [
+                    {'terms': {key: lookup}} for key, lookup in self.should_terms_lookup_filter.items()
                 ]
 
             if self.must_terms_filter:
@@ -239,7 +331,11 @@ class ElasticsearchClient(object):
             Filter for event creation time
         """
         self.body = self.SearchBody()
-        self.body.set_should_terms(should_terms)
+        should_terms_lookup = self._get_terms_lookup(should_terms)
+        if should_terms_lookup:
+            self.body.set_should_terms_lookup(should_terms_lookup)
+        else:
+            self.body.set_should_terms(should_terms)
         self.body.set_must_terms(must_terms)
         self.body.set_must_not_terms(must_not_terms)
         self.body.set_search_text(search_text)
@@ -254,6 +350,48 @@ class ElasticsearchClient(object):
             'total': search_results['hits']['total'],
         }
 
+    def get_events_after(self, cursor=None, sort='-@timestamp', index='_all', size=10):
+        """
+        Fetch page of events that follow cursor position.
+
+        Cursor is a pair of sort field value of the last returned event and number of
+        returned events with this value. Instead of skipping all previous events, search
+        is restricted to events that are not before cursor value and only events with equal
+        value are skipped. Events are additionally sorted by _uid, so events with equal
+        sort value keep their order between requests. Next page cursor is None if there
+        are no more events.
+        """
+        if sort.startswith('-'):
+            field, order, operator = sort[1:], 'desc', 'lte'
+        else:
+            field, order, operator = sort, 'asc', 'gte'
+        value, skip = cursor or (None, 0)
+
+        body = self.body
+        if value is not None:
+            body = copy.deepcopy(self.body)
+            body['query']['filtered']['filter']['bool']['must'].append({'range': {field: {operator: value}}})
+
+        search_results = self.client.search(
+            index=index, body=body, from_=skip, size=size, sort=['%s:%s' % (field, order), '_uid:%s' % order])
+        hits = search_results['hits']['hits']
+
+        next_cursor = None
+        if hits and len(hits) == size:
+            last_value = hits[-1]['sort'][0]
+            count = len([hit for hit in hits if hit['sort'][0] == last_value])
+            next_cursor = (last_value, count + skip if last_value == value else count)
+
+        return {
+            'events': [r['_source'] for r in hits],
+            'cursor': next_cursor,
+        }
+
+    def scan_events(self, index='_all', scroll='5m', size=SCAN_BATCH_SIZE):
+        """ Walk through all matching events with scroll API without sorting """
+        for hit in helpers.scan(self.client, query=self.body, index=index, scroll=scroll, size=size):
+            yield hit['_source']
+
     def get_count(self, index='_all'):
         count_results = self.client.count(index=index, body=self.body)
         return count_results['count']
@@ -274,6 +412,99 @@ class ElasticsearchClient(object):
             formatted_results.append(formatted)
         return formatted_results
 
+    def get_count_history(self, points, index='_all'):
+        """
+        Return count of events created before each point.
+
+        Points split time into adjacent periods, so each event is counted once by
+        date_range aggregation and counts of points are cumulative sums of periods counts.
+        Counts of finished periods are cached for current search query, only other periods
+        are requested from Elasticsearch.
+        """
+        points = sorted(set(points))
+        periods = zip([None] + points[:-1], points)
+        closed_until = timezone.now() - COUNT_HISTORY_DELIVERY_DELAY
+        query_hash = self._get_query_hash()
+
+        def get_cache_key(period):
+            start, end = period
+            return 'elasticsearch_count_%s_%s_%s' % (
+                query_hash, start and datetime_to_timestamp(start), datetime_to_timestamp(end))
+
+        closed_periods = [period for period in periods if period[1] <= closed_until]
+        cached_counts = cache.get_many([get_cache_key(period) for period in closed_periods])
+        counts = {period: cached_counts[get_cache_key(period)] for period in periods
+                  if get_cache_key(period) in cached_counts}
+
+        missing_periods = [period for period in periods if period not in counts]
+        if missing_periods:
+            counts.update(self._get_periods_counts(missing_periods, index))
+            cache.set_many({get_cache_key(period): counts[period]
+                            for period in missing_periods if period in closed_periods},
+                           COUNT_HISTORY_CACHE_TIMEOUT)
+
+        history = []
+        total = 0
+        for period in periods:
+            total += counts[period]
+            history.append({'end': datetime_to_timestamp(period[1]), 'count': total})
+        return history
+
+    def _get_periods_counts(self, periods, index):
+        ranges = []
+        for key, (start, end) in enumerate(periods):
+            period_range = {'key': str(key), 'to': self.body.datetime_to_elasticsearch_timestamp(end)}
+            if start is not None:
+                period_range['from'] = self.body.datetime_to_elasticsearch_timestamp(start)
+            ranges.append(period_range)
+
+        body = {
+            'query': self.body['query'],
+            'aggs': {
+                'periods': {
+                    'date_range': {'field': '@timestamp', 'ranges': ranges, 'keyed': True},
+                },
+            },
+        }
+        search_results = self.client.search(index=index, body=body, search_type='count')
+        buckets = search_results['aggregations']['periods']['buckets']
+        return {period: buckets[str(key)]['doc_count'] for key, period in enumerate(periods)}
+
+    def _get_query_hash(self):
+        """ Hash of search query that does not depend on order of terms """
+        def normalize(value):
+            if isinstance(value, dict):
+                return {key: normalize(item) for key, item in value.items()}
+            if isinstance(value, list):
+                items = [normalize(item) for item in value]
+                return sorted(items) if all(isinstance(item, basestring) for item in items) else items
+            return value
+
+        return hashlib.md5(json.dumps(normalize(self.body['query']), sort_keys=True)).hexdigest()
+
+    def _get_terms_lookup(self, terms, doc_type='terms_lookup'):
+        """
+        Store large terms as document in Elasticsearch and return terms lookup filters
+        that reference this document, so terms are not sent inline with each query.
+
+        Terms lookup is enabled only if "terms_lookup_index" is defined in Elasticsearch settings.
+        Document ID is derived from terms, so each distinct set of terms is indexed only once.
+        """
+        elasticsearch_settings = self._get_elastisearch_settings()
+        index = elasticsearch_settings.get('terms_lookup_index')
+        threshold = elasticsearch_settings.get('terms_lookup_threshold', 1000)
+        if not index or not terms or sum(len(value) for value in terms.values()) < threshold:
+            return None
+
+        terms = {key: map(str, value) for key, value in terms.items()}
+        document_id = hashlib.md5(json.dumps(terms, sort_keys=True)).hexdigest()
+        cache_key = 'elasticsearch_terms_lookup_%s' % document_id
+        if not cache.get(cache_key):
+            self.client.index(index=index, doc_type=doc_type, id=document_id, body=terms)
+            cache.set(cache_key, True, TERMS_LOOKUP_CACHE_TIMEOUT)
+
+        return {key: {'index': index, 'type': doc_type, 'id': document_id, 'path': key} for key in terms}
+
     def _get_elastisearch_settings(self):
         try:
             return settings.NODECONDUCTOR['ELASTICSEARCH']
@@ -283,6 +514,13 @@ class ElasticsearchClient(object):
                 'to be defined.')
 
     def _get_client(self):
+        global _client
+        with _client_lock:
+            if _client is None:
+                _client = self._create_client()
+            return _client
+
+    def _create_client(self):
         elasticsearch_settings = self._get_elastisearch_settings()
         if elasticsearch_settings.get('username') and elasticsearch_settings.get('password'):
             path = '%(protocol)s://%(username)s:%(password)s@%(host)s:%(port)s' % elasticsearch_settings
@@ -292,6 +530,10 @@ class ElasticsearchClient(object):
             [str(path)],
             verify_certs=elasticsearch_settings.get('verify_certs', False),
             ca_certs=elasticsearch_settings.get('ca_certs', ''),
+            timeout=elasticsearch_settings.get('timeout', 10),
+            maxsize=elasticsearch_settings.get('maxsize', 10),
+            max_retries=elasticsearch_settings.get('max_retries', 3),
+            retry_on_timeout=True,
         )
         # XXX Workaround for Python Elasticsearch client bugs
         if not elasticsearch_settings.get('verify_certs'):
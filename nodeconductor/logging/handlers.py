@@ -1,6 +1,7 @@
 from django.contrib.contenttypes import models as ct_models
 
 from nodeconductor.logging import models
+from nodeconductor.logging.loggers import event_logger
 
 
 def remove_related_alerts(sender, instance, **kwargs):
@@ -8,3 +9,9 @@ def remove_related_alerts(sender, instance, **kwargs):
     for alert in models.Alert.objects.filter(
             object_id=instance.id, content_type=content_type, closed__isnull=True).iterator():
         alert.close()
+
+
+def invalidate_permitted_objects_uuids(sender, instance, created=True, **kwargs):
+    """ Loggable object is created or deleted, so set of objects visible to users is changed """
+    if created:
+        event_logger.invalidate_permitted_objects_uuids()
@@ -1,12 +1,22 @@
 """ Formatters, handlers and other stuff for default logging configuration """
 
+import Queue
 import json
 import datetime
+import fcntl
 import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
 
 from celery import current_app
 
 
+logger = logging.getLogger(__name__)
+
+
 class EventFormatter(logging.Formatter):
 
     def format_timestamp(self, time):
@@ -88,17 +98,195 @@ class RequireNotBackgroundTask(logging.Filter):
         return not is_background
 
 
-class TCPEventHandler(logging.handlers.SocketHandler, object):
+class TCPEventHandler(logging.Handler, object):
+    """ Send events to log server in background thread.
+
+        Formatted events are put to bounded queue, so emit never waits for log server.
+        Sender thread writes newline-delimited batches of events to TCP connection.
+        If log server is not available, batches are appended to spool file (if it is defined)
+        and sent after reconnection, otherwise sender retries the batch until queue overflows.
+        Events that do not fit into queue or spool are dropped and counted in "stats".
+        Stats are logged as warning once per "stats_interval" seconds if events were dropped
+        or log server was unavailable since the previous report.
+
+        Spool file can be shared by all worker processes: appends are serialized by flock
+        on "<spool_path>.lock" and file is renamed to "<spool_path>.<pid>" before replay,
+        so each spooled event is replayed by one process only.
+    """
 
-    def __init__(self, host='localhost', port=5959):
-        super(TCPEventHandler, self).__init__(host, int(port))
+    def __init__(self, host='localhost', port=5959, queue_size=10000, batch_size=100,
+                 spool_path=None, spool_max_size=100 * 1024 * 1024, timeout=5, stats_interval=300):
+        super(TCPEventHandler, self).__init__()
+        self.address = (host, int(port))
+        self.queue = Queue.Queue(int(queue_size))
+        self.batch_size = int(batch_size)
+        self.spool_path = spool_path
+        self.spool_max_size = int(spool_max_size)
+        self.timeout = float(timeout)
         self.formatter = EventFormatter()
+        self.stats_interval = float(stats_interval)
+        self.stats = {'sent': 0, 'dropped': 0, 'spooled': 0, 'failures': 0}
+        self.reported_stats = dict(self.stats)
+        self.reported_at = time.time()
+        self.sock = None
+        self.thread = None
+        self.pid = None
+        self.stopped = threading.Event()
+
+    def emit(self, record):
+        try:
+            line = self.format(record) + b'\n'
+        except Exception:
+            self.handleError(record)
+            return
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(line)
+        except Queue.Full:
+            self.stats['dropped'] += 1
+
+    def close(self):
+        if self.thread is not None and self.pid == os.getpid():
+            self.stopped.set()
+            self.thread.join(self.timeout)
+        super(TCPEventHandler, self).close()
+
+    def _ensure_thread(self):
+        # Thread does not survive fork of worker process, so it is started in each process.
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.queue = Queue.Queue(self.queue.maxsize)
+            self.sock = None
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, name='TCPEventHandler')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        backoff = 0
+        batch = []
+        while not (self.stopped.is_set() and self.queue.empty() and not batch):
+            self._report_stats()
+            if not batch:
+                batch = self._get_batch()
+                if not batch:
+                    continue
+            try:
+                self._flush_spool()
+                self._send(b''.join(batch))
+            except (IOError, socket.error):
+                self._close_socket()
+                self.stats['failures'] += 1
+                if self._spool(batch):
+                    batch = []
+                if self.stopped.is_set():
+                    break
+                backoff = min(backoff * 2 or 1, 30)
+                self.stopped.wait(backoff)
+            else:
+                self.stats['sent'] += len(batch)
+                batch = []
+                backoff = 0
+        self._close_socket()
+        self._report_stats(force=True)
+
+    def _report_stats(self, force=False):
+        if not force and time.time() - self.reported_at < self.stats_interval:
+            return
+        problems = ('dropped', 'failures', 'spooled')
+        if any(self.stats[key] != self.reported_stats[key] for key in problems):
+            # Report is sent by this handler too, it is queued like any other record.
+            logger.warning('Log server %s:%s is unavailable or slow, events stats: '
+                           'sent %s, spooled %s, dropped %s, connection failures %s.',
+                           self.address[0], self.address[1], self.stats['sent'], self.stats['spooled'],
+                           self.stats['dropped'], self.stats['failures'])
+        self.reported_stats = dict(self.stats)
+        self.reported_at = time.time()
+
+    def _get_batch(self):
+        try:
+            batch = [self.queue.get(timeout=1)]
+        except Queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _send(self, data):
+        if self.sock is None:
+            self.sock = socket.create_connection(self.address, self.timeout)
+        self.sock.sendall(data)
 
-    def makePickle(self, record):
-        return self.formatter.format(record) + b'\n'
+    def _close_socket(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+    def _spool(self, batch):
+        """ Append batch to spool file, return False if batch should be kept in memory """
+        if not self.spool_path:
+            return False
+        data = b''.join(batch)
+        try:
+            with self._lock_spool():
+                size = os.path.getsize(self.spool_path) if os.path.exists(self.spool_path) else 0
+                if size + len(data) > self.spool_max_size:
+                    self.stats['dropped'] += len(batch)
+                    return True
+                with open(self.spool_path, 'ab') as spool:
+                    spool.write(data)
+        except (IOError, OSError):
+            return False
+        self.stats['spooled'] += len(batch)
+        return True
+
+    def _flush_spool(self):
+        """ Send events from spool file, they may be sent twice if connection breaks during this """
+        if not self.spool_path:
+            return
+        # Events that were not replayed because of connection error are kept in the
+        # file of the process and are replayed before new events are taken from spool.
+        replay_path = '%s.%s' % (self.spool_path, os.getpid())
+        if not os.path.exists(replay_path):
+            with self._lock_spool():
+                if not os.path.exists(self.spool_path):
+                    return
+                os.rename(self.spool_path, replay_path)
+        with open(replay_path, 'rb') as spool:
+            for chunk in iter(lambda: spool.read(64 * 1024), b''):
+                self._send(chunk)
+        os.remove(replay_path)
+
+    @contextmanager
+    def _lock_spool(self):
+        with open(self.spool_path + '.lock', 'ab') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
 
 
 class HookHandler(logging.Handler):
+    """ Send events to hooks processing task in batches.
+
+        Events are buffered in process and published by single task when batch is full
+        or when flush interval has passed since the first event of the batch was buffered.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=1):
+        logging.Handler.__init__(self)
+        self.batch_size = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self.events = []
+        self.timer = None
+
     def emit(self, record):
         # Check that record contains event
         if hasattr(record, 'event_type') and hasattr(record, 'event_context'):
@@ -111,8 +299,36 @@ class HookHandler(logging.Handler):
                 'type': record.event_type,
                 'context': record.event_context
             }
-            # XXX: This import provides circular dependencies between core and
-            #      logging applications.
-            from nodeconductor.core.tasks import send_task
-            # Perform hook processing in background thread
-            send_task('logging', 'process_event')(event)
+            # Handler lock is already acquired by "handle" method.
+            self.events.append(event)
+            if len(self.events) >= self.batch_size:
+                self._flush()
+            # Timer thread does not survive fork of worker process, so it is restarted if it is not alive.
+            elif self.timer is None or not self.timer.is_alive():
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        self.acquire()
+        try:
+            self._flush()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        logging.Handler.close(self)
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.events:
+            return
+        events, self.events = self.events, []
+        # XXX: This import provides circular dependencies between core and
+        #      logging applications.
+        from nodeconductor.core.tasks import send_task
+        # Perform hook processing in background thread
+        send_task('logging', 'process_events')(events)
@@ -10,16 +10,22 @@ from collections import defaultdict
 
 from django.apps import apps
 from django.contrib.contenttypes import models as ct_models
+from django.core.cache import cache
 from django.db import transaction, IntegrityError
+from django.db.models import Case, CharField, Q, Value, When
 from django.utils import six
 
-from nodeconductor.logging import models
+from nodeconductor.logging import models, signals
 from nodeconductor.logging.log import EventLoggerAdapter
 from nodeconductor.logging.middleware import get_event_context
 
 
 logger = logging.getLogger(__name__)
 
+# Permitted UUIDs are invalidated explicitly, timeout is only a safety net.
+PERMITTED_OBJECTS_UUIDS_CACHE_TIMEOUT = 60 * 60
+PERMITTED_OBJECTS_UUIDS_VERSION_KEY = 'logging_permitted_objects_uuids_version'
+
 
 class LoggerError(AttributeError):
     pass
@@ -316,6 +322,89 @@ class AlertLogger(BaseLogger):
         except models.Alert.DoesNotExist:
             pass
 
+    def bulk_process(self, severity, message_template, scopes_contexts, alert_type='undefined'):
+        """ Open or refresh alerts of many scopes by few queries.
+
+            scopes_contexts is a list of (scope, alert_context) pairs. Open alerts are fetched by
+            single query, changed alerts are updated by single query and missing alerts are created
+            by bulk_create. Returns list of created alerts.
+        """
+        self.validate_logging_type(alert_type)
+
+        alerts = {}
+        scopes = {}
+        for scope, alert_context in scopes_contexts:
+            context = self.compile_context(**(alert_context or {}))
+            alert = models.Alert(
+                scope=scope,
+                alert_type=alert_type,
+                severity=severity,
+                message=self.compile_message(message_template, context),
+                context=context)
+            alerts[(alert.content_type_id, alert.object_id)] = alert
+            scopes[(alert.content_type_id, alert.object_id)] = scope
+        if not alerts:
+            return []
+
+        open_alerts = self._get_open_alerts(alerts.keys(), alert_type)
+        changed_alerts = {}
+        changed_scopes = []
+        for key, (alert_id, open_severity, open_message) in open_alerts.items():
+            alert = alerts[key]
+            if alert.severity != open_severity or alert.message != open_message:
+                changed_alerts[alert_id] = alert
+                changed_scopes.append(scopes[key])
+        if changed_alerts:
+            models.Alert.objects.filter(pk__in=changed_alerts.keys()).update(severity=severity, message=Case(
+                *[When(pk=alert_id, then=Value(alert.message)) for alert_id, alert in changed_alerts.items()],
+                output_field=CharField()))
+
+        new_alerts = [alert for key, alert in alerts.items() if key not in open_alerts]
+        new_scopes = [scopes[key] for key in alerts if key not in open_alerts]
+        try:
+            with transaction.atomic():
+                models.Alert.objects.bulk_create(new_alerts)
+        except IntegrityError:
+            logger.warning('Could not create alerts with type %s in bulk due to concurrent update, '
+                           'they are created one by one.', alert_type)
+            new_alerts = [alert for alert in new_alerts if self._create_alert(alert)]
+            new_scopes = [alert.scope for alert in new_alerts]
+
+        logger.info('Created %s and updated %s alerts with type %s.', len(new_alerts), len(changed_alerts), alert_type)
+        signals.alerts_bulk_changed.send(sender=models.Alert, scopes=new_scopes + changed_scopes)
+        return new_alerts
+
+    def bulk_close(self, scopes, alert_type):
+        """ Close open alerts of given type of many scopes by one query for search and one for update """
+        scopes = {(ct_models.ContentType.objects.get_for_model(scope).id, scope.id): scope for scope in scopes}
+        if not scopes:
+            return
+        open_alerts = self._get_open_alerts(scopes.keys(), alert_type)
+        models.Alert.bulk_close([alert_id for alert_id, _, _ in open_alerts.values()])
+        signals.alerts_bulk_changed.send(sender=models.Alert, scopes=[scopes[key] for key in open_alerts])
+
+    def _get_open_alerts(self, scope_keys, alert_type):
+        """ Map (content type ID, object ID) of open alerts to their ID, severity and message """
+        objects_ids = defaultdict(list)
+        for content_type_id, object_id in scope_keys:
+            objects_ids[content_type_id].append(object_id)
+        query = Q()
+        for content_type_id, ids in objects_ids.items():
+            query |= Q(content_type_id=content_type_id, object_id__in=ids)
+
+        open_alerts = models.Alert.objects.filter(query, alert_type=alert_type, closed__isnull=True).values_list(
+            'content_type_id', 'object_id', 'pk', 'severity', 'message')
+        return {(content_type_id, object_id): (alert_id, severity, message)
+                for content_type_id, object_id, alert_id, severity, message in open_alerts}
+
+    def _create_alert(self, alert):
+        try:
+            with transaction.atomic():
+                alert.save()
+            return True
+        except IntegrityError:
+            return False
+
 
 class LoggableMixin(object):
     """ Mixin to serialize model in logs.
@@ -401,13 +490,40 @@ class EventLoggerRegistry(BaseLoggerRegistry):
         return [l for l in self.__dict__.values() if isinstance(l, EventLogger)]
 
     def get_permitted_objects_uuids(self, user):
+        """
+        Return UUIDs of objects which events are visible to user grouped by event context field.
+        Result is cached until user permissions or set of loggable objects are changed.
+        """
+        key = self._get_permitted_objects_uuids_key(user)
+        permitted_objects_uuids = cache.get(key)
+        if permitted_objects_uuids is None:
+            permitted_objects_uuids = self._collect_permitted_objects_uuids(user)
+            cache.set(key, permitted_objects_uuids, PERMITTED_OBJECTS_UUIDS_CACHE_TIMEOUT)
+        return permitted_objects_uuids
+
+    def invalidate_permitted_objects_uuids(self, user=None):
+        """ Invalidate cached permitted UUIDs of given user or of all users if user is not specified """
+        if user is not None:
+            cache.delete(self._get_permitted_objects_uuids_key(user))
+        else:
+            # New version makes keys of all users obsolete.
+            cache.set(PERMITTED_OBJECTS_UUIDS_VERSION_KEY, uuid.uuid4().hex, None)
+
+    def _collect_permitted_objects_uuids(self, user):
         from nodeconductor.logging.utils import get_loggable_models
         permitted_objects_uuids = {}
         for model in get_loggable_models():
             for field, uuids in model.get_permitted_objects_uuids(user).items():
-                permitted_objects_uuids[field] = [uuid.hex for uuid in uuids]
+                permitted_objects_uuids[field] = [obj_uuid.hex for obj_uuid in uuids]
         return permitted_objects_uuids
 
+    def _get_permitted_objects_uuids_key(self, user):
+        version = cache.get(PERMITTED_OBJECTS_UUIDS_VERSION_KEY)
+        if version is None:
+            cache.add(PERMITTED_OBJECTS_UUIDS_VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(PERMITTED_OBJECTS_UUIDS_VERSION_KEY)
+        return 'logging_permitted_objects_uuids_%s_%s' % (version, user.uuid.hex)
+
 
 class AlertLoggerRegistry(BaseLoggerRegistry):
 
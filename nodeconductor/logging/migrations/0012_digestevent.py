@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logging', '0011_deadletter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DigestEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', jsonfield.fields.JSONField()),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('hook', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='digest_events', to='logging.EmailHook')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logging', '0012_digestevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digestevent',
+            name='claimed',
+            field=models.DateTimeField(null=True, blank=True),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from __future__ import unicode_literals
 
+import collections
+import datetime
+import json
 import uuid
 import logging
 
@@ -8,18 +11,17 @@ from django.conf import settings
 from django.contrib.contenttypes import fields as ct_fields
 from django.contrib.contenttypes import models as ct_models
 from django.core import validators
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.db import models
 from django.template.loader import render_to_string
 from django.utils.lru_cache import lru_cache
 from django.utils import timezone
 from jsonfield import JSONField
 from model_utils.models import TimeStampedModel
-import requests
 
 from nodeconductor.core.fields import UUIDField
 from nodeconductor.core.utils import timestamp_to_datetime
-from nodeconductor.logging import managers
+from nodeconductor.logging import delivery, managers
 
 
 logger = logging.getLogger(__name__)
@@ -68,6 +70,18 @@ class Alert(UuidMixin, TimeStampedModel):
         self.is_closed = uuid.uuid4().hex
         self.save()
 
+    @classmethod
+    def bulk_close(cls, alerts_ids, batch_size=500):
+        """ Close alerts by single UPDATE per batch, signals are not sent """
+        alerts_ids = list(alerts_ids)
+        closed = timezone.now()
+        for index in range(0, len(alerts_ids), batch_size):
+            batch = alerts_ids[index:index + batch_size]
+            # Each closed alert gets unique "is_closed" value to keep unique together constraint.
+            cls.objects.filter(pk__in=batch).update(closed=closed, is_closed=models.Case(
+                *[models.When(pk=alert_id, then=models.Value(uuid.uuid4().hex)) for alert_id in batch],
+                output_field=models.CharField()))
+
     def acknowledge(self):
         self.acknowledged = True
         self.save()
@@ -92,6 +106,14 @@ class AlertThresholdMixin(models.Model):
         """
         raise NotImplementedError
 
+    @classmethod
+    def get_over_threshold_query(cls):
+        """
+        It should return Q object that selects objects which are over threshold,
+        so they can be checked by single query. It should match "is_over_threshold".
+        """
+        raise NotImplementedError
+
     @classmethod
     @lru_cache(maxsize=1)
     def get_all_models(cls):
@@ -143,6 +165,35 @@ class BaseHook(EventTypesMixin, UuidMixin, TimeStampedModel):
         else:
             return self_types | set(base_types.event_types)
 
+    def process(self, event):
+        raise NotImplementedError()
+
+    def process_events(self, events):
+        """ Process batch of events, hook may override it to deliver events together """
+        hook_requests = self.get_requests({self: events})
+        if hook_requests is None:
+            for event in events:
+                self.process(event)
+        else:
+            delivery.send_requests(hook_requests)
+
+    @classmethod
+    def get_requests(cls, hooks_events):
+        """ Return HTTP requests that deliver events of given hooks or None if hooks deliver events themselves.
+
+            Requests of all hooks are sent concurrently by delivery module.
+        """
+        return None
+
+    @classmethod
+    def process_hooks_events(cls, hooks_events):
+        """ Process events of given hooks that deliver events themselves """
+        for hook, events in hooks_events.items():
+            try:
+                hook.process_events(events)
+            except Exception:
+                logger.exception('Failed to process %s events by hook %s.', len(events), hook.uuid.hex)
+
     @classmethod
     def get_active_hooks(cls):
         return [obj for hook in cls.__subclasses__() for obj in hook.objects.filter(is_active=True)]
@@ -166,15 +217,19 @@ class WebHook(BaseHook):
     )
 
     def process(self, event):
-        logger.debug('Submitting web hook to URL %s, payload: %s', self.destination_url, event)
-
-        # encode event as JSON
-        if self.content_type == WebHook.ContentTypeChoices.JSON:
-            requests.post(self.destination_url, json=event, verify=settings.VERIFY_WEBHOOK_REQUESTS)
+        self.process_events([event])
 
-        # encode event as form
-        elif self.content_type == WebHook.ContentTypeChoices.FORM:
-            requests.post(self.destination_url, data=event, verify=settings.VERIFY_WEBHOOK_REQUESTS)
+    @classmethod
+    def get_requests(cls, hooks_events):
+        hook_requests = []
+        for hook, events in hooks_events.items():
+            for event in events:
+                logger.debug('Submitting web hook to URL %s, payload: %s', hook.destination_url, event)
+                # encode event as JSON or as form
+                payload_key = 'json' if hook.content_type == WebHook.ContentTypeChoices.JSON else 'data'
+                hook_requests.append(delivery.HookRequest(
+                    hook.destination_url, {payload_key: event, 'verify': settings.VERIFY_WEBHOOK_REQUESTS}))
+        return hook_requests
 
 
 class PushHook(BaseHook):
@@ -194,7 +249,15 @@ class PushHook(BaseHook):
     token = models.CharField(max_length=255, null=True, unique=True)
 
     def process(self, event):
-        """ Send events as push notification via Google Cloud Messaging.
+        self.process_events([event])
+
+    # Maximum number of devices that can receive single Google Cloud Messaging message.
+    MAX_REGISTRATION_IDS = 1000
+
+    @classmethod
+    def get_requests(cls, hooks_events):
+        """ Send events as push notifications via Google Cloud Messaging.
+            Event is sent to all devices of the same type by single message.
             Expected settings as follows:
 
                 # https://developers.google.com/mobile/add
@@ -210,43 +273,106 @@ class PushHook(BaseHook):
         """
 
         conf = settings.NODECONDUCTOR.get('GOOGLE_API') or {}
-        keys = conf.get(dict(self.Type.CHOICES)[self.type])
 
-        if not keys or not self.token:
-            return
+        tokens = collections.OrderedDict()
+        for hook, events in hooks_events.items():
+            if not hook.token or not conf.get(dict(cls.Type.CHOICES)[hook.type]):
+                continue
+            for event in events:
+                key = (hook.type, json.dumps(event, sort_keys=True))
+                tokens.setdefault(key, (event, []))[1].append(hook.token)
 
         endpoint = 'https://gcm-http.googleapis.com/gcm/send'
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': 'key=%s' % keys['server_key'],
-        }
-        payload = {
-            'to': self.token,
-            'notification': {
-                'body': event.get('message', 'New event'),
-                'title': conf.get('NOTIFICATION_TITLE', 'NodeConductor notification'),
-                'image': 'icon',
-            },
-            'data': {
-                'event': event
-            },
-        }
-        if self.type == self.Type.IOS:
-            payload['content-available'] = '1'
-        logger.debug('Submitting GCM push notification with headers %s, payload: %s' % (headers, payload))
-        requests.post(endpoint, json=payload, headers=headers)
+        hook_requests = []
+        for (hook_type, _), (event, event_tokens) in tokens.items():
+            headers = {'Content-Type': 'application/json'}
+            for index in range(0, len(event_tokens), cls.MAX_REGISTRATION_IDS):
+                payload = {
+                    'registration_ids': event_tokens[index:index + cls.MAX_REGISTRATION_IDS],
+                    'notification': {
+                        'body': event.get('message', 'New event'),
+                        'title': conf.get('NOTIFICATION_TITLE', 'NodeConductor notification'),
+                        'image': 'icon',
+                    },
+                    'data': {
+                        'event': event
+                    },
+                }
+                if hook_type == cls.Type.IOS:
+                    payload['content-available'] = '1'
+                logger.debug('Submitting GCM push notification with payload: %s', payload)
+                hook_requests.append(delivery.HookRequest(
+                    endpoint, {'json': payload, 'headers': headers}, hook=(cls._meta.label, hook_type)))
+        return hook_requests
+
+    @classmethod
+    def get_request_headers(cls, hook_type):
+        """ Return authorization headers of GCM request, server key is not stored in request """
+        keys = settings.NODECONDUCTOR['GOOGLE_API'][dict(cls.Type.CHOICES)[hook_type]]
+        return {'Authorization': 'key=%s' % keys['server_key']}
 
 
 class EmailHook(BaseHook):
     email = models.EmailField(max_length=75)
 
     def process(self, event):
+        self.process_events([event])
+
+    def process_events(self, events):
+        self.process_hooks_events({self: events})
+
+    @classmethod
+    def process_hooks_events(cls, hooks_events):
+        """ Send all events of each hook by single email.
+            If digest interval is defined, events are accumulated and sent later by digest.
+        """
+        if settings.NODECONDUCTOR.get('EMAIL_HOOKS_DIGEST_INTERVAL'):
+            DigestEvent.objects.bulk_create([
+                DigestEvent(hook=hook, event=event) for hook, events in hooks_events.items() for event in events])
+            return
+        try:
+            cls.send_emails(hooks_events)
+        except Exception:
+            logger.exception('Failed to send emails of %s email hooks.', len(hooks_events))
+
+    @classmethod
+    def send_emails(cls, hooks_events):
+        """ Send emails of all hooks by single SMTP connection """
+        messages = [hook.get_message(events) for hook, events in hooks_events.items() if events]
+        if messages:
+            get_connection().send_messages(messages)
+
+    def get_message(self, events):
         subject = 'Notifications from NodeConductor'
-        event['timestamp'] = timestamp_to_datetime(event['timestamp'])
-        text_message = event['message']
-        html_message = render_to_string('logging/email.html', {'events': [event]})
-        logger.debug('Submitting email hook to %s, payload: %s', self.email, event)
-        send_mail(subject, text_message, settings.DEFAULT_FROM_EMAIL, [self.email], html_message=html_message)
+        events = [dict(event, timestamp=timestamp_to_datetime(event['timestamp'])) for event in events]
+        text_message = '\n'.join(event['message'] for event in events)
+        html_message = render_to_string('logging/email.html', {'events': events})
+        logger.debug('Submitting email hook to %s, payload: %s', self.email, events)
+        message = EmailMultiAlternatives(subject, text_message, settings.DEFAULT_FROM_EMAIL, [self.email])
+        message.attach_alternative(html_message, 'text/html')
+        return message
+
+
+class DigestEvent(models.Model):
+    """ Event that is postponed to email hook digest.
+
+        Event is claimed by task that sends digest, claim expires after
+        CLAIM_TIMEOUT if task has been lost.
+    """
+    CLAIM_TIMEOUT = datetime.timedelta(hours=1)
+
+    hook = models.ForeignKey(EmailHook, related_name='digest_events')
+    event = JSONField()
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+    claimed = models.DateTimeField(null=True, blank=True)
+
+
+class DeadLetter(TimeStampedModel):
+    """ Hook request that was not delivered after all attempts """
+    url = models.URLField(max_length=255)
+    payload = JSONField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
 
 
 class SystemNotification(EventTypesMixin, models.Model):
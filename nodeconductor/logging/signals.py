@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent when alerts are opened or closed in bulk instead of alerts saving.
+# sender = Alert class
+alerts_bulk_changed = Signal(providing_args=['scopes'])
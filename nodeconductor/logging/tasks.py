@@ -1,11 +1,17 @@
+import collections
 import logging
 
 from celery import shared_task
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Min, Q
 from django.utils import timezone
 
+from nodeconductor.logging import delivery, signals
 from nodeconductor.logging.loggers import alert_logger, event_logger
-from nodeconductor.logging.models import BaseHook, Alert, AlertThresholdMixin
+from nodeconductor.logging.models import (
+    BaseHook, Alert, AlertThresholdMixin, DigestEvent, EmailHook, SystemNotification)
 
 
 logger = logging.getLogger(__name__)
@@ -13,27 +19,132 @@ logger = logging.getLogger(__name__)
 
 @shared_task(name='nodeconductor.logging.process_event')
 def process_event(event):
-    for hook in BaseHook.get_active_hooks():
-        if check_event(event, hook):
-            hook.process(event)
+    process_events([event])
 
 
-def check_event(event, hook):
-    # Check that event matches with hook
-    if event['type'] not in hook.all_event_types:
-        return False
-    for key, uuids in event_logger.get_permitted_objects_uuids(hook.user).items():
+@shared_task(name='nodeconductor.logging.process_events')
+def process_events(events):
+    """ Deliver batch of events to hooks.
+
+        Active hooks are indexed by event type and permissions of each hook owner
+        are resolved once per batch. Each hook receives all its events together.
+    """
+    hooks_by_event_type = _get_hooks_by_event_type()
+    permitted_objects_uuids = {}
+    hooks_events = {}
+
+    for event in events:
+        for hook in hooks_by_event_type.get(event['type'], []):
+            if hook.user_id not in permitted_objects_uuids:
+                permitted_objects_uuids[hook.user_id] = {
+                    key: set(uuids) for key, uuids in event_logger.get_permitted_objects_uuids(hook.user).items()}
+            if check_event(event, permitted_objects_uuids[hook.user_id]):
+                hooks_events.setdefault(hook, []).append(event)
+
+    # Requests of HTTP hooks are sent together, other hooks process their events themselves.
+    hook_requests = []
+    self_delivered_hooks_events = []
+    for model in BaseHook.get_all_models():
+        model_hooks_events = {hook: hook_events for hook, hook_events in hooks_events.items()
+                              if type(hook) is model}
+        if not model_hooks_events:
+            continue
+        model_requests = model.get_requests(model_hooks_events)
+        if model_requests is not None:
+            hook_requests.extend(model_requests)
+        else:
+            self_delivered_hooks_events.append((model, model_hooks_events))
+    delivery.send_requests(hook_requests)
+    for model, model_hooks_events in self_delivered_hooks_events:
+        model.process_hooks_events(model_hooks_events)
+
+
+@shared_task(name='nodeconductor.logging.retry_hook_requests')
+def retry_hook_requests(hook_requests, attempt):
+    """ Send hook requests that have failed on previous attempt """
+    delivery.send_requests([delivery.HookRequest(*hook_request) for hook_request in hook_requests], attempt)
+
+
+def _get_hooks_by_event_type():
+    """ Map event type to active hooks that are subscribed to it, including system notifications """
+    system_event_types = {notification.hook_content_type_id: notification.event_types
+                          for notification in SystemNotification.objects.all()}
+    hooks_by_event_type = collections.defaultdict(list)
+    for model in BaseHook.get_all_models():
+        content_type = ContentType.objects.get_for_model(model)
+        for hook in model.objects.filter(is_active=True).select_related('user'):
+            event_types = set(hook.event_types) | set(system_event_types.get(content_type.id, []))
+            for event_type in event_types:
+                hooks_by_event_type[event_type].append(hook)
+    return hooks_by_event_type
+
+
+def check_event(event, permitted_objects_uuids):
+    """ Check that event is related to one of objects permitted to hook owner """
+    for key, uuids in permitted_objects_uuids.items():
         if key in event['context'] and event['context'][key] in uuids:
             return True
     return False
 
 
+@shared_task(name='nodeconductor.logging.send_email_digests')
+def send_email_digests():
+    """ Send accumulated events of email hooks which first postponed event is older than digest interval.
+
+        Events are claimed by short transaction and emails are sent outside of it,
+        so SMTP does not hold database locks. All digests are sent by single SMTP connection.
+    """
+    digest_events = DigestEvent.objects.all()
+    interval = settings.NODECONDUCTOR.get('EMAIL_HOOKS_DIGEST_INTERVAL')
+    if interval:
+        due_hooks = (digest_events.values('hook').annotate(first_created=Min('created'))
+                     .filter(first_created__lte=timezone.now() - interval).values('hook'))
+        digest_events = digest_events.filter(hook__in=due_hooks)
+
+    now = timezone.now()
+    with transaction.atomic():
+        claimed_events = (digest_events.select_for_update()
+                          .filter(Q(claimed__isnull=True) | Q(claimed__lte=now - DigestEvent.CLAIM_TIMEOUT)))
+        pks = list(claimed_events.values_list('pk', flat=True))
+        if not pks:
+            return
+        DigestEvent.objects.filter(pk__in=pks).update(claimed=now)
+
+    hooks_events = collections.OrderedDict()
+    for digest_event in DigestEvent.objects.filter(pk__in=pks).select_related('hook').order_by('created', 'pk'):
+        hooks_events.setdefault(digest_event.hook, []).append(digest_event.event)
+
+    # Events are deleted only after emails are sent, so failed digests are sent on the next run.
+    try:
+        EmailHook.send_emails(hooks_events)
+    except Exception:
+        logger.exception('Failed to send email digests, they will be sent on the next run.')
+        DigestEvent.objects.filter(pk__in=pks, claimed=now).update(claimed=None)
+        return
+    DigestEvent.objects.filter(pk__in=pks).delete()
+    logger.info('%s email digests were sent.', len(hooks_events))
+
+
 @shared_task(name='nodeconductor.logging.close_alerts_without_scope')
 def close_alerts_without_scope():
-    for alert in Alert.objects.filter(closed__isnull=True).iterator():
-        if alert.scope is None:
-            logger.error('Alert without scope was not closed. Alert id: %s.', alert.id)
-            alert.close()
+    """ Close open alerts which scope does not exist anymore.
+
+        Alerts without scope are found by single anti-join query per scope content type.
+    """
+    open_alerts = Alert.objects.filter(closed__isnull=True)
+    orphans_ids = list(open_alerts.filter(content_type__isnull=True).values_list('pk', flat=True))
+    for content_type_id in open_alerts.values_list('content_type_id', flat=True).distinct().order_by():
+        if content_type_id is None:
+            continue
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        content_type_alerts = open_alerts.filter(content_type_id=content_type_id)
+        if model is not None:
+            content_type_alerts = content_type_alerts.exclude(object_id__in=model._base_manager.values('pk'))
+        orphans_ids.extend(content_type_alerts.values_list('pk', flat=True))
+
+    if orphans_ids:
+        logger.error('Alerts without scope were not closed. Alerts ids: %s.', ', '.join(map(str, orphans_ids)))
+        Alert.bulk_close(orphans_ids)
 
 
 @shared_task(name='nodeconductor.logging.alerts_cleanup')
@@ -45,17 +156,51 @@ def alerts_cleanup():
 
 @shared_task(name='nodeconductor.logging.check_threshold')
 def check_threshold():
+    """ Open threshold alerts for scopes of objects that are over threshold, close alerts of other checked scopes.
+
+        Objects over threshold are selected by single query per model and compared
+        with open alerts, so only alerts that should be opened or closed are written.
+    """
+    alert_type = 'threshold_exceeded'
+    checked_scopes = set()
+    exceeded_objects = {}
     for model in AlertThresholdMixin.get_all_models():
-        for obj in model.get_checkable_objects().filter(threshold__gt=0).iterator():
-            if obj.is_over_threshold() and obj.scope:
-                alert_logger.threshold.warning(
-                    'Threshold for {scope_name} is exceeded.',
-                    scope=obj.scope,
-                    alert_type='threshold_exceeded',
-                    alert_context={
-                        'object': obj
-                    })
-            else:
-                alert_logger.threshold.close(
-                    scope=obj.scope,
-                    alert_type='threshold_exceeded')
+        scope_field = model._meta.get_field('scope')
+        scope_fields = (scope_field.ct_field, scope_field.fk_field)
+        objects = model.get_checkable_objects().filter(threshold__gt=0)
+        checked_scopes.update(objects.values_list(*scope_fields))
+        for values in objects.filter(model.get_over_threshold_query()).values_list('pk', *scope_fields):
+            exceeded_objects.setdefault(values[1:], (model, values[0]))
+
+    open_alerts = {(content_type_id, object_id): alert_id for content_type_id, object_id, alert_id in
+                   Alert.objects.filter(alert_type=alert_type, closed__isnull=True).values_list(
+                       'content_type_id', 'object_id', 'pk')}
+
+    new_alerts_objects = collections.defaultdict(list)
+    for scope_key, (model, object_id) in exceeded_objects.items():
+        if scope_key not in open_alerts:
+            new_alerts_objects[model].append(object_id)
+    _open_threshold_alerts(new_alerts_objects, alert_type)
+
+    closed_alerts_ids = [alert_id for scope_key, alert_id in open_alerts.items()
+                         if scope_key in checked_scopes and scope_key not in exceeded_objects]
+    _close_alerts(closed_alerts_ids)
+
+
+def _open_threshold_alerts(models_objects_ids, alert_type):
+    scopes_contexts = []
+    for model, objects_ids in models_objects_ids.items():
+        for obj in model.objects.filter(pk__in=objects_ids).prefetch_related('scope'):
+            if obj.scope is not None:
+                scopes_contexts.append((obj.scope, {'object': obj}))
+    alert_logger.threshold.bulk_process(
+        Alert.SeverityChoices.WARNING, 'Threshold for {scope_name} is exceeded.', scopes_contexts, alert_type)
+
+
+def _close_alerts(alerts_ids):
+    if not alerts_ids:
+        return
+    scopes = [alert.scope for alert in Alert.objects.filter(pk__in=alerts_ids).prefetch_related('scope')]
+    Alert.bulk_close(alerts_ids)
+    signals.alerts_bulk_changed.send(sender=Alert, scopes=[scope for scope in scopes if scope is not None])
+    logger.info('%s threshold alerts were closed.', len(alerts_ids))
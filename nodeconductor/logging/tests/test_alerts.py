@@ -8,7 +8,7 @@ from django.utils import timezone
 from rest_framework import test, status
 
 from nodeconductor.core import utils as core_utils
-from nodeconductor.logging import models, loggers
+from nodeconductor.logging import models, loggers, tasks
 from nodeconductor.logging.tests import factories
 # Dependency from `structure` application exists only in tests
 from nodeconductor.structure import models as structure_models
@@ -246,23 +246,24 @@ class TestAlertActions(test.APITransactionTestCase):
         self.assertFalse(reread_alert.acknowledged)
 
 
-class AlertUniquenessTest(test.APITransactionTestCase):
+def get_test_alert_logger():
+    if not hasattr(loggers.alert_logger, 'test_alert_logger'):
+        class TestAlertLogger(loggers.AlertLogger):
+            class Meta:
+                alert_types = ('test_alert',)
 
-    def setUp(self):
-        self.project = structure_factories.ProjectFactory()
+        loggers.alert_logger.register('test_alert_logger', TestAlertLogger)
+
+    return loggers.alert_logger.test_alert_logger
 
-    def get_logger(self):
-        if not hasattr(loggers.alert_logger, 'test_alert_logger'):
-            class TestAlertLogger(loggers.AlertLogger):
-                class Meta:
-                    alert_types = ('test_alert',)
 
-            loggers.alert_logger.register('test_alert_logger', TestAlertLogger)
+class AlertUniquenessTest(test.APITransactionTestCase):
 
-        return loggers.alert_logger.test_alert_logger
+    def setUp(self):
+        self.project = structure_factories.ProjectFactory()
 
     def log_alert(self):
-        return self.get_logger().info('Message', scope=self.project, alert_type='test_alert')
+        return get_test_alert_logger().info('Message', scope=self.project, alert_type='test_alert')
 
     def test_duplicate_alert_is_not_created(self):
         alert, created = self.log_alert()
@@ -277,3 +278,64 @@ class AlertUniquenessTest(test.APITransactionTestCase):
 
             alert, created = self.log_alert()
             self.assertEqual(created, False)
+
+
+class BulkAlertLoggerTest(test.APITransactionTestCase):
+
+    def setUp(self):
+        self.projects = structure_factories.ProjectFactory.create_batch(3)
+        self.logger = get_test_alert_logger()
+
+    def get_open_alerts(self):
+        return models.Alert.objects.filter(alert_type='test_alert', closed__isnull=True)
+
+    def open_alerts(self, projects, message='Message'):
+        return self.logger.bulk_process(
+            models.Alert.SeverityChoices.INFO, message, [(project, None) for project in projects], 'test_alert')
+
+    def test_alerts_are_created_by_single_query(self):
+        # Counters invalidation is done by receivers of the signal and is not counted.
+        with mock.patch('nodeconductor.logging.loggers.signals'), self.assertNumQueries(3):
+            # Open alerts lookup and atomic block with bulk insert.
+            created = self.open_alerts(self.projects)
+
+        self.assertEqual(len(created), 3)
+        self.assertEqual(set(self.get_open_alerts().values_list('object_id', flat=True)),
+                         {project.id for project in self.projects})
+
+    def test_only_missing_alerts_are_created(self):
+        self.open_alerts(self.projects[:1])
+
+        created = self.open_alerts(self.projects)
+
+        self.assertEqual(len(created), 2)
+        self.assertEqual(self.get_open_alerts().count(), 3)
+
+    def test_changed_alerts_are_updated(self):
+        self.open_alerts(self.projects)
+
+        self.open_alerts(self.projects, message='New message')
+
+        self.assertEqual(set(self.get_open_alerts().values_list('message', flat=True)), {'New message'})
+
+    def test_alerts_are_closed_in_bulk(self):
+        self.open_alerts(self.projects)
+
+        self.logger.bulk_close(self.projects[:2], 'test_alert')
+
+        self.assertEqual(list(self.get_open_alerts().values_list('object_id', flat=True)), [self.projects[2].id])
+        # Closed alerts do not prevent opening of new ones.
+        self.assertEqual(len(self.open_alerts(self.projects)), 2)
+
+
+class CloseAlertsWithoutScopeTest(test.APITransactionTestCase):
+
+    def test_alerts_of_deleted_scopes_are_closed(self):
+        projects = structure_factories.ProjectFactory.create_batch(2)
+        alerts = [factories.AlertFactory(scope=project) for project in projects]
+        structure_models.Project.objects.filter(pk=projects[0].pk).delete()
+
+        tasks.close_alerts_without_scope()
+
+        self.assertIsNotNone(models.Alert.objects.get(pk=alerts[0].pk).closed)
+        self.assertIsNone(models.Alert.objects.get(pk=alerts[1].pk).closed)
@@ -0,0 +1,162 @@
+import BaseHTTPServer
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase
+import mock
+
+from nodeconductor.logging import delivery, models, tasks
+from nodeconductor.logging.tests import factories
+from nodeconductor.structure.tests import factories as structure_factories
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.payloads.append(json.loads(body))
+        self.server.cookies.append(self.headers.get('Cookie'))
+        self.server.authorizations.append(self.headers.get('Authorization'))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header('Set-Cookie', 'session=secret')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class DeliveryTest(TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.payloads = []
+        self.server.statuses = []
+        self.server.cookies = []
+        self.server.authorizations = []
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.url = 'http://127.0.0.1:%s/hook/' % self.server.server_port
+
+        nodeconductor_settings = settings.NODECONDUCTOR.copy()
+        nodeconductor_settings['HOOK_DELIVERY'] = {
+            'retry_backoff': 0,
+            'max_attempts': 2,
+            'circuit_failures_threshold': 2,
+        }
+        nodeconductor_settings['GOOGLE_API'] = {'Android': {'server_key': 'android-key'}}
+        self.settings_patcher = self.settings(NODECONDUCTOR=nodeconductor_settings)
+        self.settings_patcher.enable()
+        cache.clear()
+        # Retries are scheduled as celery task, here it is executed right away.
+        self.retries = []
+        send_task_patcher = mock.patch('nodeconductor.core.tasks.send_celery_task', side_effect=self.retry)
+        send_task_patcher.start()
+        self.addCleanup(send_task_patcher.stop)
+
+    def retry(self, name, args, kwargs, countdown):
+        self.retries.append((name, countdown, json.dumps(args)))
+        tasks.retry_hook_requests(*args, **kwargs)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.settings_patcher.disable()
+        cache.clear()
+
+    def send(self, *payloads):
+        delivery.send_requests([delivery.HookRequest(self.url, {'json': payload}) for payload in payloads])
+
+    def test_requests_are_delivered(self):
+        self.send({'message': 'first'}, {'message': 'second'})
+
+        self.assertEqual(self.server.payloads, [{'message': 'first'}, {'message': 'second'}])
+        self.assertFalse(models.DeadLetter.objects.exists())
+
+    def test_failed_request_is_retried(self):
+        self.server.statuses = [503]
+
+        self.send({'message': 'first'})
+
+        self.assertEqual(len(self.server.payloads), 2)
+        self.assertEqual([retry[:2] for retry in self.retries], [('nodeconductor.logging.retry_hook_requests', 0)])
+        self.assertFalse(models.DeadLetter.objects.exists())
+
+    def test_request_is_stored_as_dead_letter_if_all_attempts_failed(self):
+        self.server.statuses = [503, 503]
+
+        self.send({'message': 'first'})
+
+        dead_letter = models.DeadLetter.objects.get()
+        self.assertEqual(dead_letter.url, self.url)
+        self.assertEqual(dead_letter.payload, {'message': 'first'})
+        self.assertEqual(dead_letter.attempts, 2)
+
+    def test_rejected_request_is_not_retried(self):
+        self.server.statuses = [400]
+
+        self.send({'message': 'first'})
+
+        self.assertEqual(len(self.server.payloads), 1)
+        self.assertEqual(models.DeadLetter.objects.get().attempts, 1)
+
+    def test_delivery_to_destination_is_suspended_after_consecutive_failures(self):
+        self.server.statuses = [503] * 2
+
+        self.send({'message': 'first'}, {'message': 'second'}, {'message': 'third'})
+
+        # Third request and retries are not sent because circuit is open after two failed attempts.
+        self.assertEqual(len(self.server.payloads), 2)
+        self.assertEqual(models.DeadLetter.objects.filter(attempts=0).count(), 1)
+        self.assertEqual(models.DeadLetter.objects.filter(attempts=1).count(), 2)
+
+    def test_cookies_are_not_shared_between_requests(self):
+        self.send({'message': 'first'})
+        self.send({'message': 'second'})
+
+        self.assertEqual(self.server.cookies, [None, None])
+
+    def test_secret_headers_are_not_passed_to_retry_task(self):
+        self.server.statuses = [503]
+        hook_request = delivery.HookRequest(
+            self.url, {'json': {'message': 'first'}}, hook=('logging.PushHook', models.PushHook.Type.ANDROID))
+
+        delivery.send_requests([hook_request])
+
+        self.assertNotIn('android-key', self.retries[0][2])
+        self.assertEqual(self.server.authorizations, ['key=android-key'] * 2)
+
+
+class PushHookRequestsTest(TestCase):
+
+    def setUp(self):
+        nodeconductor_settings = settings.NODECONDUCTOR.copy()
+        nodeconductor_settings['GOOGLE_API'] = {
+            'Android': {'server_key': 'android-key'},
+            'iOS': {'server_key': 'ios-key'},
+        }
+        self.settings_patcher = self.settings(NODECONDUCTOR=nodeconductor_settings)
+        self.settings_patcher.enable()
+
+    def tearDown(self):
+        self.settings_patcher.disable()
+
+    def test_event_is_sent_to_devices_of_the_same_type_by_single_message(self):
+        event = {'message': 'message', 'type': 'test_event'}
+        user = structure_factories.UserFactory()
+        hooks_events = {
+            factories.PushHookFactory(user=user, type=models.PushHook.Type.ANDROID, token='token-%s' % index): [event]
+            for index in range(3)
+        }
+
+        hook_requests = models.PushHook.get_requests(hooks_events)
+
+        self.assertEqual(len(hook_requests), 1)
+        self.assertEqual(sorted(hook_requests[0].kwargs['json']['registration_ids']),
+                         ['token-0', 'token-1', 'token-2'])
+        self.assertNotIn('Authorization', hook_requests[0].kwargs['headers'])
+        self.assertEqual(hook_requests[0].get_kwargs()['headers']['Authorization'], 'key=android-key')
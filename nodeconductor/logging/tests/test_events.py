@@ -1,10 +1,14 @@
+import json
 import unittest
 
 import mock
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
 from rest_framework import test
 from rest_framework import status
 
+from nodeconductor.core import utils as core_utils
 from nodeconductor.structure import models as structure_models
 from nodeconductor.structure.tests import factories as structure_factories
 
@@ -116,3 +120,233 @@ class ScopeTest(BaseEventsApiTest):
         self.client.force_authenticate(user=owner)
         self._get_events_by_scope(structure_factories.CustomerFactory.get_url(customer))
         self.assertEqual(self.must_terms, {'customer_uuid.raw': [customer.uuid.hex]})
+
+
+class PermittedObjectsTest(BaseEventsApiTest):
+    def setUp(self):
+        super(PermittedObjectsTest, self).setUp()
+        self.customer = structure_factories.CustomerFactory()
+        self.owner = structure_factories.UserFactory()
+        self.customer.add_user(self.owner, structure_models.CustomerRole.OWNER)
+        self.client.force_authenticate(user=self.owner)
+
+    @property
+    def should_terms(self):
+        call_args = self.mocked_es().search.call_args[-1]
+        should = call_args['body']['query']['filtered']['filter']['bool']['should']
+        return {key: value for terms in should for key, value in terms['terms'].items()}
+
+    def test_permitted_objects_are_updated_when_role_is_granted(self):
+        self.client.get(factories.EventFactory.get_list_url())
+        self.assertEqual(self.should_terms['customer_uuid'], [self.customer.uuid.hex])
+
+        other_customer = structure_factories.CustomerFactory()
+        other_customer.add_user(self.owner, structure_models.CustomerRole.OWNER)
+
+        self.client.get(factories.EventFactory.get_list_url())
+        self.assertEqual(set(self.should_terms['customer_uuid']), {self.customer.uuid.hex, other_customer.uuid.hex})
+
+    def test_permitted_objects_are_updated_when_object_is_created(self):
+        self.client.get(factories.EventFactory.get_list_url())
+        self.assertEqual(self.should_terms['project_uuid'], [])
+
+        project = structure_factories.ProjectFactory(customer=self.customer)
+
+        self.client.get(factories.EventFactory.get_list_url())
+        self.assertEqual(self.should_terms['project_uuid'], [project.uuid.hex])
+
+    def test_large_terms_are_passed_via_terms_lookup(self):
+        settings.NODECONDUCTOR['ELASTICSEARCH']['terms_lookup_index'] = 'terms-lookup'
+        settings.NODECONDUCTOR['ELASTICSEARCH']['terms_lookup_threshold'] = 1
+
+        self.client.get(factories.EventFactory.get_list_url())
+
+        self.assertTrue(self.mocked_es().index.called)
+        document = self.mocked_es().index.call_args[-1]
+        self.assertEqual(document['body']['customer_uuid'], [self.customer.uuid.hex])
+        self.assertEqual(self.should_terms['customer_uuid'], {
+            'index': 'terms-lookup',
+            'type': 'terms_lookup',
+            'id': document['id'],
+            'path': 'customer_uuid',
+        })
+
+
+class EventsListTest(BaseEventsApiTest):
+    def setUp(self):
+        super(EventsListTest, self).setUp()
+        self.client.force_authenticate(user=structure_factories.UserFactory(is_staff=True))
+        events = [{'_source': {'message': 'message#%s' % index}} for index in range(5)]
+        self.mocked_es().search.return_value = {'hits': {'total': 25, 'hits': events}}
+
+    def test_page_and_total_count_are_fetched_by_single_search(self):
+        response = self.client.get(factories.EventFactory.get_list_url(), {'page': 2, 'page_size': 5})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Result-Count'], '25')
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(self.mocked_es().search.call_count, 1)
+        self.assertEqual(self.mocked_es().search.call_args[-1]['from_'], 5)
+        self.assertFalse(self.mocked_es().count.called)
+
+    def test_client_is_shared_between_requests(self):
+        self.mocked_es.reset_mock()
+
+        self.client.get(factories.EventFactory.get_list_url())
+        self.client.get(factories.EventFactory.get_list_url())
+
+        self.assertEqual(self.mocked_es.call_count, 1)
+
+
+class EventsCursorTest(BaseEventsApiTest):
+    def setUp(self):
+        super(EventsCursorTest, self).setUp()
+        self.client.force_authenticate(user=structure_factories.UserFactory(is_staff=True))
+        self.url = factories.EventFactory.get_list_url()
+
+    def set_hits(self, timestamps):
+        hits = [{'_source': {'message': 'message#%s' % index}, 'sort': [timestamp, 'event#%s' % index]}
+                for index, timestamp in enumerate(timestamps)]
+        self.mocked_es().search.return_value = {'hits': {'total': 25, 'hits': hits}}
+
+    def get_next_url(self, response):
+        return response['Link'][1:-len('>; rel="next"')]
+
+    @property
+    def search_kwargs(self):
+        return self.mocked_es().search.call_args[-1]
+
+    def test_first_page_is_fetched_without_offset(self):
+        self.set_hits([30, 20, 20])
+
+        response = self.client.get(self.url, {'cursor': '', 'page_size': 3})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(self.search_kwargs['from_'], 0)
+        self.assertEqual(self.search_kwargs['sort'], ['@timestamp:desc', '_uid:desc'])
+
+    def test_next_page_skips_only_events_with_last_sort_value(self):
+        self.set_hits([30, 20, 20])
+        response = self.client.get(self.url, {'cursor': '', 'page_size': 3})
+
+        self.client.get(self.get_next_url(response))
+
+        self.assertEqual(self.search_kwargs['from_'], 2)
+        self.assertEqual(self.search_kwargs['body']['query']['filtered']['filter']['bool']['must'][-1],
+                         {'range': {'@timestamp': {'lte': 20}}})
+
+    def test_skip_is_accumulated_if_all_events_have_the_same_sort_value(self):
+        self.set_hits([30, 20, 20])
+        response = self.client.get(self.url, {'cursor': '', 'page_size': 3})
+        self.set_hits([20, 20, 20])
+        response = self.client.get(self.get_next_url(response))
+
+        self.client.get(self.get_next_url(response))
+
+        self.assertEqual(self.search_kwargs['from_'], 5)
+
+    def test_next_link_is_not_returned_for_last_page(self):
+        self.set_hits([30, 20])
+
+        response = self.client.get(self.url, {'cursor': '', 'page_size': 3})
+
+        self.assertNotIn('Link', response)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(self.url, {'cursor': 'invalid'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EventsExportTest(BaseEventsApiTest):
+    def setUp(self):
+        super(EventsExportTest, self).setUp()
+        self.client.force_authenticate(user=structure_factories.UserFactory(is_staff=True))
+        self.url = factories.EventFactory.get_list_url() + 'export/'
+        self.scan_patcher = mock.patch('nodeconductor.logging.elasticsearch_client.helpers.scan')
+        self.mocked_scan = self.scan_patcher.start()
+        self.mocked_scan.return_value = iter([
+            {'_source': {'message': 'message#%s' % index, 'event_type': 'test_event'}} for index in range(3)
+        ])
+
+    def tearDown(self):
+        self.scan_patcher.stop()
+        super(EventsExportTest, self).tearDown()
+
+    def test_events_are_exported_as_ndjson_by_default(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual([json.loads(line)['message'] for line in lines], ['message#0', 'message#1', 'message#2'])
+        self.assertEqual(self.mocked_scan.call_args[-1]['scroll'], '5m')
+
+    def test_events_are_exported_as_csv(self):
+        response = self.client.get(self.url, {'file_format': 'csv', 'field': ['event_type', 'message']})
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(b''.join(response.streaming_content).splitlines(), [
+            'event_type,message',
+            'test_event,message#0',
+            'test_event,message#1',
+            'test_event,message#2',
+        ])
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get(self.url, {'file_format': 'xml'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EventsCountHistoryTest(BaseEventsApiTest):
+    def setUp(self):
+        super(EventsCountHistoryTest, self).setUp()
+        self.client.force_authenticate(user=structure_factories.UserFactory(is_staff=True))
+        self.url = factories.EventFactory.get_list_url() + 'count/history/'
+        self.mocked_es().search.side_effect = self.search
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+        super(EventsCountHistoryTest, self).tearDown()
+
+    def search(self, body, **kwargs):
+        # Each period contains 10 events.
+        ranges = body['aggs']['periods']['date_range']['ranges']
+        buckets = {r['key']: {'doc_count': 10} for r in ranges}
+        return {'aggregations': {'periods': {'buckets': buckets}}}
+
+    def get_history(self, points):
+        response = self.client.get(self.url, {'point': points})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    @property
+    def requested_ranges(self):
+        return self.mocked_es().search.call_args[-1]['body']['aggs']['periods']['date_range']['ranges']
+
+    def test_counts_are_cumulative_sums_of_periods_counts(self):
+        now = core_utils.datetime_to_timestamp(timezone.now())
+        points = [now - 300 * 60, now - 200 * 60, now - 100 * 60]
+
+        history = self.get_history(points)
+
+        self.assertEqual([item['object']['count'] for item in history], [10, 20, 30])
+        self.assertEqual(len(self.requested_ranges), 3)
+        self.assertNotIn('from', self.requested_ranges[0])
+        self.assertEqual(self.requested_ranges[1]['from'], self.requested_ranges[0]['to'])
+
+    def test_only_open_period_is_requested_if_closed_periods_are_cached(self):
+        now = core_utils.datetime_to_timestamp(timezone.now())
+        points = [now - 200 * 60, now - 100 * 60, now]
+        self.get_history(points)
+
+        history = self.get_history(points)
+
+        self.assertEqual([item['object']['count'] for item in history], [10, 20, 30])
+        self.assertEqual(self.requested_ranges, [{
+            'key': '0',
+            'from': (now - 100 * 60) * 1000,
+            'to': now * 1000,
+        }])
@@ -1,14 +1,19 @@
 import logging
 import mock
+import smtplib
 import time
+from datetime import timedelta
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core import mail
+from django.db import connection
+from django.utils import timezone
 from rest_framework import test
 
 from nodeconductor.logging import models as logging_models
 from nodeconductor.logging.log import HookHandler
-from nodeconductor.logging.tasks import process_event
+from nodeconductor.logging.tasks import process_event, process_events, send_email_digests
 from nodeconductor.structure import models as structure_models
 from nodeconductor.structure.log import event_logger
 from nodeconductor.structure.tests import factories as structure_factories
@@ -37,20 +42,23 @@ class TestHookService(test.APITransactionTestCase):
                                                                   event_types=[self.event_type])
 
     @mock.patch('celery.app.base.Celery.send_task')
-    def test_logger_handler_sends_task_if_handler_attached(self, mocked_task):
+    def test_logger_handler_sends_batch_of_events_if_handler_attached(self, mocked_task):
         # Prepare logger
         logger = logging.getLogger('nodeconductor')
         logger.setLevel(logging.DEBUG)
 
         # Inject handler
-        handler = HookHandler()
+        handler = HookHandler(batch_size=2)
         logger.addHandler(handler)
 
-        event_logger.customer.warning(self.message,
-                                      event_type=self.event_type,
-                                      event_context={'customer': self.customer})
+        for _ in range(2):
+            event_logger.customer.warning(self.message,
+                                          event_type=self.event_type,
+                                          event_context={'customer': self.customer})
 
-        mocked_task.assert_called_once_with('nodeconductor.logging.process_event', mock.ANY, {}, countdown=2)
+        mocked_task.assert_called_once_with('nodeconductor.logging.process_events', mock.ANY, {}, countdown=2)
+        events = mocked_task.call_args[0][1][0]
+        self.assertEqual([event['type'] for event in events], [self.event_type, self.event_type])
         mocked_task.reset_mock()
 
         # Remove hook handler so that other tests won't depend on it
@@ -64,6 +72,23 @@ class TestHookService(test.APITransactionTestCase):
         # If hook handler is not attached hook is not processed
         self.assertFalse(mocked_task.called)
 
+    @mock.patch('celery.app.base.Celery.send_task')
+    def test_logger_handler_sends_incomplete_batch_on_close(self, mocked_task):
+        logger = logging.getLogger('nodeconductor')
+        logger.setLevel(logging.DEBUG)
+        handler = HookHandler(batch_size=10, flush_interval=60)
+        logger.addHandler(handler)
+
+        event_logger.customer.warning(self.message,
+                                      event_type=self.event_type,
+                                      event_context={'customer': self.customer})
+        logger.removeHandler(handler)
+        self.assertFalse(mocked_task.called)
+
+        handler.close()
+
+        mocked_task.assert_called_once_with('nodeconductor.logging.process_events', mock.ANY, {}, countdown=2)
+
     def test_email_hook_filters_events_by_user_and_event_type(self):
         # Create email hook for customer owner
         email_hook = logging_models.EmailHook.objects.create(user=self.owner,
@@ -79,7 +104,7 @@ class TestHookService(test.APITransactionTestCase):
         # Verify that destination address of message is correct
         self.assertEqual(mail.outbox[0].to, [email_hook.email])
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.post')
     def test_webhook_makes_post_request_against_destination_url(self, requests_post):
 
         # Create web hook for customer owner
@@ -92,4 +117,142 @@ class TestHookService(test.APITransactionTestCase):
 
         # Event is captured and POST request is triggererd because event_type and user_uuid match
         requests_post.assert_called_once_with(
-            self.web_hook.destination_url, json=mock.ANY, verify=settings.VERIFY_WEBHOOK_REQUESTS)
+            self.web_hook.destination_url, json=mock.ANY, verify=settings.VERIFY_WEBHOOK_REQUESTS, timeout=(5, 10))
+
+    @mock.patch('nodeconductor.logging.tasks.event_logger.get_permitted_objects_uuids')
+    def test_permissions_of_hook_owner_are_resolved_once_per_batch(self, get_permitted_objects_uuids):
+        get_permitted_objects_uuids.return_value = {'customer_uuid': [self.customer.uuid.hex]}
+        logging_models.EmailHook.objects.create(user=self.owner, email=self.owner.email,
+                                                event_types=[self.event_type, self.other_event])
+        other_event = dict(self.event, type=self.other_event)
+
+        process_events([self.event, other_event, self.event])
+
+        # Hooks of customer owner and other user are checked.
+        self.assertEqual(sorted(call[0][0].pk for call in get_permitted_objects_uuids.call_args_list),
+                         sorted([self.owner.pk, self.other_user.pk]))
+
+    def test_system_notification_event_types_are_routed_to_hooks(self):
+        logging_models.SystemNotification.objects.create(
+            hook_content_type=ContentType.objects.get_for_model(logging_models.EmailHook),
+            event_types=[self.other_event])
+        logging_models.EmailHook.objects.create(user=self.owner, email=self.owner.email, event_types=[])
+
+        process_events([dict(self.event, type=self.other_event)])
+
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class EmailDigestTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.owner = structure_factories.UserFactory()
+        self.customer = structure_factories.CustomerFactory()
+        self.customer.add_user(self.owner, structure_models.CustomerRole.OWNER)
+        self.event_type = 'customer_update_succeeded'
+        self.hook = logging_models.EmailHook.objects.create(
+            user=self.owner, email=self.owner.email, event_types=[self.event_type])
+        self.events = [{
+            'message': 'Customer has been updated %s times.' % index,
+            'type': self.event_type,
+            'context': event_logger.customer.compile_context(customer=self.customer),
+            'timestamp': time.time()
+        } for index in range(3)]
+
+    def digest_settings(self, interval):
+        nodeconductor_settings = settings.NODECONDUCTOR.copy()
+        nodeconductor_settings['EMAIL_HOOKS_DIGEST_INTERVAL'] = interval
+        return self.settings(NODECONDUCTOR=nodeconductor_settings)
+
+    def test_events_of_batch_are_sent_by_single_email(self):
+        process_events(self.events)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(self.events[2]['message'], mail.outbox[0].body)
+
+    def test_events_are_postponed_to_digest_if_digest_interval_is_defined(self):
+        with self.digest_settings(timedelta(minutes=15)):
+            process_events(self.events[:2])
+            process_events(self.events[2:])
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(self.hook.digest_events.count(), 3)
+
+    def test_due_digests_are_sent_by_single_connection(self):
+        other_hook = logging_models.EmailHook.objects.create(
+            user=self.owner, email='other@example.com', event_types=[self.event_type])
+        with self.digest_settings(timedelta(minutes=15)):
+            process_events(self.events)
+            logging_models.DigestEvent.objects.update(created=timezone.now() - timedelta(minutes=20))
+
+            with mock.patch('nodeconductor.logging.models.get_connection') as get_connection:
+                send_email_digests()
+
+        get_connection.assert_called_once_with()
+        messages = get_connection().send_messages.call_args[0][0]
+        self.assertEqual(sorted(message.to[0] for message in messages), sorted([self.hook.email, other_hook.email]))
+        self.assertFalse(logging_models.DigestEvent.objects.exists())
+
+    def test_digest_is_not_sent_before_interval_has_passed(self):
+        with self.digest_settings(timedelta(minutes=15)):
+            process_events(self.events)
+            send_email_digests()
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(self.hook.digest_events.count(), 3)
+
+    def test_digest_events_are_kept_if_emails_are_not_sent(self):
+        with self.digest_settings(timedelta(minutes=15)):
+            process_events(self.events)
+            logging_models.DigestEvent.objects.update(created=timezone.now() - timedelta(minutes=20))
+
+            with mock.patch('nodeconductor.logging.models.get_connection') as get_connection:
+                get_connection().send_messages.side_effect = smtplib.SMTPException
+                send_email_digests()
+
+        self.assertEqual(self.hook.digest_events.count(), 3)
+        self.assertFalse(self.hook.digest_events.filter(claimed__isnull=False).exists())
+
+    def test_digest_emails_are_sent_outside_of_transaction(self):
+        with self.digest_settings(timedelta(minutes=15)):
+            process_events(self.events)
+            logging_models.DigestEvent.objects.update(created=timezone.now() - timedelta(minutes=20))
+
+            with mock.patch('nodeconductor.logging.models.EmailHook.send_emails') as send_emails:
+                send_emails.side_effect = lambda hooks_events: self.assertFalse(connection.in_atomic_block)
+                send_email_digests()
+
+        self.assertEqual(send_emails.call_count, 1)
+        self.assertFalse(logging_models.DigestEvent.objects.exists())
+
+    def test_digest_events_claimed_by_other_task_are_not_sent(self):
+        with self.digest_settings(timedelta(minutes=15)):
+            process_events(self.events)
+            logging_models.DigestEvent.objects.update(
+                created=timezone.now() - timedelta(minutes=20), claimed=timezone.now())
+            send_email_digests()
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(self.hook.digest_events.count(), 3)
+
+    def test_digest_events_are_sent_if_claim_has_expired(self):
+        with self.digest_settings(timedelta(minutes=15)):
+            process_events(self.events)
+            logging_models.DigestEvent.objects.update(
+                created=timezone.now() - timedelta(minutes=20),
+                claimed=timezone.now() - logging_models.DigestEvent.CLAIM_TIMEOUT - timedelta(minutes=1))
+            send_email_digests()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(logging_models.DigestEvent.objects.exists())
+
+    @mock.patch('requests.Session.post')
+    def test_web_hooks_are_processed_if_emails_are_not_sent(self, requests_post):
+        web_hook = logging_models.WebHook.objects.create(
+            user=self.owner, destination_url='http://example.com/', event_types=[self.event_type])
+
+        with mock.patch('nodeconductor.logging.models.get_connection') as get_connection:
+            get_connection().send_messages.side_effect = smtplib.SMTPException
+            process_events(self.events)
+
+        self.assertEqual(requests_post.call_count, len(self.events))
+        self.assertEqual(requests_post.call_args[0], (web_hook.destination_url,))
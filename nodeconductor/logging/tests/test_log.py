@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from nodeconductor.logging.log import TCPEventHandler
+
+
+class LogServer(object):
+    """ TCP listener that stands in for logstash """
+
+    def __init__(self, port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', port))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.data = b''
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        try:
+            connection, _ = self.sock.accept()
+        except socket.error:
+            return
+        while True:
+            chunk = connection.recv(4096)
+            if not chunk:
+                break
+            self.data += chunk
+        connection.close()
+
+    def get_events(self, count, timeout=5):
+        deadline = time.time() + timeout
+        while self.data.count(b'\n') < count and time.time() < deadline:
+            time.sleep(0.01)
+        return [json.loads(line) for line in self.data.splitlines()]
+
+    def close(self):
+        self.sock.close()
+
+
+class TCPEventHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.handlers = []
+
+    def tearDown(self):
+        for handler in self.handlers:
+            handler.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def create_handler(self, port, **kwargs):
+        handler = TCPEventHandler(port=port, host='127.0.0.1', **kwargs)
+        self.handlers.append(handler)
+        return handler
+
+    def emit(self, handler, count):
+        for index in range(count):
+            record = logging.LogRecord('nodeconductor', logging.INFO, __file__, 1, 'message#%s' % index, (), None)
+            record.event_type = 'test_event'
+            handler.handle(record)
+
+    def get_free_port(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def test_events_are_sent_as_newline_delimited_json(self):
+        server = LogServer()
+        handler = self.create_handler(server.port)
+
+        self.emit(handler, 3)
+
+        events = server.get_events(3)
+        server.close()
+        self.assertEqual([event['message'] for event in events], ['message#0', 'message#1', 'message#2'])
+        self.assertEqual(events[0]['event_type'], 'test_event')
+
+    def test_emit_does_not_wait_for_unavailable_log_server(self):
+        handler = self.create_handler(self.get_free_port(), queue_size=5)
+
+        started = time.time()
+        self.emit(handler, 20)
+
+        self.assertLess(time.time() - started, 0.5)
+        self.assertGreater(handler.stats['dropped'], 0)
+
+    def test_events_are_spooled_while_log_server_is_unavailable(self):
+        port = self.get_free_port()
+        spool_path = os.path.join(self.tmp_dir, 'events.spool')
+        handler = self.create_handler(port, spool_path=spool_path)
+
+        self.emit(handler, 3)
+        deadline = time.time() + 5
+        while handler.stats['spooled'] < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(handler.stats['spooled'], 3)
+
+        server = LogServer(port)
+        self.emit(handler, 1)
+
+        events = server.get_events(4, timeout=10)
+        server.close()
+        self.assertEqual(len(events), 4)
+        self.assertEqual(os.listdir(self.tmp_dir), ['events.spool.lock'])
+
+    def test_events_spooled_by_other_process_are_replayed(self):
+        server = LogServer()
+        spool_path = os.path.join(self.tmp_dir, 'events.spool')
+        other_handler = self.create_handler(server.port, spool_path=spool_path)
+        other_handler._spool([b'{"message": "spooled"}\n'])
+        handler = self.create_handler(server.port, spool_path=spool_path)
+
+        self.emit(handler, 1)
+
+        events = server.get_events(2)
+        server.close()
+        self.assertEqual([event['message'] for event in events], ['spooled', 'message#0'])
+
+    @mock.patch('nodeconductor.logging.log.logger')
+    def test_stats_are_reported_if_log_server_is_unavailable(self, logger):
+        handler = self.create_handler(self.get_free_port(), stats_interval=0, queue_size=1)
+
+        self.emit(handler, 5)
+        handler.close()
+
+        self.assertTrue(logger.warning.called)
+        self.assertIn(handler.stats['dropped'], logger.warning.call_args[0])
@@ -1,12 +1,19 @@
 from __future__ import unicode_literals
 
+import base64
+import json
+
 from django.core.exceptions import PermissionDenied
 from django.db.models import Count
+from django.http import StreamingHttpResponse
 from django.utils.translation import ugettext_lazy as _
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import response, viewsets, permissions, status, decorators, mixins
+from rest_framework.serializers import ValidationError
+from rest_framework.utils.urls import replace_query_param
 
 from nodeconductor.core import serializers as core_serializers, filters as core_filters, permissions as core_permissions
+from nodeconductor.core.csv import UnicodeDictWriter
 from nodeconductor.core.managers import SummaryQuerySet
 from nodeconductor.logging import elasticsearch_client, models, serializers, filters, utils
 from nodeconductor.logging.loggers import get_event_groups, get_alert_groups, event_logger
@@ -16,6 +23,7 @@ class EventViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
     permission_classes = (permissions.IsAuthenticated, core_permissions.IsAdminOrReadOnly)
     filter_backends = (filters.EventFilterBackend,)
     serializer_class = serializers.EventSerializer
+    export_fields = ('@timestamp', 'event_type', 'importance', 'message', 'user_username')
 
     def get_queryset(self):
         return elasticsearch_client.ElasticsearchResultList()
@@ -28,6 +36,10 @@ class EventViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
         Sorting is supported in ascending and descending order by specifying a field to an **?o=** parameter. By default
         events are sorted by @timestamp in descending order.
 
+        Deep pages are expensive to fetch by page number. To iterate over large amount of events
+        pass empty **?cursor=** parameter and follow URL from "next" relation of Link header.
+        Cursor pages do not include X-Result-Count header, use */api/events/count/* instead.
+
         Run POST against */api/events/* to create an event. Only users with staff privileges can create events.
         New event will be emitted with `custom_notification` event type.
         Request should contain following fields:
@@ -53,12 +65,47 @@ class EventViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
             }
         """
         self.queryset = self.filter_queryset(self.get_queryset())
+        if 'cursor' in request.query_params:
+            return self.get_cursor_page_response()
+        self.prefetch_page()
 
         page = self.paginate_queryset(self.queryset)
         if page is not None:
             return self.get_paginated_response(page)
         return response.Response(self.queryset)
 
+    def prefetch_page(self):
+        """ Fetch requested page of events together with their total count by single search """
+        if self.paginator is None or not hasattr(self.queryset, 'prefetch'):
+            return
+        page_size = self.paginator.get_page_size(self.request)
+        try:
+            page_number = int(self.request.query_params.get(self.paginator.page_query_param, 1))
+        except ValueError:
+            return
+        if page_size and page_number > 0:
+            self.queryset.prefetch((page_number - 1) * page_size, page_size)
+
+    def get_cursor_page_response(self):
+        token = self.request.query_params['cursor']
+        cursor = None
+        if token:
+            try:
+                value, skip = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+                cursor = (value, int(skip))
+            except (TypeError, ValueError):
+                raise ValidationError({'cursor': _('Cursor is not valid.')})
+
+        page_size = self.paginator.get_page_size(self.request) if self.paginator else None
+        events, next_cursor = self.queryset.get_page_after(cursor, page_size or 10)
+
+        headers = {}
+        if next_cursor is not None:
+            url = replace_query_param(
+                self.request.build_absolute_uri(), 'cursor', base64.urlsafe_b64encode(json.dumps(next_cursor)))
+            headers['Link'] = '<%s>; rel="next"' % url
+        return response.Response(events, headers=headers)
+
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
@@ -121,13 +168,50 @@ class EventViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
         serializer = core_serializers.HistorySerializer(data={k: v for k, v in mapped.items() if v})
         serializer.is_valid(raise_exception=True)
 
-        timestamp_ranges = [{'end': point_date} for point_date in serializer.get_filter_data()]
-        aggregated_count = queryset.aggregated_count(timestamp_ranges)
+        count_history = queryset.count_history(serializer.get_filter_data())
 
         return response.Response(
-            [{'point': int(ac['end']), 'object': {'count': ac['count']}} for ac in aggregated_count],
+            [{'point': item['end'], 'object': {'count': item['count']}} for item in count_history],
             status=status.HTTP_200_OK)
 
+    @decorators.list_route()
+    def export(self, request, *args, **kwargs):
+        """
+        To export events - run **GET** against */api/events/export/* as authenticated user.
+        Endpoint support same filters as events list. Events are streamed in the order they are stored,
+        so export is not limited by size of the result and does not support sorting.
+
+        Supported formats are passed to **?file_format=** parameter:
+
+        - ndjson: each line is JSON object of event, it is default format;
+        - csv: comma separated values with header row. Columns are specified by **?field=** parameters,
+          by default timestamp, event type, importance, message and username are exported.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        file_format = request.query_params.get('file_format', 'ndjson')
+
+        if file_format == 'ndjson':
+            rows = (json.dumps(event) + '\n' for event in queryset.scan())
+            return StreamingHttpResponse(rows, content_type='application/x-ndjson')
+
+        if file_format == 'csv':
+            fields = request.query_params.getlist('field') or self.export_fields
+            rows = self._get_csv_rows(queryset.scan(), fields)
+            export_response = StreamingHttpResponse(rows, content_type='text/csv')
+            export_response['Content-Disposition'] = 'attachment; filename="events.csv"'
+            return export_response
+
+        raise ValidationError({'file_format': _('Supported formats are ndjson and csv.')})
+
+    def _get_csv_rows(self, events, fields):
+        line = _LineBuffer()
+        writer = UnicodeDictWriter(line, fields)
+        writer.writerow(dict(zip(fields, fields)))
+        yield line.value
+        for event in events:
+            writer.writerow({field: event.get(field, '') for field in fields})
+            yield line.value
+
     @decorators.list_route()
     def scope_types(self, request, *args, **kwargs):
         """ Returns a list of scope types acceptable by events filter. """
@@ -142,6 +226,14 @@ class EventViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
         return response.Response(get_event_groups())
 
 
+class _LineBuffer(object):
+    """ File-like object that keeps only last written line, so CSV rows can be streamed """
+    value = ''
+
+    def write(self, value):
+        self.value = value
+
+
 class AlertViewSet(mixins.CreateModelMixin,
                    viewsets.ReadOnlyModelViewSet):
     queryset = models.Alert.objects.all()
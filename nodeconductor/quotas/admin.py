@@ -2,7 +2,6 @@ from django.contrib import admin
 from django.contrib.contenttypes.admin import GenericTabularInline
 from django.contrib.contenttypes import models as ct_models
 
-from nodeconductor.core.admin import ReversionAdmin
 from nodeconductor.quotas import models, utils
 
 
@@ -34,7 +33,7 @@ class QuotaFieldTypeLimit(object):
         return ''
 
 
-class QuotaAdmin(QuotaFieldTypeLimit, ReversionAdmin):
+class QuotaAdmin(QuotaFieldTypeLimit, admin.ModelAdmin):
     list_display = ['scope', 'name', 'limit', 'usage']
     list_filter = ['name', QuotaScopeClassListFilter]
 
@@ -1,10 +1,29 @@
+import collections
+
 from django import VERSION as DJANGO_VERSION
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models import Count, Sum
 from django.utils import six
 
+from nodeconductor.core import utils as core_utils
+
 from . import exceptions
 
 
+def _get_lookup_path(model, path_to_scope):
+    """ Convert dotted path to scope to ORM lookup path.
+
+        Structure querysets support virtual fields like "project" or "customer"
+        in filters, they are replaced with real paths here.
+    """
+    path = path_to_scope.replace('.', '__')
+    queryset = model.objects.all()
+    if hasattr(queryset, '_filter_by_custom_fields'):
+        path = next(iter(queryset._filter_by_custom_fields(**{path: None})))
+    return path
+
+
 class QuotaLimitField(models.IntegerField):
     """ Django virtual model field.
         Could be used to manage quotas transparently as model fields.
@@ -139,6 +158,30 @@ class QuotaField(object):
     def recalculate_usage(self, scope):
         pass
 
+    def recalculate_usages(self, scope_model):
+        """ Recalculate quotas usages for all instances of scope model.
+
+            Usages are calculated in bulk and only changed quotas are updated.
+            Quota signals are not sent, history samples of updated quotas are recorded.
+            Returns number of updated quotas.
+        """
+        from nodeconductor.quotas.models import Quota, QuotaSample
+
+        usages = self.get_current_usages(scope_model)
+        quotas = Quota.objects.filter(content_type=ContentType.objects.get_for_model(scope_model), name=self.name)
+        new_usages = {}
+        for quota_id, scope_id, usage in quotas.values_list('pk', 'object_id', 'usage'):
+            current_usage = usages.get(scope_id, 0)
+            if current_usage != usage:
+                new_usages[quota_id] = current_usage
+        core_utils.bulk_update(Quota, 'usage', new_usages)
+        QuotaSample.record(new_usages.keys())
+        return len(new_usages)
+
+    def get_current_usages(self, scope_model):
+        """ Return dictionary that maps ID of scope model instance to its current quota usage. """
+        raise NotImplementedError()
+
 
 class CounterQuotaField(QuotaField):
     """ Provides limitation on target models instances count.
@@ -183,6 +226,18 @@ class CounterQuotaField(QuotaField):
         current_usage = self.get_current_usage(self.target_models, scope)
         scope.set_quota_usage(self.name, current_usage)
 
+    def get_current_usages(self, scope_model):
+        if self._raw_get_current_usage is not None:
+            return {scope.pk: self._raw_get_current_usage(self.target_models, scope)
+                    for scope in scope_model.objects.all() if self.is_connected_to_scope(scope)}
+
+        usages = collections.Counter()
+        for model in self.target_models:
+            path_to_scope = _get_lookup_path(model, self.path_to_scope)
+            counts = model.objects.order_by().values_list(path_to_scope).annotate(count=Count('pk'))
+            usages.update(dict(counts))
+        return usages
+
     def add_usage(self, target_instance, delta, fail_silently=False):
         scope = self._get_scope(target_instance)
         if self.is_connected_to_scope(scope):
@@ -201,25 +256,87 @@ class AggregatorQuotaField(QuotaField):
             # This quota will store sum of all customer projects resources
             nc_resource_count = quotas_fields.UsageAggregatorQuotaField(
                 get_children=lambda customer: customer.projects.all(),
+                child_model=lambda: Project,  # optional model or function that returns model of children
+                path_to_scope='customer',  # optional path from child model to scope
             )
+
+        Usages of all scopes are recalculated by single grouped query over child model and
+        path_to_scope. All instances of child model that are linked to scope by path_to_scope
+        should be its children, get_children filtering is not applied there. If they are not
+        defined, they are derived from the only foreign key of children model to scope model,
+        see get_grouping.
     """
     aggregation_field = NotImplemented
 
-    def __init__(self, get_children, child_quota_name=None, **kwargs):
+    def __init__(self, get_children, child_quota_name=None, child_model=None, path_to_scope=None, **kwargs):
         self.get_children = get_children
         self._child_quota_name = child_quota_name
+        self._raw_child_model = child_model
+        self.path_to_scope = path_to_scope
         super(AggregatorQuotaField, self).__init__(**kwargs)
 
     def get_child_quota_name(self):
         return self._child_quota_name if self._child_quota_name is not None else self.name
 
+    @property
+    def child_model(self):
+        if self._raw_child_model is None or isinstance(self._raw_child_model, type):
+            return self._raw_child_model
+        return self._raw_child_model()
+
     def recalculate_usage(self, scope):
+        scope.set_quota_usage(self.name, self._get_children_sum(self.get_children(scope)))
+
+    def get_grouping(self, scope_model):
+        """ Return (child_model, path_to_scope) pair that links children to scopes or None.
+
+            Pair is derived from the only foreign key of children model to scope model if it
+            is not defined explicitly. Derived pair is used only if get_children returns
+            the same query as filtering of children model by this foreign key.
+        """
+        if self.child_model is not None and self.path_to_scope is not None:
+            return self.child_model, self.path_to_scope
+
+        scope = scope_model.objects.first()
+        if scope is None:
+            return
         children = self.get_children(scope)
-        current_usage = 0
-        for child in children:
-            child_quota = child.quotas.get(name=self.get_child_quota_name())
-            current_usage += getattr(child_quota, self.aggregation_field)
-        scope.set_quota_usage(self.name, current_usage)
+        if not isinstance(children, models.QuerySet):
+            return
+        child_model = children.model
+        paths = [field.name for field in child_model._meta.get_fields()
+                 if field.many_to_one and field.related_model is scope_model]
+        if len(paths) != 1:
+            return
+        expected_children = child_model._default_manager.filter(**{paths[0]: scope})
+        if six.text_type(children.query) != six.text_type(expected_children.query):
+            return
+        return child_model, paths[0]
+
+    def get_current_usages(self, scope_model):
+        grouping = self.get_grouping(scope_model)
+        if grouping is None:
+            return {scope.pk: self._get_children_sum(self.get_children(scope))
+                    for scope in scope_model.objects.all() if self.is_connected_to_scope(scope)}
+
+        child_model, path_to_scope = grouping
+        sums = (child_model.objects
+                .filter(quotas__name=self.get_child_quota_name())
+                .order_by()
+                .values_list(_get_lookup_path(child_model, path_to_scope))
+                .annotate(total=Sum('quotas__' + self.aggregation_field)))
+        return dict(sums)
+
+    def _get_children_sum(self, children):
+        """ Sum aggregation field of children quotas by single query """
+        from nodeconductor.quotas.models import Quota
+
+        child_quotas = Quota.objects.filter(
+            content_type=ContentType.objects.get_for_model(children.model),
+            object_id__in=children.values('pk'),
+            name=self.get_child_quota_name(),
+        )
+        return child_quotas.aggregate(total=Sum(self.aggregation_field))['total'] or 0
 
     def post_child_quota_save(self, scope, child_quota, created=False):
         quota = scope.quotas.get(name=self.name)
@@ -228,16 +345,16 @@ class AggregatorQuotaField(QuotaField):
             diff = current_value
         else:
             diff = current_value - child_quota.tracker.previous(self.aggregation_field)
-        if diff:
-            quota.usage += diff
-            quota.save()
+        quota.add_usage(diff)
+
+    def post_child_quota_usage_change(self, scope, child_quota, delta):
+        if self.aggregation_field == 'usage':
+            scope.quotas.get(name=self.name).add_usage(delta)
 
     def pre_child_quota_delete(self, scope, child_quota):
         quota = scope.quotas.get(name=self.name)
         diff = getattr(child_quota, self.aggregation_field)
-        if diff:
-            quota.usage -= diff
-            quota.save()
+        quota.add_usage(-diff)
 
 
 class UsageAggregatorQuotaField(AggregatorQuotaField):
@@ -1,4 +1,3 @@
-from django.db import transaction
 from django.db.models import signals
 
 from nodeconductor.quotas import models, utils, fields
@@ -22,20 +21,14 @@ def create_global_quotas(**kwargs):
 
 def increase_global_quota(sender, instance=None, created=False, **kwargs):
     if created and hasattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'):
-        with transaction.atomic():
-            global_quota = models.Quota.objects.select_for_update().get(
-                name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
-            global_quota.usage += 1
-            global_quota.save()
+        global_quota = models.Quota.objects.get(name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
+        global_quota.add_usage(1)
 
 
 def decrease_global_quota(sender, **kwargs):
     if hasattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'):
-        with transaction.atomic():
-            global_quota = models.Quota.objects.select_for_update().get(
-                name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
-            global_quota.usage -= 1
-            global_quota.save()
+        global_quota = models.Quota.objects.get(name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
+        global_quota.add_usage(-1)
 
 
 # new quotas
@@ -81,3 +74,4 @@ def handle_aggregated_quotas(sender, instance, **kwargs):
             field.post_child_quota_save(aggregator_quota.scope, child_quota=quota, created=kwargs.get('created'))
         elif signal == signals.pre_delete:
             field.pre_child_quota_delete(aggregator_quota.scope, child_quota=quota)
+
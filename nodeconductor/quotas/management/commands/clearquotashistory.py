@@ -1,21 +1,20 @@
 from django.core.management.base import BaseCommand
-from reversion import revisions as reversion
 
-from nodeconductor.quotas.models import Quota
+from nodeconductor.quotas.models import QuotaSample
 
 
 class Command(BaseCommand):
-    help = "Delete quotas versions duplicates."
+    help = "Delete quotas samples duplicates."
 
     def handle(self, *args, **options):
         self.stdout.write('Collecting duplicates...')
-        duplicates = sum([self.get_quota_duplicate_versions(quota) for quota in Quota.objects.all()], [])
+        duplicates = self.get_duplicate_samples_ids()
         self.stdout.write('...Done')
 
         if not duplicates:
             self.stdout.write('No duplicates were found. Congratulations!')
         else:
-            self.stdout.write('There are %s duplicates for quotas versions.' % len(duplicates))
+            self.stdout.write('There are %s duplicates for quotas samples.' % len(duplicates))
             while True:
                 delete = raw_input('  Do you want to delete them? [Y/n]:') or 'y'
                 if delete.lower() not in ('y', 'n'):
@@ -24,27 +23,24 @@ class Command(BaseCommand):
                     delete = delete.lower() == 'y'
                     break
             if delete:
-                for duplicate in duplicates:
-                    duplicate.delete()
+                batch_size = 500
+                for index in range(0, len(duplicates), batch_size):
+                    QuotaSample.objects.filter(pk__in=duplicates[index:index + batch_size]).delete()
                 self.stdout.write('All duplicates were deleted.')
             else:
                 self.stdout.write('Duplicates were not deleted.')
 
-    def get_quota_duplicate_versions(self, quota):
-        versions = reversion.get_for_object(quota).order_by('revision__date_created')
-        if not versions:
-            return []
+    def get_duplicate_samples_ids(self):
+        """ Find samples that have the same limit and usage as previous sample of the same quota """
+        samples = (QuotaSample.objects
+                   .order_by('quota', 'timestamp', 'pk')
+                   .values_list('pk', 'quota_id', 'limit', 'usage')
+                   .iterator())
         duplicates = []
-        last_version = versions[0]
-        for version in versions[1:]:
-            next_version = version
-            if self.are_versions_equal(quota, last_version, next_version):
-                duplicates.append(next_version)
+        last_sample = None
+        for sample in samples:
+            if last_sample is not None and sample[1:] == last_sample[1:]:
+                duplicates.append(sample[0])
             else:
-                last_version = next_version
+                last_sample = sample
         return duplicates
-
-    def are_versions_equal(self, quota, v1, v2):
-        o1 = v1.object_version.object
-        o2 = v2.object_version.object
-        return all([getattr(o1, f) == getattr(o2, f) for f in quota.get_version_fields()])
@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from reversion.models import Version
+
+from nodeconductor.quotas import models
+
+
+class Command(BaseCommand):
+    help = "Import quotas history from django-reversion versions to quota samples."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='How many samples should be inserted by one query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        quotas_ids = set(models.Quota.objects.values_list('pk', flat=True))
+        # Only versions older than the earliest sample of quota are imported, so samples that were
+        # recorded after deployment are kept and command can be executed several times.
+        first_samples_dates = dict(models.QuotaSample.objects.order_by().values_list('quota_id').annotate(
+            first_date=Min('timestamp')))
+
+        self.stdout.write('Importing quotas versions')
+        versions = (Version.objects
+                    .filter(content_type=ContentType.objects.get_for_model(models.Quota))
+                    .order_by()
+                    .values_list('object_id_int', 'revision__date_created', 'serialized_data')
+                    .iterator())
+        samples = []
+        count = 0
+        skipped_count = 0
+        for quota_id, date_created, serialized_data in versions:
+            if quota_id not in quotas_ids:
+                continue
+            first_date = first_samples_dates.get(quota_id)
+            if first_date is not None and date_created >= first_date:
+                skipped_count += 1
+                continue
+            fields = json.loads(serialized_data)[0]['fields']
+            samples.append(models.QuotaSample(
+                quota_id=quota_id, timestamp=date_created, limit=fields['limit'], usage=fields['usage']))
+            if len(samples) >= batch_size:
+                models.QuotaSample.objects.bulk_create(samples)
+                count += len(samples)
+                samples = []
+        models.QuotaSample.objects.bulk_create(samples)
+        count += len(samples)
+        self.stdout.write('...done. %s samples were imported, %s versions are already covered by samples.' % (
+            count, skipped_count))
+
+        self.stdout.write('Creating samples for quotas without history')
+        sampled_quotas_ids = set(models.QuotaSample.objects.values_list('quota_id', flat=True).distinct())
+        samples = [models.QuotaSample(quota_id=quota_id, limit=limit, usage=usage)
+                   for quota_id, limit, usage in models.Quota.objects.values_list('pk', 'limit', 'usage')
+                   if quota_id not in sampled_quotas_ids]
+        models.QuotaSample.objects.bulk_create(samples, batch_size=batch_size)
+        self.stdout.write('...done. %s samples were created.' % len(samples))
@@ -1,11 +1,15 @@
 from __future__ import unicode_literals
 
+from django.contrib.contenttypes.models import ContentType
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
 from nodeconductor.quotas import models, fields, exceptions
 from nodeconductor.quotas.utils import get_models_with_quotas
 
+# Maximum number of nested aggregators levels.
+MAX_AGGREGATION_DEPTH = 10
+
 
 class Command(BaseCommand):
     """ Recalculate all quotas """
@@ -18,23 +22,21 @@ class Command(BaseCommand):
         self.recalculate_global_quotas()
         self.recalculate_counter_quotas()
         self.recalculate_aggregator_quotas()
-        self.stdout.write('XXX: Second time to make sure that aggregators of aggregators where calculated properly.')
-        self.recalculate_aggregator_quotas()
         self.recalculate_customers_user_count()
 
     def delete_stale_quotas(self):
         self.stdout.write('Deleting stale quotas')
         for model in get_models_with_quotas():
-            for obj in model.objects.all():
-                quotas_names = model.QUOTAS_NAMES + [f.name for f in model.get_quotas_fields()]
-                obj.quotas.exclude(name__in=quotas_names).delete()
+            content_type = ContentType.objects.get_for_model(model)
+            quotas_names = model.QUOTAS_NAMES + [f.name for f in model.get_quotas_fields()]
+            models.Quota.objects.filter(content_type=content_type).exclude(name__in=quotas_names).delete()
         self.stdout.write('...done')
 
     def init_missing_quotas(self):
         self.stdout.write('Initializing missing quotas')
         for model in get_models_with_quotas():
-            for obj in model.objects.all():
-                for field in obj.get_quotas_fields():
+            for field in model.get_quotas_fields():
+                for obj in model.objects.exclude(quotas__name=field.name):
                     try:
                         field.get_or_create_quota(scope=obj)
                     except exceptions.CreationConditionFailedQuotaError:
@@ -55,17 +57,22 @@ class Command(BaseCommand):
         self.stdout.write('Recalculating counter quotas')
         for model in get_models_with_quotas():
             for counter_field in model.get_quotas_fields(field_class=fields.CounterQuotaField):
-                for instance in model.objects.all():
-                    counter_field.recalculate(scope=instance)
+                counter_field.recalculate_usages(scope_model=model)
         self.stdout.write('...done')
 
     def recalculate_aggregator_quotas(self):
-        # TODO: recalculate child quotas first
+        """ Recalculate aggregators level by level.
+
+            Aggregator can aggregate another aggregators, so each pass makes one
+            more level of hierarchy valid. Recalculation stops when pass does not change any quota.
+        """
         self.stdout.write('Recalculating aggregator quotas')
-        for model in get_models_with_quotas():
-            for aggregator_field in model.get_quotas_fields(field_class=fields.AggregatorQuotaField):
-                for instance in model.objects.all():
-                    aggregator_field.recalculate(scope=instance)
+        aggregators = [(model, field) for model in get_models_with_quotas()
+                       for field in model.get_quotas_fields(field_class=fields.AggregatorQuotaField)]
+        for _ in range(MAX_AGGREGATION_DEPTH):
+            updated = sum(field.recalculate_usages(scope_model=model) for model, field in aggregators)
+            if not updated:
+                break
         self.stdout.write('...done')
 
     # XXX: With current permissions structure it easier to handle customer quota separately.
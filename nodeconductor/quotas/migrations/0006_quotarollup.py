@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotas', '0005_quotasample'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('limit', models.FloatField()),
+                ('usage', models.FloatField()),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=10)),
+                ('quota', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='quotas.Quota')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='quotarollup',
+            unique_together=set([('quota', 'period', 'timestamp')]),
+        ),
+    ]
@@ -1,34 +1,40 @@
 from __future__ import unicode_literals
 
+import bisect
+import contextlib
 import functools
 import inspect
+import threading
 from collections import defaultdict
+from datetime import timedelta
 
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.contenttypes import fields as ct_fields
 from django.contrib.contenttypes import models as ct_models
-from django.db import models
-from django.db.models import Sum
-from django.utils import six
+from django.db import models, transaction
+from django.db.models import Case, F, Max, Sum, Value, When
+from django.utils import six, timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from model_utils import FieldTracker
-from reversion import revisions as reversion
 
 from nodeconductor.logging.loggers import LoggableMixin
 from nodeconductor.logging.models import AlertThresholdMixin
-from nodeconductor.quotas import exceptions, managers, fields
-from nodeconductor.core.models import UuidMixin, ReversionMixin, DescendantMixin
+from nodeconductor.quotas import exceptions, managers, fields, signals
+from nodeconductor.core.models import UuidMixin, DescendantMixin
 
 
 @python_2_unicode_compatible
-@reversion.register(fields=['usage', 'limit'])
-class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, ReversionMixin, models.Model):
+class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, models.Model):
     """
     Abstract quota for any resource.
 
     Quota can exist without scope: for example, a quota for all projects or all
     customers on site.
     If quota limit is set to -1 quota will never be exceeded.
+
+    History of quota limit and usage is stored as QuotaSample records.
     """
     class Meta:
         unique_together = (('name', 'content_type', 'object_id'),)
@@ -47,6 +53,19 @@ class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, ReversionMixin, model
     def __str__(self):
         return '%s quota for %s' % (self.name, self.scope)
 
+    def save(self, *args, **kwargs):
+        is_changed = self.pk is None or self.tracker.has_changed('limit') or self.tracker.has_changed('usage')
+        super(Quota, self).save(*args, **kwargs)
+        if is_changed:
+            QuotaSample.record([self.pk])
+
+    def get_history(self, dates):
+        """ Get quota (limit, usage) pair for each of given dates.
+
+            Pair is None if there is no history sample before the date.
+        """
+        return QuotaSample.get_history([self.pk], dates).get(self.pk, [None] * len(dates))
+
     def is_exceeded(self, delta=None, threshold=None):
         """
         Check is quota exceeded
@@ -57,7 +76,7 @@ class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, ReversionMixin, model
         if self.limit == -1:
             return False
 
-        usage = self.usage
+        usage = self.usage + self.get_pending_usage_delta()
         limit = self.limit
 
         if delta is not None:
@@ -80,6 +99,294 @@ class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, ReversionMixin, model
     def is_over_threshold(self):
         return self.usage >= self.threshold
 
+    @classmethod
+    def get_over_threshold_query(cls):
+        return models.Q(usage__gte=F('threshold'))
+
+    def add_usage(self, delta):
+        """ Add delta to quota usage by atomic UPDATE instead of read-modify-write.
+
+            Delta is applied in current transaction and propagated to usage aggregator quotas
+            of scope ancestors. Inside of "batch_usage_deltas" block delta is applied on block exit.
+            Quota is not saved, so "quota_usage_changed" signal is sent instead of "post_save",
+            signal is sent and history sample is recorded after transaction commit.
+        """
+        if not delta:
+            return
+        _add_usage_deltas({self.pk: ([self], delta)})
+
+    def get_pending_usage_delta(self):
+        """ Return sum of deltas that were added inside of "batch_usage_deltas" block but are not applied yet """
+        return sum(batch[self.pk][1] for batch in _get_usage_deltas_stack() if self.pk in batch)
+
+
+_usage_deltas_batches = threading.local()
+
+
+@contextlib.contextmanager
+def batch_usage_deltas():
+    """ Collapse quotas usage deltas added inside the block and apply them on block exit.
+
+        All deltas of the same quota are applied by single UPDATE in current transaction,
+        so block that is executed inside of transaction is committed or rolled back together
+        with other changes of transaction. Deltas are discarded if block raises exception.
+    """
+    stack = _get_usage_deltas_stack()
+    stack.append({})
+    try:
+        yield
+    except:
+        stack.pop()
+        raise
+    _add_usage_deltas(stack.pop())
+
+
+def _get_usage_deltas_stack():
+    return _usage_deltas_batches.__dict__.setdefault('stack', [])
+
+
+def _add_usage_deltas(deltas):
+    stack = _get_usage_deltas_stack()
+    if not stack:
+        _apply_usage_deltas(deltas)
+        return
+    batch = stack[-1]
+    for quota_id, (quotas, delta) in deltas.items():
+        batch_quotas, batch_delta = batch.get(quota_id, ([], 0))
+        batch_quotas = batch_quotas + [quota for quota in quotas if not any(quota is q for q in batch_quotas)]
+        batch[quota_id] = (batch_quotas, batch_delta + delta)
+
+
+def _discard_pending_usage_deltas(quota_id):
+    """ Drop deltas of quota that are not applied yet, they are overridden by new usage value """
+    for batch in _get_usage_deltas_stack():
+        batch.pop(quota_id, None)
+
+
+def _apply_usage_deltas(deltas):
+    deltas = {quota_id: (quotas, delta) for quota_id, (quotas, delta) in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = Quota.objects.filter(pk__in=deltas.keys()).update(usage=F('usage') + Case(
+        *[When(pk=quota_id, then=Value(delta)) for quota_id, (_, delta) in deltas.items()],
+        output_field=models.FloatField()))
+    if updated < len(deltas):
+        # Quotas could be deleted in current transaction before deltas were applied.
+        existing_ids = set(Quota.objects.filter(pk__in=deltas.keys()).values_list('pk', flat=True))
+        deltas = {quota_id: value for quota_id, value in deltas.items() if quota_id in existing_ids}
+
+    for quotas, delta in deltas.values():
+        for quota in quotas:
+            quota.usage += delta
+    # Deltas of aggregator quotas are applied together.
+    with batch_usage_deltas():
+        for quotas, delta in deltas.values():
+            _propagate_usage_delta(quotas[0], delta)
+    transaction.on_commit(lambda: _handle_committed_usage_deltas(deltas))
+
+
+def _propagate_usage_delta(quota, delta):
+    """ Add usage delta of quota to usage aggregators of its scope ancestors """
+    if quota.scope is None:
+        return
+    quota_field = quota.get_field()
+    # usage aggregation should not count another usage aggregator field to avoid calls duplication.
+    if isinstance(quota_field, fields.UsageAggregatorQuotaField) or quota_field is None:
+        return
+    for aggregator_quota in quota_field.get_aggregator_quotas(quota):
+        field = aggregator_quota.get_field()
+        field.post_child_quota_usage_change(aggregator_quota.scope, child_quota=quota, delta=delta)
+
+
+def _handle_committed_usage_deltas(deltas):
+    """ Record history samples and send signal for quotas that were not deleted after deltas were applied """
+    existing_ids = set(QuotaSample.record(deltas.keys()))
+    for quota_id, (quotas, delta) in deltas.items():
+        if quota_id in existing_ids:
+            signals.quota_usage_changed.send(sender=Quota, instance=quotas[0], delta=delta)
+
+
+class BaseQuotaSample(models.Model):
+    """ Quota limit and usage starting from timestamp """
+    timestamp = models.DateTimeField(default=timezone.now)
+    limit = models.FloatField()
+    usage = models.FloatField()
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def _get_history(samples, dates):
+        """ Get (limit, usage) pair of each quota for each of given dates.
+
+            Returns dictionary that maps quota ID to the list of pairs aligned with dates,
+            pair is None if there is no quota sample before the date. Quotas without
+            samples are omitted.
+
+            Samples are fetched by ordered range scan over dates interval plus
+            the latest sample before it for each quota, so number of queries
+            does not depend on quotas or dates count.
+        """
+        if not dates:
+            return {}
+        start, end = min(dates), max(dates)
+        fields = ('quota_id', 'timestamp', 'limit', 'usage')
+
+        last_timestamps = (samples.filter(timestamp__lte=start).order_by()
+                           .values('quota').annotate(last_timestamp=Max('timestamp'))
+                           .values('last_timestamp'))
+        previous_samples = {}
+        for sample in samples.filter(timestamp__in=last_timestamps, timestamp__lte=start).values_list(*fields):
+            quota_id, timestamp = sample[:2]
+            if quota_id not in previous_samples or previous_samples[quota_id][1] < timestamp:
+                previous_samples[quota_id] = sample
+
+        quotas_samples = defaultdict(list)
+        for quota_id, sample in previous_samples.items():
+            quotas_samples[quota_id].append(sample)
+        range_samples = (samples.filter(timestamp__gt=start, timestamp__lte=end)
+                         .order_by('quota', 'timestamp').values_list(*fields))
+        for sample in range_samples:
+            quotas_samples[sample[0]].append(sample)
+
+        history = {}
+        for quota_id, quota_samples in quotas_samples.items():
+            timestamps = [sample[1] for sample in quota_samples]
+            history[quota_id] = []
+            for date in dates:
+                index = bisect.bisect_right(timestamps, date) - 1
+                history[quota_id].append(quota_samples[index][2:] if index >= 0 else None)
+        return history
+
+
+class QuotaSample(BaseQuotaSample):
+    """ Append-only history of quota limit and usage. """
+    quota = models.ForeignKey(Quota, related_name='samples')
+
+    class Meta:
+        index_together = ('quota', 'timestamp')
+
+    @classmethod
+    def get_history(cls, quotas, dates):
+        """ Get history of quotas defined as list of IDs or queryset, see BaseQuotaSample._get_history """
+        return cls._get_history(cls.objects.filter(quota__in=quotas), dates)
+
+    @classmethod
+    def record(cls, quotas):
+        """ Store current limit and usage of quotas defined as list of IDs or queryset.
+
+            Every path that changes quota limit or usage records history by this method,
+            including bulk updates that do not call Quota.save. Returns IDs of recorded quotas.
+        """
+        now = timezone.now()
+        values = Quota.objects.filter(pk__in=quotas).values_list('pk', 'limit', 'usage')
+        samples = [cls(quota_id=quota_id, timestamp=now, limit=limit, usage=usage)
+                   for quota_id, limit, usage in values]
+        cls.objects.bulk_create(samples)
+        return [sample.quota_id for sample in samples]
+
+
+class QuotaRollup(BaseQuotaSample):
+    """ Quota limit and usage at the beginning of hour or day.
+
+        Rollup is stored only if quota limit or usage has changed since previous period,
+        so rollups are coarse grained copy of samples. They are created by
+        "nodeconductor.quotas.create_rollups" task.
+    """
+    class Periods(object):
+        HOUR = 'hour'
+        DAY = 'day'
+
+        CHOICES = ((HOUR, 'Hour'), (DAY, 'Day'))
+        DURATIONS = {HOUR: timedelta(hours=1), DAY: timedelta(days=1)}
+
+    COVERED_UNTIL_CACHE_KEY = 'quotas_rollups_covered_until_%s'
+
+    quota = models.ForeignKey(Quota, related_name='rollups')
+    period = models.CharField(max_length=10, choices=Periods.CHOICES)
+
+    class Meta:
+        unique_together = ('quota', 'period', 'timestamp')
+
+    @classmethod
+    def get_history(cls, quotas, dates, period):
+        """ Get history of quotas with given period, see BaseQuotaSample._get_history """
+        return cls._get_history(cls.objects.filter(quota__in=quotas, period=period), dates)
+
+    @classmethod
+    def get_covered_until(cls):
+        """ Get start of the last period processed by rollups task for each rollups period.
+
+            Rollups are stored only on change, so the last processed period is cached by the task.
+            Timestamp of the last rollup is used if cache is empty, it is less precise but still correct.
+        """
+        keys = {period: cls.COVERED_UNTIL_CACHE_KEY % period for period, _ in cls.Periods.CHOICES}
+        cached = cache.get_many(keys.values())
+        if len(cached) == len(keys):
+            return {period: cached[key] for period, key in keys.items()}
+        return dict(cls.objects.order_by().values_list('period').annotate(Max('timestamp')))
+
+    @classmethod
+    def set_covered_until(cls, period, timestamp):
+        cache.set(cls.COVERED_UNTIL_CACHE_KEY % period, timestamp, None)
+
+    @classmethod
+    def get_period_start(cls, date, period):
+        if period == cls.Periods.HOUR:
+            return date.replace(minute=0, second=0, microsecond=0)
+        return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_quotas_history(quotas, dates):
+    """ Get (limit, usage) pair of each quota for each of given dates.
+
+        Each date is served by the coarsest source that contains exact value for it:
+        daily rollups for dates at the beginning of a day, hourly rollups for dates
+        at the beginning of an hour and raw samples for other dates. Dates older than
+        samples lifetime are served by the coarsest available rollup.
+        Result has the same format as BaseQuotaSample._get_history returns.
+    """
+    now = timezone.now()
+    lifetimes = {
+        None: settings.NODECONDUCTOR.get('QUOTA_SAMPLES_LIFETIME'),
+        QuotaRollup.Periods.HOUR: settings.NODECONDUCTOR.get('QUOTA_HOURLY_ROLLUPS_LIFETIME'),
+        QuotaRollup.Periods.DAY: None,
+    }
+    covered_until = QuotaRollup.get_covered_until()
+
+    def is_complete(date, period):
+        lifetime = lifetimes[period]
+        return lifetime is None or date >= now - lifetime
+
+    def get_source(date):
+        periods = [period for period in (QuotaRollup.Periods.DAY, QuotaRollup.Periods.HOUR)
+                   if period in covered_until and date <= covered_until[period]]
+        for period in periods:
+            if QuotaRollup.get_period_start(date, period) == date and is_complete(date, period):
+                return period
+        if not is_complete(date, None):
+            # Samples are compacted already, so the finest rollup is used as approximation.
+            for period in reversed(periods):
+                if is_complete(date, period):
+                    return period
+        return None
+
+    indexes_by_source = defaultdict(list)
+    for index, date in enumerate(dates):
+        indexes_by_source[get_source(date)].append(index)
+
+    history = defaultdict(lambda: [None] * len(dates))
+    for source, indexes in indexes_by_source.items():
+        source_dates = [dates[index] for index in indexes]
+        if source is None:
+            source_history = QuotaSample.get_history(quotas, source_dates)
+        else:
+            source_history = QuotaRollup.get_history(quotas, source_dates, source)
+        for quota_id, values in source_history.items():
+            for index, value in zip(indexes, values):
+                history[quota_id][index] = value
+    return dict(history)
+
 
 def _fail_silently(method):
 
@@ -149,6 +456,8 @@ class QuotaModelMixin(models.Model):
     @_fail_silently
     def set_quota_usage(self, quota_name, usage, fail_silently=False):
         quota = self.quotas.get(name=quota_name)
+        # Deltas that are not applied yet would be added on top of the new value.
+        _discard_pending_usage_deltas(quota.pk)
         if quota.usage != usage:
             quota.usage = usage
             quota.save(update_fields=['usage'])
@@ -156,12 +465,12 @@ class QuotaModelMixin(models.Model):
     @_fail_silently
     def add_quota_usage(self, quota_name, usage_delta, fail_silently=False, validate=False):
         quota = self.quotas.get(name=quota_name)
-        quota.usage += usage_delta
-        if validate and quota.usage > quota.limit:
+        new_usage = quota.usage + quota.get_pending_usage_delta() + usage_delta
+        if validate and new_usage > quota.limit:
             raise exceptions.QuotaValidationError(
                 _('%(quota)s "%(name)s" quota is over limit. Required: %(usage)s, limit: %(limit)s.') % dict(
-                    quota=self, name=quota_name, usage=quota.usage, limit=quota.limit))
-        quota.save()
+                    quota=self, name=quota_name, usage=new_usage, limit=quota.limit))
+        quota.add_usage(usage_delta)
 
     def get_quota_ancestors(self):
         if isinstance(self, DescendantMixin):
@@ -188,7 +497,7 @@ class QuotaModelMixin(models.Model):
             quota = self.quotas.get(name=name)
             if quota.is_exceeded(delta):
                 errors.append('%s quota limit: %s, requires %s (%s)\n' % (
-                    quota.name, quota.limit, quota.usage + delta, quota.scope))
+                    quota.name, quota.limit, quota.usage + quota.get_pending_usage_delta() + delta, quota.scope))
         if not raise_exception:
             return errors
         else:
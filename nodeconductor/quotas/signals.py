@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent when quota usage is changed by atomic delta instead of quota saving.
+# Quota.add_usage does not send post_save, so receivers that track quota usage
+# changes should listen to this signal too. Signal is sent after transaction commit.
+# sender = Quota class
+quota_usage_changed = Signal(providing_args=['instance', 'delta'])
@@ -0,0 +1,111 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from nodeconductor.quotas.models import Quota, QuotaSample, QuotaRollup
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of periods and quotas that are processed together by rollups task.
+ROLLUPS_MAX_PERIODS = 24 * 7
+ROLLUPS_QUOTAS_CHUNK_SIZE = 1000
+
+
+@shared_task(name='nodeconductor.quotas.create_rollups')
+def create_rollups():
+    """ Store quotas limits and usages at the beginning of each passed hour and day.
+
+        Rollup is created only if quota limit or usage has changed since previous rollup.
+    """
+    for period, _ in QuotaRollup.Periods.CHOICES:
+        _create_rollups(period)
+
+
+def _create_rollups(period):
+    duration = QuotaRollup.Periods.DURATIONS[period]
+    end = QuotaRollup.get_period_start(timezone.now(), period)
+    last_timestamp = QuotaRollup.get_covered_until().get(period)
+    if last_timestamp is not None:
+        start = last_timestamp + duration
+    else:
+        first_timestamp = QuotaSample.objects.aggregate(Min('timestamp'))['timestamp__min']
+        if first_timestamp is None:
+            return
+        start = QuotaRollup.get_period_start(first_timestamp, period)
+
+    # Long history (for example, right after import) is processed by several runs.
+    end = min(end, start + duration * (ROLLUPS_MAX_PERIODS - 1))
+    timestamps = []
+    while start <= end:
+        timestamps.append(start)
+        start += duration
+    if not timestamps:
+        return
+
+    quotas_ids = list(Quota.objects.order_by('pk').values_list('pk', flat=True))
+    count = 0
+    for index in range(0, len(quotas_ids), ROLLUPS_QUOTAS_CHUNK_SIZE):
+        chunk = quotas_ids[index:index + ROLLUPS_QUOTAS_CHUNK_SIZE]
+        count += _create_chunk_rollups(chunk, period, timestamps, last_timestamp)
+    QuotaRollup.set_covered_until(period, end)
+    logger.info('%s %s quotas rollups were created.', count, period)
+
+
+def _create_chunk_rollups(quotas_ids, period, timestamps, last_timestamp):
+    if last_timestamp is not None:
+        previous_values = {quota_id: values[0] for quota_id, values in
+                           QuotaRollup.get_history(quotas_ids, [last_timestamp], period).items()}
+    else:
+        previous_values = {}
+
+    new_rollups = []
+    for quota_id, history in QuotaSample.get_history(quotas_ids, timestamps).items():
+        previous = previous_values.get(quota_id)
+        for timestamp, values in zip(timestamps, history):
+            if values is not None and values != previous:
+                limit, usage = values
+                new_rollups.append(QuotaRollup(
+                    quota_id=quota_id, period=period, timestamp=timestamp, limit=limit, usage=usage))
+                previous = values
+    QuotaRollup.objects.bulk_create(new_rollups, batch_size=500)
+    return len(new_rollups)
+
+
+@shared_task(name='nodeconductor.quotas.compact_history')
+def compact_history():
+    """ Replace samples and hourly rollups that are older than their lifetime with single value per quota.
+
+        Only history that is already covered by coarser rollups is compacted.
+    """
+    now = timezone.now()
+    last_timestamps = QuotaRollup.get_covered_until()
+    hourly_lifetime = settings.NODECONDUCTOR.get('QUOTA_HOURLY_ROLLUPS_LIFETIME')
+    samples_lifetime = settings.NODECONDUCTOR.get('QUOTA_SAMPLES_LIFETIME')
+
+    day_end = last_timestamps.get(QuotaRollup.Periods.DAY)
+    hour_end = last_timestamps.get(QuotaRollup.Periods.HOUR)
+    if hourly_lifetime and day_end:
+        # Hourly rollups should stay aligned with hours.
+        cutoff = QuotaRollup.get_period_start(min(now - hourly_lifetime, day_end), QuotaRollup.Periods.HOUR)
+        _compact(QuotaRollup, cutoff, period=QuotaRollup.Periods.HOUR)
+    if samples_lifetime and day_end and hour_end:
+        _compact(QuotaSample, min(now - samples_lifetime, day_end, hour_end))
+
+
+def _compact(model, cutoff, **filters):
+    """ Replace history of each quota before cutoff with its value at cutoff """
+    samples = model.objects.filter(**filters)
+    with transaction.atomic():
+        history = model._get_history(samples, [cutoff])
+        deleted_count = samples.filter(timestamp__lte=cutoff).delete()[0]
+        model.objects.bulk_create([
+            model(quota_id=quota_id, timestamp=cutoff, limit=values[0][0], usage=values[0][1], **filters)
+            for quota_id, values in history.items()
+        ], batch_size=500)
+    logger.info('%s history was compacted: %s records were replaced with %s.',
+                model.__name__, deleted_count, len(history))
@@ -9,6 +9,8 @@ class GrandparentModel(core_models.UuidMixin, quotas_models.QuotaModelMixin, cor
         regular_quota = fields.QuotaField()
         usage_aggregator_quota = fields.UsageAggregatorQuotaField(
             get_children=lambda scope: ChildModel.objects.filter(parent__parent=scope),
+            child_model=lambda: ChildModel,
+            path_to_scope='parent.parent',
         )
         limit_aggregator_quota = fields.LimitAggregatorQuotaField(
             get_children=lambda scope: ChildModel.objects.filter(parent__parent=scope),
@@ -31,6 +33,8 @@ class ParentModel(core_models.UuidMixin, quotas_models.QuotaModelMixin, core_mod
         )
         usage_aggregator_quota = fields.UsageAggregatorQuotaField(
             get_children=lambda scope: scope.children.all(),
+            child_model=lambda: ChildModel,
+            path_to_scope='parent',
         )
         limit_aggregator_quota = fields.LimitAggregatorQuotaField(
             get_children=lambda scope: scope.children.all(),
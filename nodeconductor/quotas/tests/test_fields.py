@@ -1,7 +1,7 @@
 from django.test import TransactionTestCase
-from reversion import revisions as reversion
 
 from nodeconductor.core.utils import silent_call
+from nodeconductor.quotas.models import Quota
 from . import models as test_models
 
 
@@ -21,21 +21,18 @@ class TestQuotaField(TransactionTestCase):
         child.save()
         self.assertEqual(child.quotas.get(name='regular_quota').limit, 9)
 
-    # XXX: Ideally this method should belong to ReversionMixin tests and
-    #      should be separated into several smaller tests.
-    def test_quota_versions(self):
+    def test_quota_samples(self):
         scope = test_models.GrandparentModel.objects.create()
         quota = scope.quotas.get(name=test_models.GrandparentModel.Quotas.regular_quota)
         quota.usage = 13.0
         quota.save()
-        # make sure that new version was created after quota usage change.
-        latest_version = reversion.get_for_object(quota).latest('revision__date_created')
-        self.assertEqual(latest_version.object_version.object.usage, quota.usage)
-        # make sure that new version was not created if object was saved without data change.
+        # make sure that new sample was created after quota usage change.
+        latest_sample = quota.samples.latest('timestamp')
+        self.assertEqual(latest_sample.usage, quota.usage)
+        # make sure that new sample was not created if object was saved without data change.
         quota.usage = 13
         quota.save()
-        new_latest_version = reversion.get_for_object(quota).latest('revision__date_created')
-        self.assertEqual(new_latest_version, latest_version)
+        self.assertEqual(quota.samples.latest('timestamp'), latest_sample)
 
 
 class TestCounterQuotaField(TransactionTestCase):
@@ -65,6 +62,24 @@ class TestCounterQuotaField(TransactionTestCase):
         quota = self.parent.quotas.get(name=self.quota_field)
         self.assertEqual(quota.usage, 1)
 
+    def test_samples_of_recalculated_quotas_are_recorded(self):
+        quota = self.parent.quotas.get(name=self.quota_field)
+        Quota.objects.filter(pk=quota.pk).update(usage=3)
+
+        self.quota_field.recalculate_usages(scope_model=test_models.ParentModel)
+
+        self.assertEqual(quota.samples.latest('timestamp').usage, 1)
+
+    def test_counter_quota_usages_are_calculated_by_query_per_target_model(self):
+        second_parent = test_models.ParentModel.objects.create(parent=self.grandparent)
+        test_models.SecondChildModel.objects.create(parent=second_parent)
+        quota_field = test_models.ParentModel.Quotas.two_targets_counter_quota
+
+        with self.assertNumQueries(2):
+            usages = quota_field.get_current_usages(test_models.ParentModel)
+
+        self.assertEqual(usages, {self.parent.pk: 1, second_parent.pk: 1})
+
     def test_counter_quota_usage_is_working_with_two_models_as_targets(self):
         self.parent.second_children.create()
 
@@ -146,6 +161,41 @@ class TestUsageAggregatorField(TransactionTestCase):
         quota = self.grandparent.quotas.get(name=self.grandparent_quota_field)
         self.assertEqual(quota.usage, usage_value * len(self.children))
 
+    def test_usage_aggregator_usages_are_calculated_by_grouped_query(self):
+        for child in self.children:
+            child.set_quota_usage(self.child_quota_field, 5)
+        grandparent_field = test_models.GrandparentModel.Quotas.usage_aggregator_quota
+
+        with self.assertNumQueries(1):
+            usages = grandparent_field.get_current_usages(test_models.GrandparentModel)
+
+        self.assertEqual(usages, {self.grandparent.pk: 10})
+
+    def test_grouped_usages_are_equal_to_sums_of_children_of_each_scope(self):
+        other_grandparent = test_models.GrandparentModel.objects.create()
+        other_parent = test_models.ParentModel.objects.create(parent=other_grandparent)
+        other_child = test_models.ChildModel.objects.create(parent=other_parent)
+        for usage, child in enumerate(self.children + [other_child], 1):
+            child.set_quota_usage(self.child_quota_field, usage)
+
+        for scope_model, field in ((test_models.GrandparentModel, self.grandparent_quota_field),
+                                   (test_models.ParentModel, self.parent_quota_field),
+                                   (test_models.ParentModel, test_models.ParentModel.Quotas.second_usage_aggregator_quota)):
+            usages = field.get_current_usages(scope_model)
+            expected = {scope.pk: field._get_children_sum(field.get_children(scope))
+                        for scope in scope_model.objects.all()}
+            self.assertEqual(usages, expected)
+
+    def test_grouping_is_derived_from_foreign_key_of_children(self):
+        field = test_models.ParentModel.Quotas.second_usage_aggregator_quota
+
+        self.assertEqual(field.get_grouping(test_models.ParentModel), (test_models.ChildModel, 'parent'))
+
+    def test_grouping_is_not_derived_if_children_are_filtered(self):
+        field = test_models.GrandparentModel.Quotas.limit_aggregator_quota
+
+        self.assertIsNone(field.get_grouping(test_models.GrandparentModel))
+
     def test_usage_aggregator_quota_works_with_specified_child_quota_name(self):
         usage_value = 10
         for child in self.children:
@@ -2,7 +2,6 @@ from datetime import timedelta
 
 from django.utils import timezone
 from rest_framework import test, status
-from reversion import revisions as reversion
 
 from nodeconductor.core import utils as core_utils
 from nodeconductor.quotas.tests import factories
@@ -19,10 +18,8 @@ class QuotaHistoryTest(test.APITransactionTestCase):
 
         self.quota = factories.QuotaFactory(scope=self.customer)
         self.url = factories.QuotaFactory.get_url(self.quota, 'history')
-        # Hook for test: lets say that revision was created one hour ago
-        version = reversion.get_for_date(self.quota, timezone.now())
-        version.revision.date_created = timezone.now() - timedelta(hours=1)
-        version.revision.save()
+        # Hook for test: lets say that sample was created one hour ago
+        self.quota.samples.update(timestamp=timezone.now() - timedelta(hours=1))
 
     def test_old_version_of_quota_is_available(self):
         old_usage = self.quota.usage
@@ -37,6 +34,21 @@ class QuotaHistoryTest(test.APITransactionTestCase):
         self.assertEqual(response.data[0]['point'], history_timestamp)
         self.assertEqual(response.data[0]['object']['usage'], old_usage)
 
+    def test_each_point_contains_latest_value_before_it(self):
+        old_usage = self.quota.usage
+        self.quota.usage = old_usage + 1
+        self.quota.save()
+        points = [timezone.now() - timedelta(hours=2), timezone.now() - timedelta(minutes=30),
+                  timezone.now() + timedelta(minutes=1)]
+
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(self.url, data={'point': [core_utils.datetime_to_timestamp(p) for p in points]})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('object', response.data[0])
+        self.assertEqual(response.data[1]['object']['usage'], old_usage)
+        self.assertEqual(response.data[2]['object']['usage'], old_usage + 1)
+
     def test_endpoint_does_not_return_object_if_date(self):
         history_timestamp = core_utils.datetime_to_timestamp(timezone.now() - timedelta(hours=2))
 
@@ -44,3 +44,36 @@ class QuotaThresholdAlertTest(test.APITransactionTestCase):
         })
         self.assertEqual(status.HTTP_200_OK, response.status_code, response.data)
         self.assertEqual(1000, response.data['threshold'], response.data)
+
+
+class CheckThresholdTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.projects = ProjectFactory.create_batch(3)
+        for project in self.projects:
+            project.quotas.filter(name=project.Quotas.nc_resource_count.name).update(threshold=10, usage=20)
+
+    def get_open_alerts(self):
+        return Alert.objects.filter(alert_type='threshold_exceeded', closed__isnull=True)
+
+    def test_alerts_are_opened_for_all_exceeded_scopes(self):
+        check_threshold()
+
+        self.assertEqual(set(self.get_open_alerts().values_list('object_id', flat=True)),
+                         {project.id for project in self.projects})
+
+    def test_alert_is_closed_if_quota_is_not_exceeded_anymore(self):
+        check_threshold()
+        self.projects[0].quotas.filter(name=self.projects[0].Quotas.nc_resource_count.name).update(usage=5)
+
+        check_threshold()
+
+        self.assertEqual(set(self.get_open_alerts().values_list('object_id', flat=True)),
+                         {project.id for project in self.projects[1:]})
+        self.assertTrue(Alert.objects.filter(object_id=self.projects[0].id, closed__isnull=False).exists())
+
+    def test_unchanged_alerts_are_not_written(self):
+        check_threshold()
+
+        # Checked and exceeded quotas, checked and exceeded price estimates and open alerts.
+        with self.assertNumQueries(5):
+            check_threshold()
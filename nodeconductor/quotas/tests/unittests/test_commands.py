@@ -1,6 +1,13 @@
+import datetime
+import json
+
+from django.contrib.contenttypes.models import ContentType
 from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from reversion.models import Revision, Version
 
+from nodeconductor.quotas import models
 from nodeconductor.structure.tests import factories as structure_factories
 
 
@@ -23,3 +30,53 @@ class RecalculateCommandTest(TestCase):
 
         call_command('recalculatequotas')
         self.assertEqual(customer.quotas.get(name='nc_resource_count').usage, 0)
+
+
+class ImportQuotasHistoryCommandTest(TestCase):
+
+    def setUp(self):
+        self.customer = structure_factories.CustomerFactory()
+        self.quota = self.customer.quotas.get(name='nc_project_count')
+        models.QuotaSample.objects.all().delete()
+
+    def create_version(self, date, usage):
+        revision = Revision.objects.create()
+        revision.date_created = date
+        revision.save()
+        serialized_data = json.dumps([{'fields': {'limit': self.quota.limit, 'usage': usage}}])
+        Version.objects.create(
+            revision=revision,
+            object_id=self.quota.id,
+            object_id_int=self.quota.id,
+            content_type=ContentType.objects.get_for_model(self.quota),
+            format='json',
+            serialized_data=serialized_data,
+            object_repr=str(self.quota),
+        )
+
+    def test_versions_are_imported_as_samples(self):
+        date = timezone.now() - datetime.timedelta(days=1)
+        self.create_version(date, usage=3)
+
+        call_command('importquotashistory')
+
+        sample = self.quota.samples.get()
+        self.assertEqual(sample.timestamp, date)
+        self.assertEqual(sample.usage, 3)
+
+    def test_sample_is_created_for_quota_without_versions(self):
+        call_command('importquotashistory')
+
+        self.assertEqual(self.quota.samples.get().usage, self.quota.usage)
+
+    def test_versions_older_than_existing_samples_are_imported(self):
+        now = timezone.now()
+        self.create_version(now - datetime.timedelta(days=2), usage=3)
+        self.create_version(now - datetime.timedelta(hours=1), usage=4)
+        models.QuotaSample.objects.create(
+            quota=self.quota, timestamp=now - datetime.timedelta(days=1), limit=self.quota.limit, usage=5)
+
+        call_command('importquotashistory')
+        call_command('importquotashistory')
+
+        self.assertEqual(list(self.quota.samples.order_by('timestamp').values_list('usage', flat=True)), [3, 5])
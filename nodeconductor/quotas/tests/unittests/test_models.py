@@ -1,8 +1,13 @@
 import random
 
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+import mock
 
-from ..models import GrandparentModel
+from nodeconductor.quotas import signals
+from nodeconductor.quotas.exceptions import QuotaValidationError
+from nodeconductor.quotas.models import Quota, batch_usage_deltas
+from ..models import GrandparentModel, ParentModel, ChildModel
 
 
 class QuotaModelMixinTest(TestCase):
@@ -48,3 +53,117 @@ class QuotaModelMixinTest(TestCase):
         sum_of_quotas = GrandparentModel.get_sum_of_quotas_as_dict(
             instances, quota_names=['regular_quota'], fields=['limit'])
         self.assertEqual({'regular_quota': -1}, sum_of_quotas)
+
+
+class QuotaUsageDeltaTest(TestCase):
+
+    def setUp(self):
+        self.grandparent = GrandparentModel.objects.create()
+        self.parent = ParentModel.objects.create(parent=self.grandparent)
+        self.child = ChildModel.objects.create(parent=self.parent)
+
+    def get_usage(self, scope, quota_name):
+        return scope.quotas.get(name=quota_name).usage
+
+    def test_usage_is_increased_by_update_without_quota_saving(self):
+        quota = self.child.quotas.get(name='regular_quota')
+        # stale value should not be written back to database
+        Quota.objects.filter(pk=quota.pk).update(usage=5)
+
+        quota.add_usage(3)
+
+        self.assertEqual(self.get_usage(self.child, 'regular_quota'), 8)
+
+    def test_usage_delta_is_propagated_to_aggregator_quotas(self):
+        self.child.add_quota_usage('usage_aggregator_quota', 2)
+
+        self.assertEqual(self.get_usage(self.parent, 'usage_aggregator_quota'), 2)
+        self.assertEqual(self.get_usage(self.grandparent, 'usage_aggregator_quota'), 2)
+
+    def test_deltas_of_the_same_quota_are_collapsed_in_batch(self):
+        quota = self.child.quotas.get(name='regular_quota')
+
+        with batch_usage_deltas():
+            for _ in range(5):
+                quota.add_usage(1)
+            self.assertEqual(self.get_usage(self.child, 'regular_quota'), 0)
+
+        self.assertEqual(self.get_usage(self.child, 'regular_quota'), 5)
+
+    def test_deltas_are_discarded_if_batch_fails(self):
+        with self.assertRaises(ValueError):
+            with batch_usage_deltas():
+                self.child.add_quota_usage('regular_quota', 1)
+                raise ValueError()
+
+        self.assertEqual(self.get_usage(self.child, 'regular_quota'), 0)
+
+    def test_deltas_are_applied_in_current_transaction(self):
+        quota = self.child.quotas.get(name='regular_quota')
+
+        with transaction.atomic():
+            quota.add_usage(1)
+            self.assertEqual(self.get_usage(self.child, 'regular_quota'), 1)
+
+        self.assertEqual(self.get_usage(self.child, 'regular_quota'), 1)
+
+    def test_deltas_of_rolled_back_transaction_are_discarded(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.child.add_quota_usage('usage_aggregator_quota', 1)
+                raise ValueError()
+
+        self.assertEqual(self.get_usage(self.child, 'usage_aggregator_quota'), 0)
+        self.assertEqual(self.get_usage(self.parent, 'usage_aggregator_quota'), 0)
+
+    def test_pending_deltas_are_validated(self):
+        self.child.set_quota_limit('regular_quota', 5)
+
+        with self.assertRaises(QuotaValidationError):
+            with batch_usage_deltas():
+                self.child.add_quota_usage('regular_quota', 3, validate=True)
+                self.child.add_quota_usage('regular_quota', 3, validate=True)
+
+    def test_pending_deltas_are_taken_into_account_by_quota_change_validation(self):
+        self.child.set_quota_limit('regular_quota', 5)
+
+        with batch_usage_deltas():
+            self.child.add_quota_usage('regular_quota', 3)
+            errors = self.child.validate_quota_change({'regular_quota': 3})
+
+        self.assertEqual(len(errors), 1)
+
+    def test_new_usage_value_overrides_pending_deltas(self):
+        with batch_usage_deltas():
+            self.child.add_quota_usage('regular_quota', 3)
+            self.child.set_quota_usage('regular_quota', 10)
+
+        self.assertEqual(self.get_usage(self.child, 'regular_quota'), 10)
+
+
+class QuotaUsageChangedSignalTest(TransactionTestCase):
+
+    def setUp(self):
+        self.child = ChildModel.objects.create(parent=ParentModel.objects.create(parent=GrandparentModel.objects.create()))
+        self.quota = self.child.quotas.get(name='regular_quota')
+        self.receiver = mock.Mock()
+        signals.quota_usage_changed.connect(self.receiver, sender=Quota)
+
+    def tearDown(self):
+        signals.quota_usage_changed.disconnect(self.receiver, sender=Quota)
+
+    def test_signal_is_sent_and_sample_is_recorded_after_commit(self):
+        with transaction.atomic():
+            self.quota.add_usage(2)
+            self.assertFalse(self.receiver.called)
+
+        self.receiver.assert_called_once_with(
+            signal=signals.quota_usage_changed, sender=Quota, instance=self.quota, delta=2)
+        self.assertEqual(self.quota.samples.latest('timestamp').usage, 2)
+
+    def test_signal_is_not_sent_for_deleted_quota(self):
+        with transaction.atomic():
+            self.quota.add_usage(2)
+            self.quota.delete()
+
+        self.assertFalse(self.receiver.called)
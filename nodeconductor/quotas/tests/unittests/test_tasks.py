@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+import mock
+
+from nodeconductor.quotas import tasks
+from nodeconductor.quotas.models import QuotaSample, QuotaRollup, get_quotas_history
+from nodeconductor.quotas.tests import factories
+
+
+class QuotasRollupsTest(TestCase):
+
+    def setUp(self):
+        self.quota = factories.QuotaFactory(limit=10, usage=5)
+        self.quota.samples.all().delete()
+        self.today = QuotaRollup.get_period_start(timezone.now(), QuotaRollup.Periods.DAY)
+        self.add_sample(days=-3, limit=10, usage=1)
+        self.add_sample(days=-2, hours=2, limit=10, usage=2)
+        self.add_sample(days=-2, hours=3, limit=10, usage=3)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def add_sample(self, limit, usage, **delta):
+        QuotaSample.objects.create(
+            quota=self.quota, timestamp=self.today + timedelta(**delta), limit=limit, usage=usage)
+
+    def get_rollups(self, period):
+        return list(self.quota.rollups.filter(period=period).order_by('timestamp').values_list('timestamp', 'usage'))
+
+    def test_rollup_is_created_only_if_quota_value_has_changed(self):
+        tasks.create_rollups()
+
+        self.assertEqual(self.get_rollups(QuotaRollup.Periods.DAY), [
+            (self.today - timedelta(days=3), 1),
+            (self.today - timedelta(days=1), 3),
+        ])
+        self.assertEqual(self.get_rollups(QuotaRollup.Periods.HOUR), [
+            (self.today - timedelta(days=3), 1),
+            (self.today - timedelta(days=2, hours=-2), 2),
+            (self.today - timedelta(days=2, hours=-3), 3),
+        ])
+
+    def test_rollups_are_created_for_new_periods_only(self):
+        tasks.create_rollups()
+        self.add_sample(days=-1, limit=10, usage=4)
+
+        tasks.create_rollups()
+
+        self.assertEqual(self.get_rollups(QuotaRollup.Periods.DAY)[-1], (self.today - timedelta(days=1), 3))
+
+    def test_history_is_served_by_rollups_for_period_starts(self):
+        tasks.create_rollups()
+        self.quota.samples.all().delete()
+
+        history = get_quotas_history([self.quota.pk], [self.today - timedelta(days=1), self.today])
+
+        self.assertEqual(history, {self.quota.pk: [(10, 3), (10, 3)]})
+
+    def test_history_is_served_by_samples_for_other_dates(self):
+        tasks.create_rollups()
+        self.quota.rollups.all().delete()
+        date = self.today - timedelta(days=2, hours=-2, minutes=-30)
+
+        with self.assertNumQueries(2):
+            history = get_quotas_history([self.quota.pk], [date])
+
+        self.assertEqual(history, {self.quota.pk: [(10, 2)]})
+
+    def test_compaction_keeps_quota_value(self):
+        tasks.create_rollups()
+        nodeconductor_settings = {'QUOTA_SAMPLES_LIFETIME': timedelta(days=1),
+                                  'QUOTA_HOURLY_ROLLUPS_LIFETIME': timedelta(days=1)}
+
+        with self.settings(NODECONDUCTOR=nodeconductor_settings):
+            tasks.compact_history()
+            history = get_quotas_history([self.quota.pk], [timezone.now() - timedelta(hours=1)])
+
+        self.assertEqual(self.quota.samples.count(), 1)
+        self.assertEqual(history, {self.quota.pk: [(10, 3)]})
+
+    def test_long_history_is_processed_by_several_runs(self):
+        with mock.patch('nodeconductor.quotas.tasks.ROLLUPS_MAX_PERIODS', 2):
+            tasks.create_rollups()
+            self.assertEqual(QuotaRollup.get_covered_until()[QuotaRollup.Periods.DAY],
+                             self.today - timedelta(days=2))
+
+            tasks.create_rollups()
+            tasks.create_rollups()
+
+        self.assertEqual(self.get_rollups(QuotaRollup.Periods.DAY), [
+            (self.today - timedelta(days=3), 1),
+            (self.today - timedelta(days=1), 3),
+        ])
+
+    def test_compacted_hourly_rollups_are_aligned_with_hours(self):
+        tasks.create_rollups()
+        nodeconductor_settings = {'QUOTA_HOURLY_ROLLUPS_LIFETIME': timedelta(days=1, minutes=30)}
+
+        with self.settings(NODECONDUCTOR=nodeconductor_settings):
+            tasks.compact_history()
+
+        timestamps = self.quota.rollups.filter(period=QuotaRollup.Periods.HOUR).values_list('timestamp', flat=True)
+        for timestamp in timestamps:
+            self.assertEqual(timestamp, QuotaRollup.get_period_start(timestamp, QuotaRollup.Periods.HOUR))
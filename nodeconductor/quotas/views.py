@@ -3,8 +3,6 @@ from __future__ import unicode_literals
 from rest_framework import permissions as rf_permissions, exceptions as rf_exceptions, decorators, response, status
 from rest_framework import mixins
 from rest_framework import viewsets
-from reversion import revisions as reversion
-from reversion.models import Version
 
 from nodeconductor.core.pagination import UnlimitedLinkHeaderPagination
 from nodeconductor.core.serializers import HistorySerializer
@@ -134,19 +132,13 @@ class QuotaViewSet(mixins.UpdateModelMixin,
 
         quota = self.get_object()
         serializer = self.get_serializer(quota)
+        point_dates = history_serializer.get_filter_data()
         serialized_versions = []
-        for point_date in history_serializer.get_filter_data():
+        for point_date, values in zip(point_dates, quota.get_history(point_dates)):
             serialized = {'point': datetime_to_timestamp(point_date)}
-            try:
-                version = reversion.get_for_date(quota, point_date)
-            except Version.DoesNotExist:
-                pass
-            else:
-                # make copy of serialized data and update field that are stored in version
-                version_object = version.object_version.object
+            if values is not None:
+                # make copy of serialized data and update fields that are stored in history
                 serialized['object'] = serializer.data.copy()
-                serialized['object'].update({
-                    f: getattr(version_object, f) for f in quota.get_version_fields()
-                })
+                serialized['object']['limit'], serialized['object']['usage'] = values
             serialized_versions.append(serialized)
         return response.Response(serialized_versions, status=status.HTTP_200_OK)
@@ -235,6 +235,21 @@ CELERYBEAT_SCHEDULE = {
         'schedule': timedelta(minutes=30),
         'args': (),
     },
+    'send-email-digests': {
+        'task': 'nodeconductor.logging.send_email_digests',
+        'schedule': timedelta(minutes=1),
+        'args': (),
+    },
+    'create-quotas-rollups': {
+        'task': 'nodeconductor.quotas.create_rollups',
+        'schedule': crontab(minute=1),
+        'args': (),
+    },
+    'compact-quotas-history': {
+        'task': 'nodeconductor.quotas.compact_history',
+        'schedule': crontab(minute=30, hour=3),
+        'args': (),
+    },
     'cancel-expired-invitations': {
         'task': 'nodeconductor.users.cancel_expired_invitations',
         'schedule': timedelta(hours=24),
@@ -256,6 +271,8 @@ NODECONDUCTOR = {
     'SUSPEND_UNPAID_CUSTOMERS': False,
     'CLOSED_ALERTS_LIFETIME': timedelta(weeks=1),
     'INVITATION_LIFETIME': timedelta(weeks=1),
+    'QUOTA_SAMPLES_LIFETIME': timedelta(weeks=1),
+    'QUOTA_HOURLY_ROLLUPS_LIFETIME': timedelta(days=90),
 }
 
 
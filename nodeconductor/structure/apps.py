@@ -10,7 +10,9 @@ class StructureConfig(AppConfig):
     verbose_name = 'Structure'
 
     def ready(self):
-        from nodeconductor.core.models import CoordinatesMixin
+        from nodeconductor.core.models import CoordinatesMixin, SshPublicKey
+        from nodeconductor.logging import signals as logging_signals
+        from nodeconductor.logging.models import Alert, BaseHook
         from nodeconductor.structure.models import ResourceMixin, Service, TagMixin
         from nodeconductor.structure import handlers
         from nodeconductor.structure import signals as structure_signals
@@ -85,6 +87,29 @@ class StructureConfig(AppConfig):
             dispatch_uid='nodeconductor.structure.handlers.log_project_role_revoked',
         )
 
+        for model in (self.get_model('CustomerPermission'), self.get_model('ProjectPermission')):
+            signals.post_save.connect(
+                handlers.invalidate_permission_caches_on_permission_change,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.'
+                             'invalidate_permission_caches_on_{}_save'.format(model.__name__),
+            )
+
+            signals.post_delete.connect(
+                handlers.invalidate_permission_caches_on_permission_change,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.'
+                             'invalidate_permission_caches_on_{}_delete'.format(model.__name__),
+            )
+
+        for model in structure_models_with_roles:
+            structure_signals.structure_role_revoked.connect(
+                handlers.invalidate_permission_caches_on_role_revoked,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.'
+                             'invalidate_permission_caches_on_{}_role_revoked'.format(model.__name__),
+            )
+
         signals.pre_delete.connect(
             handlers.revoke_roles_on_project_deletion,
             sender=Project,
@@ -193,3 +218,73 @@ class StructureConfig(AppConfig):
             sender=TagMixin.tags.through,
             dispatch_uid='nodeconductor.structure.handlers.clean_tags_cache_after_tagged_item_created'
         )
+
+        counted_models = [Project] + Service.get_all_models() + ResourceMixin.get_all_models()
+        for index, model in enumerate(counted_models):
+            signals.post_save.connect(
+                handlers.invalidate_counters_on_object_create,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.invalidate_counters_on_{}_create_{}'.format(
+                    model.__name__, index),
+            )
+
+            signals.post_delete.connect(
+                handlers.invalidate_counters_on_object_change,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.invalidate_counters_on_{}_delete_{}'.format(
+                    model.__name__, index),
+            )
+
+        for model in (self.get_model('CustomerPermission'), self.get_model('ProjectPermission')):
+            signals.post_save.connect(
+                handlers.invalidate_counters_on_object_change,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.invalidate_counters_on_{}_save'.format(model.__name__),
+            )
+
+            signals.post_delete.connect(
+                handlers.invalidate_counters_on_object_change,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.invalidate_counters_on_{}_delete'.format(model.__name__),
+            )
+
+        for model in structure_models_with_roles:
+            structure_signals.structure_role_revoked.connect(
+                handlers.invalidate_counters_on_role_revoked,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.'
+                             'invalidate_counters_on_{}_role_revoked'.format(model.__name__),
+            )
+
+        signals.post_save.connect(
+            handlers.invalidate_counters_on_alert_change,
+            sender=Alert,
+            dispatch_uid='nodeconductor.structure.handlers.invalidate_counters_on_alert_save',
+        )
+
+        signals.post_delete.connect(
+            handlers.invalidate_counters_on_alert_change,
+            sender=Alert,
+            dispatch_uid='nodeconductor.structure.handlers.invalidate_counters_on_alert_delete',
+        )
+
+        logging_signals.alerts_bulk_changed.connect(
+            handlers.invalidate_counters_on_alerts_bulk_change,
+            sender=Alert,
+            dispatch_uid='nodeconductor.structure.handlers.invalidate_counters_on_alerts_bulk_change',
+        )
+
+        for model in [SshPublicKey] + BaseHook.get_all_models():
+            signals.post_save.connect(
+                handlers.invalidate_user_counters_on_object_create,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.invalidate_user_counters_on_{}_create'.format(
+                    model.__name__),
+            )
+
+            signals.post_delete.connect(
+                handlers.invalidate_user_counters_on_object_delete,
+                sender=model,
+                dispatch_uid='nodeconductor.structure.handlers.invalidate_user_counters_on_{}_delete'.format(
+                    model.__name__),
+            )
@@ -583,9 +583,13 @@ class AggregateFilter(BaseExternalFilter):
 
         serializer = serializers.AggregateSerializer(data=request.query_params)
         serializer.is_valid(raise_exception=True)
+        return queryset.filter(self.get_aggregate_query(serializer, request.user))
 
-        aggregates = serializer.get_aggregates(request.user)
-        projects = serializer.get_projects(request.user)
+    @staticmethod
+    def get_aggregate_query(serializer, user):
+        """ Get query for objects which generic scope is related to aggregates of validated serializer """
+        aggregates = serializer.get_aggregates(user)
+        projects = serializer.get_projects(user)
         querysets = [aggregates, projects]
         aggregates_ids = list(aggregates.values_list('id', flat=True))
         query = {serializer.data['aggregate'] + '__in': aggregates_ids}
@@ -598,7 +602,7 @@ class AggregateFilter(BaseExternalFilter):
 
         for model in all_models:
             qs = model.objects.filter(**query).all()
-            querysets.append(filter_queryset_for_user(qs, request.user))
+            querysets.append(filter_queryset_for_user(qs, user))
 
         aggregate_query = Q()
         for qs in querysets:
@@ -606,7 +610,7 @@ class AggregateFilter(BaseExternalFilter):
             ids = qs.values_list('id', flat=True)
             aggregate_query |= Q(content_type=content_type, object_id__in=ids)
 
-        return queryset.filter(aggregate_query)
+        return aggregate_query
 
 ExternalAlertFilterBackend.register(AggregateFilter())
 
@@ -8,7 +8,7 @@ from django.utils import timezone
 from nodeconductor.core import utils
 from nodeconductor.core.tasks import send_task
 from nodeconductor.core.models import SynchronizationStates, StateMixin
-from nodeconductor.structure import SupportedServices, signals
+from nodeconductor.structure import SupportedServices, managers, signals
 from nodeconductor.structure.log import event_logger
 from nodeconductor.structure.models import (Customer, CustomerPermission, Project, ProjectPermission,
                                             Service, ServiceSettings, NewResource)
@@ -322,3 +322,54 @@ def clean_tags_cache_after_tagged_item_saved(sender, instance, **kwargs):
 
 def clean_tags_cache_before_tagged_item_deleted(sender, instance, **kwargs):
     instance.content_object.clean_tag_cache()
+
+
+def invalidate_permission_caches_on_permission_change(sender, instance, **kwargs):
+    _invalidate_permission_caches(instance.user)
+
+
+def invalidate_permission_caches_on_role_revoked(sender, structure, user, role, **kwargs):
+    """
+    Permissions are revoked by queryset update without emitting post_save signal.
+    """
+    _invalidate_permission_caches(user)
+
+
+def _invalidate_permission_caches(user):
+    managers.invalidate_permission_index(user)
+    event_logger.invalidate_permitted_objects_uuids(user)
+
+
+def invalidate_counters_on_object_create(sender, instance, created=False, **kwargs):
+    if created:
+        managers.invalidate_counters(instance)
+
+
+def invalidate_counters_on_object_change(sender, instance, **kwargs):
+    managers.invalidate_counters(instance)
+
+
+def invalidate_counters_on_role_revoked(sender, structure, user, role, **kwargs):
+    """
+    Permissions are revoked by queryset update without emitting post_save signal.
+    """
+    managers.invalidate_counters(structure)
+
+
+def invalidate_counters_on_alert_change(sender, instance, **kwargs):
+    if instance.scope is not None:
+        managers.invalidate_counters(instance.scope)
+
+
+def invalidate_counters_on_alerts_bulk_change(sender, scopes, **kwargs):
+    for scope in set(scopes):
+        managers.invalidate_counters(scope)
+
+
+def invalidate_user_counters_on_object_create(sender, instance, created=False, **kwargs):
+    if created:
+        managers.invalidate_counters(instance.user)
+
+
+def invalidate_user_counters_on_object_delete(sender, instance, **kwargs):
+    managers.invalidate_counters(instance.user)
@@ -1,16 +1,127 @@
+import hashlib
+import uuid
 from operator import or_
 
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
+from django.utils.encoding import smart_str
 
 from nodeconductor.core.managers import GenericKeyMixin, SummaryQuerySet
 
 
+# Permission index is invalidated on each permission change, timeout is only a safety net.
+PERMISSION_INDEX_TIMEOUT = 60 * 60 * 24
+
+
+def get_permission_index(user):
+    """ Return ids and roles of customers and projects where user has active permissions.
+
+        Example output:
+
+        .. code-block:: python
+
+            {
+                'customer': [(1, 'owner')],
+                'project': [(3, 'admin'), (4, 'manager')],
+            }
+    """
+    key = _get_permission_index_key(user)
+    index = cache.get(key)
+    if index is None:
+        from nodeconductor.structure.models import CustomerPermission, ProjectPermission
+        index = {
+            'customer': list(CustomerPermission.objects.filter(
+                user=user, is_active=True).values_list('customer_id', 'role')),
+            'project': list(ProjectPermission.objects.filter(
+                user=user, is_active=True).values_list('project_id', 'role')),
+        }
+        cache.set(key, index, PERMISSION_INDEX_TIMEOUT)
+    return index
+
+
+def invalidate_permission_index(user):
+    cache.delete(_get_permission_index_key(user))
+
+
+def _get_permission_index_key(user):
+    # User UUID is used instead of ID because ID could be reused after user deletion.
+    return 'structure_permission_index_%s' % user.uuid.hex
+
+
+# Counters are invalidated on changes of counted objects, timeout limits staleness of counters
+# which depend on changes made without signals, for example by queryset update.
+COUNTERS_CACHE_TIMEOUT = 60 * 10
+
+
+def get_cached_counters(scope, context, func):
+    """ Return counters of scope computed by func, cache them until scope counters are invalidated.
+
+        Context should contain everything else counters depend on, for example user permissions.
+    """
+    version = _get_counters_version(scope)
+    key = 'structure_counters_%s' % hashlib.md5(smart_str(repr((version, context)))).hexdigest()
+    counters = cache.get(key)
+    if counters is None:
+        counters = func()
+        cache.set(key, counters, COUNTERS_CACHE_TIMEOUT)
+    return counters
+
+
+def invalidate_counters(instance):
+    """ Invalidate cached counters of instance and of project and customer it belongs to """
+    scopes = [instance]
+    permissions = getattr(instance, 'Permissions', None)
+    for path in (getattr(permissions, 'project_path', None), getattr(permissions, 'customer_path', None)):
+        if path in (None, 'self'):
+            continue
+        scope = instance
+        try:
+            for name in path.split('__'):
+                scope = getattr(scope, name)
+        except ObjectDoesNotExist:
+            continue
+        # Multivalued paths are skipped, objects are counted by their single-valued paths.
+        if isinstance(scope, models.Model):
+            scopes.append(scope)
+    cache.set_many({_get_counters_version_key(scope): uuid.uuid4().hex for scope in scopes}, None)
+
+
+def _get_counters_version(scope):
+    key = _get_counters_version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(key, version, None)
+    return version
+
+
+def _get_counters_version_key(scope):
+    # UUID is used if possible because ID could be reused after object deletion.
+    model = scope._meta.concrete_model
+    return 'structure_counters_version_%s_%s' % (model._meta.label_lower, getattr(scope, 'uuid', scope.pk))
+
+
+def _is_multivalued_path(model, path):
+    for name in path.split('__'):
+        field = model._meta.get_field(name)
+        if field.many_to_many or field.one_to_many:
+            return True
+        model = field.related_model
+    return False
+
+
 def filter_queryset_for_user(queryset, user):
     filtered_relations = ('customer', 'project')
 
     if user is None or user.is_staff or user.is_support:
         return queryset
 
+    if isinstance(queryset, SummaryQuerySet):
+        # Permission paths are resolved against concrete models
+        queryset.querysets = [filter_queryset_for_user(qs, user) for qs in queryset.querysets]
+        return queryset
+
     def create_q(entity):
         try:
             path = getattr(permissions, '%s_path' % entity)
@@ -18,27 +129,23 @@ def filter_queryset_for_user(queryset, user):
             return None
 
         role = getattr(permissions, '%s_role' % entity, None)
+        ids = [obj_id for obj_id, obj_role in permission_index[entity] if role is None or obj_role == role]
 
         if path == 'self':
-            prefix = ''
+            return models.Q(pk__in=ids)
+        elif _is_multivalued_path(queryset.model, path):
+            # Semi-join does not produce duplicates, so DISTINCT is not needed.
+            subquery = queryset.model._default_manager.filter(**{path + '__in': ids}).values('pk')
+            return models.Q(pk__in=subquery)
         else:
-            prefix = path + '__'
-
-        kwargs = {
-            prefix + 'permissions__user': user,
-            prefix + 'permissions__is_active': True
-        }
-
-        if role:
-            kwargs[prefix + 'permissions__role'] = role
-
-        return models.Q(**kwargs)
+            return models.Q(**{path + '__in': ids})
 
     try:
         permissions = queryset.model.Permissions
     except AttributeError:
         return queryset
 
+    permission_index = get_permission_index(user)
     q_objects = [q_object for q_object in (
         create_q(entity) for entity in filtered_relations
     ) if q_object is not None]
@@ -55,11 +162,8 @@ def filter_queryset_for_user(queryset, user):
     try:
         # Whether both customer and project filtering requested?
         any_of_q = reduce(or_, q_objects)
-        return queryset.filter(any_of_q).distinct()
+        return queryset.filter(any_of_q)
     except TypeError:
-        # Or any of customer and project filtering requested?
-        return queryset.filter(q_objects[0])
-    except IndexError:
         # Looks like no filters are there
         return queryset
 
@@ -1,10 +1,15 @@
 from __future__ import unicode_literals
 
+import collections
 import logging
+from multiprocessing.pool import ThreadPool
+import threading
 
 from celery import shared_task
+from celery.utils import uuid
 from django.core import exceptions
-from django.db import transaction
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.utils import six
 
 from nodeconductor.core import utils as core_utils, tasks as core_tasks, models as core_models
@@ -72,19 +77,32 @@ class BackgroundPullTask(core_tasks.BackgroundTask):
     """ Pull information about object from backend. Method "pull" should be implemented.
 
         Task marks object as ERRED if pull failed and recovers it if pull succeed.
+        Method "pull" should get backend via "get_backend", so backend that is
+        passed to "pull_instance" by chunk pull task is reused.
     """
+    _pulled_backend = threading.local()
 
     def run(self, serialized_instance):
         instance = core_utils.deserialize_instance(serialized_instance)
+        self.pull_instance(instance)
+
+    def pull_instance(self, instance, backend=None):
+        self._pulled_backend.value = backend
         try:
             self.pull(instance)
         except ServiceBackendError as e:
             self.on_pull_fail(instance, e)
         else:
             self.on_pull_success(instance)
+        finally:
+            self._pulled_backend.value = None
 
-    def is_equal(self, other_task, serialized_instance):
-        return self.name == other_task.get('name') and serialized_instance in other_task.get('args', [])
+    def get_backend(self, instance):
+        """ Return backend passed to "pull_instance" or create new backend of the instance """
+        backend = getattr(self._pulled_backend, 'value', None)
+        if backend is None:
+            backend = instance.get_backend()
+        return backend
 
     def pull(self, instance):
         """ Pull instance from backend.
@@ -120,27 +138,158 @@ class BackgroundPullTask(core_tasks.BackgroundTask):
 
 
 class BackgroundListPullTask(core_tasks.BackgroundTask):
-    """ Schedules pull task for each stable object of the model. """
+    """ Schedules pull of stable objects of the model in chunks.
+
+        Objects are grouped by service settings, all objects of the same settings
+        are pulled by one chunk task. At most "max_settings_workers" objects of
+        the settings are pulled simultaneously, each worker thread uses its own backend.
+    """
     model = NotImplemented
     pull_task = NotImplemented
-
-    def is_equal(self, other_task):
-        return self.name == other_task.get('name')
+    # Path from pulled object to its service settings, None if objects are service settings.
+    settings_field = 'service_project_link__service__settings'
+    chunk_size = 100
+    max_workers = 10
+    max_settings_workers = 2
 
     def get_pulled_objects(self):
         States = self.model.States
         return self.model.objects.filter(state__in=[States.ERRED, States.OK]).exclude(backend_id='')
 
+    def get_chunk_objects(self, pks):
+        queryset = self.model.objects.filter(pk__in=pks)
+        if self.settings_field:
+            queryset = queryset.select_related(self.settings_field)
+        return queryset
+
+    def get_settings(self, instance):
+        if not self.settings_field:
+            return instance
+        for field in self.settings_field.split('__'):
+            instance = getattr(instance, field)
+        return instance
+
     def run(self):
-        for instance in self.get_pulled_objects():
-            serialized = core_utils.serialize_instance(instance)
-            self.pull_task().delay(serialized)
+        queryset = self.get_pulled_objects()
+        if self.settings_field:
+            rows = queryset.values_list('pk', self.settings_field)
+        else:
+            rows = [(pk, pk) for pk in queryset.values_list('pk', flat=True)]
+        pks_by_settings = collections.defaultdict(list)
+        for pk, settings_id in rows:
+            pks_by_settings[settings_id].append(pk)
+
+        chunk, chunk_size = {}, 0
+        for settings_id, pks in sorted(pks_by_settings.items()):
+            if chunk and chunk_size + len(pks) > self.chunk_size:
+                BackgroundChunkPullTask().delay(self.name, chunk)
+                chunk, chunk_size = {}, 0
+            chunk[six.text_type(settings_id)] = pks
+            chunk_size += len(pks)
+        if chunk:
+            BackgroundChunkPullTask().delay(self.name, chunk)
+
+
+class BackgroundChunkPullTask(core_tasks.BackgroundTask):
+    """ Pull chunk of objects scheduled by list pull task.
+
+        Objects of each service settings are split between at most "max_settings_workers"
+        threads, each thread pulls its objects one by one with its own backend.
+        Chunk takes lock for each service settings, objects of the settings that
+        are locked by other chunk are skipped. Each object is also locked the same
+        way as by its pull task, so object is not pulled by both tasks simultaneously.
+    """
+    name = 'nodeconductor.structure.BackgroundChunkPullTask'
+
+    def get_settings_lock_key(self, list_task_name, settings_id):
+        return 'background_chunk_pull_lock_%s_%s' % (list_task_name, settings_id)
+
+    def run(self, list_task_name, pks_by_settings):
+        token = uuid()
+        locked_keys = []
+        try:
+            pks = []
+            for settings_id, settings_pks in pks_by_settings.items():
+                lock_key = self.get_settings_lock_key(list_task_name, settings_id)
+                if not cache.add(lock_key, token, self.LOCK_TIMEOUT):
+                    logger.info('Objects of service settings %s are not pulled by %s, '
+                                'because they are pulled by other task.', settings_id, list_task_name)
+                    continue
+                locked_keys.append(lock_key)
+                pks.extend(settings_pks)
+            self._pull_chunk(list_task_name, pks, token)
+        finally:
+            for lock_key in locked_keys:
+                # Lock could expire and be taken by the next task, it should not be released.
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+
+    def _pull_chunk(self, list_task_name, pks, token):
+        list_task = self.app.tasks[list_task_name]
+        pull_task = list_task.pull_task()
+
+        instances_by_settings = collections.defaultdict(list)
+        for instance in list_task.get_chunk_objects(pks):
+            instances_by_settings[list_task.get_settings(instance).pk].append(instance)
+
+        # Backend client may be not thread-safe, so it is shared by objects of one thread only.
+        units = []
+        for instances in instances_by_settings.values():
+            workers = min(list_task.max_settings_workers, len(instances))
+            for index in range(workers):
+                unit_instances = instances[index::workers]
+                units.append((unit_instances, self._get_backend(list_task.get_settings(unit_instances[0]))))
+
+        def pull(unit):
+            instances, backend = unit
+            for instance in instances:
+                lock_key = pull_task.get_lock_key(core_utils.serialize_instance(instance))
+                if not cache.add(lock_key, token, pull_task.LOCK_TIMEOUT):
+                    logger.info('%s %s (PK: %s) is not pulled, because it is pulled by other task.',
+                                instance.__class__.__name__, instance, instance.pk)
+                    continue
+                try:
+                    pull_task.pull_instance(instance, backend)
+                except Exception:
+                    # Unexpected error should not stop pull of other objects.
+                    logger.exception('Failed to pull %s %s (PK: %s).',
+                                     instance.__class__.__name__, instance, instance.pk)
+                finally:
+                    if cache.get(lock_key) == token:
+                        cache.delete(lock_key)
+
+        workers = min(list_task.max_workers, len(units))
+        if workers <= 1:
+            map(pull, units)
+            return
+
+        def pull_in_thread(unit):
+            try:
+                pull(unit)
+            finally:
+                # Each thread uses its own database connection.
+                connection.close()
+
+        pool = ThreadPool(workers)
+        try:
+            pool.map(pull_in_thread, units)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _get_backend(self, settings):
+        try:
+            return settings.get_backend()
+        except ServiceBackendError as e:
+            # Each object creates its own backend and fails separately.
+            logger.warning('Cannot create backend for service settings %s. Error: %s', settings, e)
+            return None
 
 
 class ServiceSettingsBackgroundPullTask(BackgroundPullTask):
 
     def pull(self, service_settings):
-        backend = service_settings.get_backend()
+        backend = self.get_backend(service_settings)
         backend.sync()
 
 
@@ -148,6 +297,7 @@ class ServiceSettingsListPullTask(BackgroundListPullTask):
     name = 'nodeconductor.structure.ServiceSettingsListPullTask'
     model = models.ServiceSettings
     pull_task = ServiceSettingsBackgroundPullTask
+    settings_field = None
 
     def get_pulled_objects(self):
         States = self.model.States
@@ -1,16 +1,18 @@
 from __future__ import unicode_literals
 
 from ddt import data, ddt
-from mock import call
+from mock import call, patch, Mock
 
 from django.core.urlresolvers import reverse
 from django.test import TransactionTestCase
+from django.utils import timezone
 from mock_django import mock_signal_receiver
 from rest_framework import status, test
 
-from nodeconductor.structure import signals, models
+from nodeconductor.logging.tests import factories as logging_factories
+from nodeconductor.structure import signals, models, views
 from nodeconductor.structure.models import CustomerRole, Project, ProjectRole
-from nodeconductor.structure.tests import factories, fixtures
+from nodeconductor.structure.tests import factories, fixtures, models as test_models
 
 
 class ProjectTest(TransactionTestCase):
@@ -467,6 +469,66 @@ class ProjectCountersListTest(test.APITransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, {'users': 2, 'apps': 0, 'vms': 1})
 
+    def test_opened_alerts_of_project_and_its_resources_are_counted(self):
+        logging_factories.AlertFactory(scope=self.project)
+        logging_factories.AlertFactory(scope=self.resource)
+        logging_factories.AlertFactory(scope=self.resource, closed=timezone.now())
+        logging_factories.AlertFactory(scope=factories.ProjectFactory())
+
+        self.client.force_authenticate(self.fixture.owner)
+        response = self.client.get(self.url, {'fields': ['alerts']})
+
+        self.assertEqual(response.data, {'alerts': 2})
+
+    def test_counters_are_cached(self):
+        self.client.force_authenticate(self.fixture.owner)
+        self.client.get(self.url)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.data['vms'], 1)
+
+    def test_cached_counters_are_invalidated_when_resource_is_created(self):
+        self.client.force_authenticate(self.fixture.owner)
+        self.client.get(self.url, {'fields': ['vms']})
+
+        factories.TestNewInstanceFactory(service_project_link=self.fixture.service_project_link)
+        response = self.client.get(self.url, {'fields': ['vms']})
+
+        self.assertEqual(response.data, {'vms': 2})
+
+    def test_extension_can_register_counter(self):
+        self.project.certifications.add(factories.ServiceCertificationFactory())
+        views.ProjectCountersView.register_counter('certifications', lambda view: view.object.certifications.all())
+        self.addCleanup(views.ProjectCountersView._extra_counters.pop, 'certifications')
+
+        self.client.force_authenticate(self.fixture.owner)
+        response = self.client.get(self.url, {'fields': ['certifications', 'users']})
+
+        self.assertEqual(response.data, {'certifications': 1, 'users': 2})
+
+    def test_premium_support_contracts_are_counted_if_extension_is_installed(self):
+        other_project = factories.ProjectFactory(customer=self.fixture.customer)
+        factories.TestServiceProjectLinkFactory(service=self.fixture.service, project=other_project)
+        app_config = Mock()
+        # Project link stands in for contract model of premium support extension.
+        app_config.get_model.return_value = test_models.TestServiceProjectLink
+        self.client.force_authenticate(self.fixture.owner)
+
+        with patch('nodeconductor.structure.views.apps.get_containing_app_config', return_value=app_config):
+            response = self.client.get(self.url, {'fields': ['premium_support_contracts']})
+
+        app_config.get_model.assert_called_once_with('Contract')
+        self.assertEqual(response.data, {'premium_support_contracts': 1})
+
+    def test_premium_support_contracts_are_not_counted_if_extension_is_not_installed(self):
+        self.client.force_authenticate(self.fixture.owner)
+
+        response = self.client.get(self.url)
+
+        self.assertNotIn('premium_support_contracts', response.data)
+
 
 @ddt
 class ProjectUpdateCertificationTest(test.APITransactionTestCase):
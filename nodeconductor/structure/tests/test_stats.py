@@ -3,6 +3,8 @@ from __future__ import unicode_literals
 from datetime import timedelta
 
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from rest_framework import test, status
 
@@ -114,6 +116,20 @@ class StatsQuotaTimelineTest(BaseQuotaAggregationTest):
         self.assertEqual(110, response.data[0]['vcpu_limit'])
         self.assertEqual(12, response.data[0]['vcpu_usage'])
 
+    def test_number_of_queries_does_not_depend_on_number_of_links(self):
+        self.create_links(limit1=10, usage1=2, limit2=100, usage2=10)
+        self.get_response()
+        with CaptureQueriesContext(connection) as context:
+            self.get_response()
+        queries_count = len(context.captured_queries)
+
+        self.create_links(limit1=10, usage1=2, limit2=100, usage2=10)
+        with self.assertNumQueries(queries_count):
+            response = self.get_response()
+
+        self.assertEqual(220, response.data[0]['vcpu_limit'])
+        self.assertEqual(24, response.data[0]['vcpu_usage'])
+
     def get_response(self):
         response = self.client.get(reverse('stats_quota_timeline'), data={
             'aggregate': 'project',
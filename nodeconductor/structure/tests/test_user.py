@@ -2,12 +2,14 @@ from __future__ import unicode_literals
 
 import unittest
 
+from django.core.urlresolvers import reverse
 from django.utils import timezone
 from freezegun import freeze_time
 from rest_framework import status
 from rest_framework import test
 
 from nodeconductor.core.models import User
+from nodeconductor.logging.tests import factories as logging_factories
 from nodeconductor.structure.models import CustomerRole
 from nodeconductor.structure.serializers import PasswordSerializer
 from nodeconductor.structure.tests import factories
@@ -700,3 +702,23 @@ class UserUpdateTest(test.APITransactionTestCase):
         response = self.client.put(self.url, self.valid_payload)
         self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('token_lifetime', response.data)
+
+
+class UserCountersTest(test.APITransactionTestCase):
+
+    def setUp(self):
+        self.user = factories.UserFactory()
+        factories.SshPublicKeyFactory(user=self.user)
+        factories.SshPublicKeyFactory()
+        logging_factories.WebHookFactory(user=self.user)
+        logging_factories.PushHookFactory(user=self.user)
+        logging_factories.WebHookFactory(user=factories.UserFactory())
+
+    def test_user_counters_include_only_own_keys_and_hooks(self):
+        self.client.force_authenticate(self.user)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('user_counters'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'keys': 1, 'hooks': 2})
@@ -0,0 +1,50 @@
+from django.test import TestCase
+
+from nodeconductor.structure import models
+from nodeconductor.structure.managers import filter_queryset_for_user, get_permission_index
+from nodeconductor.structure.tests import factories, fixtures
+from nodeconductor.structure.tests import models as test_models
+
+
+class FilterQuerysetForUserTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ServiceFixture()
+        self.resource = self.fixture.resource
+        factories.TestNewInstanceFactory()
+
+    def get_resources(self, user):
+        return filter_queryset_for_user(test_models.TestNewInstance.objects.all(), user)
+
+    def test_owner_can_see_customer_resources(self):
+        self.assertEqual(list(self.get_resources(self.fixture.owner)), [self.resource])
+
+    def test_admin_can_see_project_resources(self):
+        self.assertEqual(list(self.get_resources(self.fixture.admin)), [self.resource])
+
+    def test_user_without_permissions_can_not_see_resources(self):
+        self.assertFalse(self.get_resources(self.fixture.user).exists())
+
+    def test_user_can_see_customer_with_permission_in_its_project(self):
+        customers = filter_queryset_for_user(models.Customer.objects.all(), self.fixture.admin)
+        self.assertEqual(list(customers), [self.fixture.customer])
+
+    def test_query_does_not_use_distinct(self):
+        self.assertNotIn('DISTINCT', str(self.get_resources(self.fixture.owner).query))
+
+    def test_permission_index_is_updated_when_role_is_granted(self):
+        user = self.fixture.user
+        self.assertFalse(self.get_resources(user).exists())
+
+        self.fixture.project.add_user(user, models.ProjectRole.MANAGER)
+
+        self.assertEqual(list(self.get_resources(user)), [self.resource])
+
+    def test_permission_index_is_updated_when_role_is_revoked(self):
+        owner = self.fixture.owner
+        self.assertTrue(self.get_resources(owner).exists())
+
+        self.fixture.customer.remove_user(owner, models.CustomerRole.OWNER)
+
+        self.assertFalse(self.get_resources(owner).exists())
+        self.assertEqual(get_permission_index(owner), {'customer': [], 'project': []})
@@ -1,4 +1,5 @@
 from ddt import ddt, data
+from django.core.cache import cache
 from django.test import TestCase
 from mock import patch, Mock
 
@@ -62,3 +63,116 @@ class ThrottleProvisionTaskTest(TestCase):
             'create',
             state_transition='begin_starting').apply()
         self.assertEqual(mocked_retry.called, params['retried'])
+
+
+class TestInstancePullTask(tasks.BackgroundPullTask):
+    backends = []
+
+    def pull(self, instance):
+        self.backends.append((instance.pk, self.get_backend(instance)))
+
+
+class TestInstanceListPullTask(tasks.BackgroundListPullTask):
+    name = 'nodeconductor.structure.tests.TestInstanceListPullTask'
+    model = models.TestNewInstance
+    pull_task = TestInstancePullTask
+    chunk_size = 3
+
+
+class BackgroundListPullTaskTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        TestInstancePullTask.backends = []
+        self.links = factories.TestServiceProjectLinkFactory.create_batch(2)
+        self.instances = [
+            factories.TestNewInstanceFactory(
+                service_project_link=link, state=models.TestNewInstance.States.OK, backend_id='backend_id')
+            for link in self.links for _ in range(2)
+        ]
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_settings_id(self, instance):
+        return instance.service_project_link.service.settings_id
+
+    def get_pks_by_settings(self):
+        pks_by_settings = {}
+        for instance in self.instances:
+            pks_by_settings.setdefault(str(self.get_settings_id(instance)), []).append(instance.pk)
+        return pks_by_settings
+
+    @patch('nodeconductor.structure.tasks.BackgroundChunkPullTask.delay')
+    def test_objects_of_the_same_settings_are_pulled_by_one_chunk(self, mocked_delay):
+        TestInstanceListPullTask().run()
+
+        chunks = [call[0][1] for call in mocked_delay.call_args_list]
+        self.assertEqual(chunks, [
+            {str(self.get_settings_id(self.instances[0])): [self.instances[0].pk, self.instances[1].pk]},
+            {str(self.get_settings_id(self.instances[2])): [self.instances[2].pk, self.instances[3].pk]},
+        ])
+
+    @patch.object(TestInstanceListPullTask, 'max_settings_workers', 1)
+    def test_objects_of_the_same_settings_share_backend(self):
+        tasks.BackgroundChunkPullTask().run(TestInstanceListPullTask.name, self.get_pks_by_settings())
+
+        backends = dict(TestInstancePullTask.backends)
+        self.assertEqual(sorted(backends), sorted(instance.pk for instance in self.instances))
+        self.assertIs(backends[self.instances[0].pk], backends[self.instances[1].pk])
+        self.assertIsNot(backends[self.instances[0].pk], backends[self.instances[2].pk])
+
+    def test_backend_is_not_shared_between_threads(self):
+        tasks.BackgroundChunkPullTask().run(TestInstanceListPullTask.name, self.get_pks_by_settings())
+
+        backends = dict(TestInstancePullTask.backends)
+        self.assertEqual(sorted(backends), sorted(instance.pk for instance in self.instances))
+        self.assertIsNot(backends[self.instances[0].pk], backends[self.instances[1].pk])
+
+    def test_objects_of_settings_locked_by_other_chunk_are_not_pulled(self):
+        task = tasks.BackgroundChunkPullTask()
+        locked_settings_id = self.get_settings_id(self.instances[0])
+        lock_key = task.get_settings_lock_key(TestInstanceListPullTask.name, str(locked_settings_id))
+        cache.add(lock_key, 'other-task-id')
+
+        task.run(TestInstanceListPullTask.name, self.get_pks_by_settings())
+
+        pulled = sorted(pk for pk, _ in TestInstancePullTask.backends)
+        self.assertEqual(pulled, sorted([self.instances[2].pk, self.instances[3].pk]))
+        self.assertEqual(cache.get(lock_key), 'other-task-id')
+
+    def test_settings_locks_are_released_after_pull(self):
+        task = tasks.BackgroundChunkPullTask()
+
+        task.run(TestInstanceListPullTask.name, self.get_pks_by_settings())
+
+        for instance in self.instances:
+            lock_key = task.get_settings_lock_key(TestInstanceListPullTask.name, str(self.get_settings_id(instance)))
+            self.assertIsNone(cache.get(lock_key))
+
+    def test_object_locked_by_its_pull_task_is_not_pulled(self):
+        lock_key = TestInstancePullTask().get_lock_key(utils.serialize_instance(self.instances[0]))
+        cache.add(lock_key, 'other-task-id')
+
+        tasks.BackgroundChunkPullTask().run(TestInstanceListPullTask.name, self.get_pks_by_settings())
+
+        pulled = sorted(pk for pk, _ in TestInstancePullTask.backends)
+        self.assertEqual(pulled, sorted(instance.pk for instance in self.instances[1:]))
+        self.assertEqual(cache.get(lock_key), 'other-task-id')
+
+    def test_object_locks_are_released_after_pull(self):
+        tasks.BackgroundChunkPullTask().run(TestInstanceListPullTask.name, self.get_pks_by_settings())
+
+        for instance in self.instances:
+            lock_key = TestInstancePullTask().get_lock_key(utils.serialize_instance(instance))
+            self.assertIsNone(cache.get(lock_key))
+
+    @patch('nodeconductor.structure.tasks.BackgroundChunkPullTask.delay')
+    def test_service_settings_are_pulled_by_single_chunk(self, mocked_delay):
+        settings = [self.get_settings_id(instance) for instance in self.instances[::2]]
+
+        tasks.ServiceSettingsListPullTask().run()
+
+        self.assertEqual(mocked_delay.call_count, 1)
+        pks_by_settings = mocked_delay.call_args[0][1]
+        self.assertTrue(set(map(str, settings)) <= set(pks_by_settings))
@@ -3,14 +3,15 @@ from __future__ import unicode_literals
 import functools
 import time
 import logging
-from collections import defaultdict
 
 from datetime import timedelta
 
+from django.apps import apps
 from django.conf import settings as django_settings
 from django.contrib import auth
+from django.contrib.contenttypes.models import ContentType
 from django.db import transaction, IntegrityError
-from django.db.models import Q
+from django.db.models import Q, QuerySet
 from django.http import Http404
 from django.utils import six, timezone
 from django.utils.functional import cached_property
@@ -29,14 +30,16 @@ from rest_framework import generics
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.exceptions import PermissionDenied, MethodNotAllowed, NotFound, APIException, ValidationError
 from rest_framework.response import Response
-from reversion import revisions as reversion
 
 from nodeconductor.core import (
     filters as core_filters, mixins as core_mixins, models as core_models, exceptions as core_exceptions,
     serializers as core_serializers, views as core_views, validators as core_validators)
-from nodeconductor.core.utils import request_api, datetime_to_timestamp, sort_dict
+from nodeconductor.core.managers import SummaryQuerySet
+from nodeconductor.core.utils import datetime_to_timestamp, sort_dict
+from nodeconductor.logging.loggers import expand_alert_groups
+from nodeconductor.logging.models import Alert, BaseHook
 from nodeconductor.monitoring.filters import SlaFilter, MonitoringItemFilter
-from nodeconductor.quotas.models import QuotaModelMixin, Quota
+from nodeconductor.quotas.models import QuotaModelMixin, Quota, get_quotas_history
 from nodeconductor.structure import (
     SupportedServices, ServiceBackendError, ServiceBackendNotImplemented, filters, permissions, models, serializers,
     managers)
@@ -1262,8 +1265,8 @@ class ResourceSummaryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
             }
         """
         queryset = self.filter_queryset(self.get_queryset())
-        return Response({SupportedServices.get_name_for_model(qs.model): qs.count()
-                         for qs in queryset.querysets})
+        return Response({SupportedServices.get_name_for_model(qs.model): count
+                         for qs, count in zip(queryset.querysets, queryset.get_counts())})
 
 
 class ServicesViewSet(mixins.ListModelMixin,
@@ -1301,17 +1304,84 @@ class ServicesViewSet(mixins.ListModelMixin,
 
 
 class BaseCounterView(viewsets.GenericViewSet):
+    """ Count entities related to object.
+
+        Counter returns number, queryset or list of querysets. Querysets of all
+        requested counters are counted by single query. Extensions could add
+        their own counters using register_counter method.
+
+        Result is cached per scope, user permissions and request parameters.
+        Cache is invalidated on creation and deletion of counted objects,
+        changes that are not tracked are visible after cache timeout.
+    """
     # Fix for schema generation
     queryset = []
 
     def list(self, request, uuid=None):
+        fields = sorted(set(request.query_params.getlist('fields') or self.get_all_fields().keys()))
+        context = (
+            self.__class__.__name__,
+            fields,
+            sorted(request.query_params.getlist('exclude_features')),
+            self.get_permission_context(),
+        )
+        result = managers.get_cached_counters(self.get_counters_scope(), context, lambda: self.count(fields))
+        return Response(result)
+
+    def count(self, fields):
         result = {}
-        fields = request.query_params.getlist('fields') or self.get_fields().keys()
-        for field, func in self.get_fields().items():
-            if field in fields:
-                result[field] = func()
+        counters_querysets = {}
+        for field, func in self.get_all_fields().items():
+            if field not in fields:
+                continue
+            value = func()
+            if isinstance(value, QuerySet):
+                counters_querysets[field] = [value]
+            elif isinstance(value, (list, tuple)):
+                counters_querysets[field] = value
+            else:
+                result[field] = value
 
-        return Response(result)
+        summary_queryset = SummaryQuerySet([])
+        summary_queryset.querysets = sum(counters_querysets.values(), [])
+        counts = iter(summary_queryset.get_counts())
+        for field, querysets in counters_querysets.items():
+            result[field] = sum(next(counts) for _ in querysets)
+        return result
+
+    def get_counters_scope(self):
+        """ Counters are cached until objects related to this scope are changed """
+        return self.object
+
+    def get_permission_context(self):
+        user = self.request.user
+        if user.is_staff or user.is_support:
+            return 'staff'
+        permission_index = managers.get_permission_index(user)
+        return sorted(permission_index['customer']), sorted(permission_index['project'])
+
+    @classmethod
+    def register_counter(cls, name, func):
+        """ Add counter to the view. Function receives view instance and returns counter value.
+
+            Example:
+
+            .. code-block:: python
+
+                ProjectCountersView.register_counter(
+                    'premium_support_contracts',
+                    lambda view: models.Contract.objects.filter(project=view.object))
+        """
+        if '_extra_counters' not in cls.__dict__:
+            cls._extra_counters = {}
+        cls._extra_counters[name] = func
+
+    def get_all_fields(self):
+        fields = self.get_fields()
+        for klass in reversed(self.__class__.__mro__):
+            for name, func in klass.__dict__.get('_extra_counters', {}).items():
+                fields[name] = functools.partial(func, self)
+        return fields
 
     def get_fields(self):
         raise NotImplementedError()
@@ -1320,13 +1390,18 @@ class BaseCounterView(viewsets.GenericViewSet):
     def object(self):
         return self.get_object()
 
-    def get_count(self, url, params=None):
-        response = request_api(self.request, url, method='HEAD', params=params)
-        if response.ok:
-            return response.total
-        else:
-            logger.warning('Unable to execute API request with URL %s and error %s', url, response.reason)
-        return 0
+    def get_alerts(self):
+        serializer = serializers.AggregateSerializer(data={
+            'aggregate': self.aggregate,
+            'uuid': self.object.uuid.hex,
+        })
+        serializer.is_valid(raise_exception=True)
+        query = filters.AggregateFilter.get_aggregate_query(serializer, self.request.user)
+        alerts = Alert.objects.filter(closed__isnull=True).filter(query)
+        features = self.request.query_params.getlist('exclude_features')
+        if features:
+            alerts = alerts.exclude(alert_type__in=expand_alert_groups(features))
+        return alerts
 
 
 class CustomerCountersView(BaseCounterView):
@@ -1343,6 +1418,7 @@ class CustomerCountersView(BaseCounterView):
         }
     """
     lookup_field = 'uuid'
+    aggregate = 'customer'
 
     def get_queryset(self):
         return filter_queryset_for_user(models.Customer.objects.all().only('pk', 'uuid'), self.request.user)
@@ -1356,30 +1432,18 @@ class CustomerCountersView(BaseCounterView):
         }
 
     def get_users(self):
-        return self.object.get_users().count()
-
-    def get_alerts(self):
-        return self.get_count('alert-list', {
-            'aggregate': 'customer',
-            'uuid': self.object.uuid.hex,
-            'exclude_features': self.request.query_params.getlist('exclude_features'),
-            'opened': True
-        })
+        return self.object.get_users()
 
     def get_projects(self):
-        return self._count_model(models.Project)
+        return self._get_querysets([models.Project])
 
     def get_services(self):
         models = [item['service'] for item in SupportedServices.get_service_models().values()]
-        return self._total_count(models)
+        return self._get_querysets(models)
 
-    def _total_count(self, models):
-        return sum(self._count_model(model) for model in models)
-
-    def _count_model(self, model):
-        qs = model.objects.filter(customer=self.object).only('pk')
-        qs = filter_queryset_for_user(qs, self.request.user)
-        return qs.count()
+    def _get_querysets(self, models):
+        return [filter_queryset_for_user(model.objects.filter(customer=self.object), self.request.user)
+                for model in models]
 
 
 class ProjectCountersView(BaseCounterView):
@@ -1395,10 +1459,11 @@ class ProjectCountersView(BaseCounterView):
             "vms": 1,
             "private_clouds": 1,
             "storages": 2,
-            "premium_support_contracts": 0,
+            "premium_support_contracts": 0
         }
     """
     lookup_field = 'uuid'
+    aggregate = 'project'
 
     def get_queryset(self):
         return filter_queryset_for_user(models.Project.objects.all().only('pk', 'uuid'), self.request.user)
@@ -1412,45 +1477,35 @@ class ProjectCountersView(BaseCounterView):
             'storages': self.get_storages,
             'users': self.get_users
         }
-        if 'nodeconductor_plus.premium_support' in django_settings.INSTALLED_APPS:
+        if self._get_premium_support_config() is not None:
             fields['premium_support_contracts'] = self.get_premium_support_contracts
         return fields
 
-    def get_alerts(self):
-        return self.get_count('alert-list', {
-            'aggregate': 'project',
-            'uuid': self.object.uuid.hex,
-            'exclude_features': self.request.query_params.getlist('exclude_features'),
-            'opened': True
-        })
-
     def get_vms(self):
-        return self._total_count(models.VirtualMachineMixin.get_all_models())
+        return self._get_querysets(models.VirtualMachineMixin.get_all_models())
 
     def get_apps(self):
-        return self._total_count(models.ApplicationMixin.get_all_models())
+        return self._get_querysets(models.ApplicationMixin.get_all_models())
 
     def get_private_clouds(self):
-        return self._total_count(models.PrivateCloud.get_all_models())
+        return self._get_querysets(models.PrivateCloud.get_all_models())
 
     def get_storages(self):
-        return self._total_count(models.Storage.get_all_models())
+        return self._get_querysets(models.Storage.get_all_models())
 
     def get_users(self):
-        return self.object.get_users().count()
+        return self.object.get_users()
 
     def get_premium_support_contracts(self):
-        return self.get_count('premium-support-contract-list', {
-            'project_uuid': self.object.uuid.hex
-        })
+        contract_model = self._get_premium_support_config().get_model('Contract')
+        return filter_queryset_for_user(contract_model.objects.filter(project=self.object), self.request.user)
 
-    def _total_count(self, models):
-        return sum(self._count_model(model) for model in models)
+    def _get_premium_support_config(self):
+        return apps.get_containing_app_config('nodeconductor_plus.premium_support')
 
-    def _count_model(self, model):
-        qs = model.objects.filter(project=self.object).only('pk')
-        qs = filter_queryset_for_user(qs, self.request.user)
-        return qs.count()
+    def _get_querysets(self, models):
+        return [filter_queryset_for_user(model.objects.filter(project=self.object), self.request.user)
+                for model in models]
 
 
 class UserCountersView(BaseCounterView):
@@ -1471,13 +1526,20 @@ class UserCountersView(BaseCounterView):
             'hooks': self.get_hooks
         }
 
+    def get_counters_scope(self):
+        return self.request.user
+
+    def get_permission_context(self):
+        return self.request.user.is_staff or self.request.user.is_support
+
     def get_keys(self):
-        return self.get_count('sshpublickey-list', {
-            'user_uuid': self.request.user.uuid.hex
-        })
+        return core_models.SshPublicKey.objects.filter(user=self.request.user)
 
     def get_hooks(self):
-        return self.get_count('hooks-list')
+        querysets = [model.objects.all() for model in BaseHook.get_all_models()]
+        if self.request.user.is_staff or self.request.user.is_support:
+            return querysets
+        return [queryset.filter(user=self.request.user) for queryset in querysets]
 
 
 class UpdateOnlyByPaidCustomerMixin(object):
@@ -1966,32 +2028,33 @@ class QuotaTimelineStatsView(views.APIView):
     """
 
     def get(self, request, format=None):
-        scopes = self.get_quota_scopes(request)
         ranges = self.get_ranges(request)
         items = request.query_params.getlist('item') or self.get_all_spls_quotas()
+        quotas = self.get_quotas(request, items)
 
-        collector = QuotaTimelineCollector()
-        for item in items:
-            for scope in scopes:
-                values = self.get_stats_for_scope(item, scope, ranges)
-                for (end, start), (limit, usage) in zip(ranges, values):
-                    collector.add_quota(start, end, item, limit, usage)
+        collector = QuotaTimelineCollector([(start, end) for end, start in ranges], items)
+        history = get_quotas_history(quotas, [end for end, start in ranges])
+        for quota_id, item in quotas.values_list('pk', 'name'):
+            if quota_id in history:
+                collector.add_quota_history(item, history[quota_id])
 
         stats = map(sort_dict, collector.to_dict())[::-1]
         return Response(stats, status=status.HTTP_200_OK)
 
-    def get_quota_scopes(self, request):
+    def get_quotas(self, request, items):
+        """ Get quotas with given names of all SPLs visible for aggregate """
         serializer = serializers.AggregateSerializer(data=request.query_params)
         serializer.is_valid(raise_exception=True)
-        scopes = sum([list(qs) for qs in serializer.get_service_project_links(request.user)], [])
-        # XXX: quick and dirty hack for OpenStack: use tenants instead of SPLs as quotas scope.
-        new_scopes = []
-        for index, scope in enumerate(scopes):
-            if scope.service.settings.type == 'OpenStack':
-                new_scopes += list(scope.tenants.all())
-            else:
-                new_scopes.append(scope)
-        return new_scopes
+        query = Q()
+        for scopes in serializer.get_service_project_links(request.user):
+            # XXX: quick and dirty hack for OpenStack: use tenants instead of SPLs as quotas scope.
+            if scopes.model.__name__ == 'OpenStackServiceProjectLink':
+                spl_field = scopes.model.tenants.rel.field
+                scopes = spl_field.model.objects.filter(**{spl_field.name + '__in': scopes})
+            query |= Q(content_type=ContentType.objects.get_for_model(scopes.model), object_id__in=scopes.values('pk'))
+        if not query:
+            return Quota.objects.none()
+        return Quota.objects.all().filter(query, name__in=items)
 
     def get_all_spls_quotas(self):
         # XXX: quick and dirty hack for OpenStack: use tenants instead of SPLs as quotas scope.
@@ -1999,29 +2062,6 @@ class QuotaTimelineStatsView(views.APIView):
                       for m in models.ServiceProjectLink.get_all_models()]
         return sum([spl_model.get_quotas_names() for spl_model in spl_models], [])
 
-    def get_stats_for_scope(self, quota_name, scope, dates):
-        stats_data = []
-        try:
-            quota = scope.quotas.get(name=quota_name)
-        except Quota.DoesNotExist:
-            return stats_data
-        versions = reversion\
-            .get_for_object(quota)\
-            .select_related('revision')\
-            .filter(revision__date_created__lte=dates[0][0])\
-            .iterator()
-        version = None
-        for end, start in dates:
-            try:
-                while version is None or version.revision.date_created > end:
-                    version = versions.next()
-                stats_data.append((version.object_version.object.limit,
-                                   version.object_version.object.usage))
-            except StopIteration:
-                break
-
-        return stats_data
-
     def get_ranges(self, request):
         mapped = {
             'start_time': request.query_params.get('from'),
@@ -2058,33 +2098,45 @@ class QuotaTimelineCollector(object):
             }
         ]
     """
-    def __init__(self):
-        self.ranges = set()
-        self.items = set()
-        self.limits = defaultdict(int)
-        self.usages = defaultdict(int)
-
-    def add_quota(self, start, end, item, limit, usage):
-        key = (start, end, item)
-        if limit == -1 or self.limits[key] == -1:
-            self.limits[key] = -1
-        else:
-            self.limits[key] += limit
-        self.usages[key] += usage
-        self.ranges.add((start, end))
-        self.items.add(item)
+    def __init__(self, ranges, items):
+        self.ranges = ranges
+        self.items = set(items)
+        self.limits = {item: [0] * len(ranges) for item in self.items}
+        self.usages = {item: [0] * len(ranges) for item in self.items}
+        self.collected_ranges = [False] * len(ranges)
+        self.collected_items = set()
+
+    def add_quota_history(self, item, history):
+        """ Add quota (limit, usage) pairs aligned with ranges, None pair marks range without data.
+
+            Quota has no data for older ranges too once it is missing for some range.
+        """
+        limits, usages = self.limits[item], self.usages[item]
+        for index, values in enumerate(history):
+            if values is None:
+                break
+            limit, usage = values
+            if limit == -1 or limits[index] == -1:
+                limits[index] = -1
+            else:
+                limits[index] += limit
+            usages[index] += usage
+            self.collected_ranges[index] = True
+            self.collected_items.add(item)
 
     def to_dict(self):
         table = []
-        for start, end in sorted(self.ranges):
+        items = sorted(self.collected_items)
+        ranges = sorted((start, end, index) for index, (start, end) in enumerate(self.ranges)
+                        if self.collected_ranges[index])
+        for start, end, index in ranges:
             row = {
                 'from': datetime_to_timestamp(start),
                 'to': datetime_to_timestamp(end)
             }
-            for item in sorted(self.items):
-                key = (start, end, item)
-                row['%s_limit' % item] = self.limits[key]
-                row['%s_usage' % item] = self.usages[key]
+            for item in items:
+                row['%s_limit' % item] = self.limits[item][index]
+                row['%s_usage' % item] = self.usages[item][index]
             table.append(row)
         return table
 